@@ -0,0 +1 @@
+from .network import *
@@ -0,0 +1,13 @@
+import hardware
+
+async def init_network():
+    """
+        Setup network, and add NICs (Network Interface Controller) in global nics list.
+        This hardware is only used by the CPython device simulator (script/simulate_devices),
+        whose network module gives each simulated device its own loopback NIC.
+    """
+    hardware.nics = []
+
+    import network
+
+    hardware.nics.append(network.LAN())
@@ -0,0 +1,107 @@
+# Content hash of the app tree (/apps/<app_name>), sent in the beacon as versions.app_tree,
+# so that script/push_code skips the devices already running the app it pushes.
+# The shared libraries (LIBS_DIR) have theirs too, sent as versions.libs_tree (None without the directory).
+#
+# It is the same hash as the host deploy artifacts (see script/swarmlib/artifact.py): the sha256 of
+# "<path>\0<sha256 hex>\n" for each file, sorted by path, __pycache__ and dot files excluded.
+# The beacon service computes them at boot, and again once the services writing files called changed()
+# (files written otherwise, from the REPL for example, are only seen at the next boot).
+# The boot code staged by a network upgrade is checked with the same hash (see upgrade.py).
+
+import binascii
+import hashlib
+import os
+import uasyncio
+
+import board
+
+from . import settings
+
+tree_hash = None
+libs_hash = None
+# Incremented on each changed() report
+version = 0
+_changed = True
+
+def app_dir():
+    return "/apps/" + board.app_name
+
+def changed():
+    """
+        Report that files may have changed, the hashes are computed again by the next update()
+    """
+    global _changed, version
+    _changed = True
+    version += 1
+
+def is_changed():
+    """
+        Whether the next update() computes the hashes again
+    """
+    return _changed
+
+def _is_ignored(name):
+    return name == "__pycache__" or name.startswith(".")
+
+async def _file_sha256(path, buffer):
+    mv = memoryview(buffer)
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            h.update(mv[0:n])
+    # Let the other routines run between two files
+    await uasyncio.sleep_ms(0)
+    return binascii.hexlify(h.digest()).decode()
+
+async def _walk(directory, relative, files, buffer):
+    for entry in list(os.ilistdir(directory)):
+        if _is_ignored(entry[0]):
+            continue
+        path = relative + entry[0]
+        if entry[1] & 0x4000:
+            await _walk(directory + "/" + entry[0], path + "/", files, buffer)
+        else:
+            files.append((path, await _file_sha256(directory + "/" + entry[0], buffer)))
+
+async def dir_hash(directory):
+    """
+        The tree hash of a directory (OSError if it can not be read)
+    """
+    files = []
+    await _walk(directory, "", files, bytearray(512))
+    files.sort()
+    h = hashlib.sha256()
+    for (path, digest) in files:
+        h.update("{}\0{}\n".format(path, digest).encode())
+    return binascii.hexlify(h.digest()).decode()
+
+async def update():
+    """
+        Compute the hashes if the files changed since the last time. Returns True if a hash changed.
+    """
+    global tree_hash, libs_hash, _changed
+    if not _changed:
+        return False
+    _changed = False
+    previous = (tree_hash, libs_hash)
+    try:
+        tree_hash = await dir_hash(app_dir())
+    except OSError:
+        # No app, or its files changed while they were read: try again later
+        _changed = True
+        tree_hash = None
+    try:
+        os.stat(settings.LIBS_DIR)
+    except OSError:
+        # No shared libraries
+        libs_hash = None
+    else:
+        try:
+            libs_hash = await dir_hash(settings.LIBS_DIR)
+        except OSError:
+            _changed = True
+            libs_hash = None
+    return (tree_hash, libs_hash) != previous
@@ -12,6 +12,14 @@
 # cmd_port is the port number (default 21)
 # verbose_level controls the level of printed activity messages, values 0, 1, 2
 #
+# Directory listings are built from the os.ilistdir() entries (stat is only called for the
+# LIST details), and written in chunks of about _CHUNK_SIZE bytes. The chunks of the recent
+# listings are kept, up to _LIST_CACHE_SIZE bytes: a cached listing is invalidated by the
+# commands changing its directory (STOR, APPE, DELE, MKD, RMD, RNTO, SITE), and is only used
+# while the names, types and sizes of the entries are unchanged. All of them are forgotten
+# when another service reports written files (apptree.changed(), by the sync, delta and
+# multicast deploy services), as a file rewritten with the same size has another date.
+#
 # Copyright (c) 2016 Christopher Popp (initial ftp server framework)
 # Copyright (c) 2016 Paul Sokolovsky (background execution control structure)
 # Copyright (c) 2016 Robert Hammelrath (putting the pieces together and a
@@ -24,13 +32,26 @@
 import socket
 import hardware
 import os
-import gc
 import sys
 import errno
 from time import sleep_ms, localtime
 import uasyncio
 
+from . import apptree
+from . import gcpolicy
+from . import logring
+from . import metrics
+
 _CHUNK_SIZE = const(1024)
+_LIST_CACHE_SIZE = const(4096)
+
+_M_COMMANDS = metrics.counter("ftpd.commands")
+_M_FAILURES = metrics.counter("ftpd.failures")
+_M_BYTES_IN = metrics.counter("ftpd.bytes_in")
+_M_BYTES_OUT = metrics.counter("ftpd.bytes_out")
+_M_FILES_IN = metrics.counter("ftpd.files_in")
+_M_FILES_OUT = metrics.counter("ftpd.files_out")
+_M_LIST_CACHE_HITS = metrics.counter("ftpd.list_cache_hits")
 
 _month_name = ("", "Jan", "Feb", "Mar", "Apr", "May", "Jun",
                "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
@@ -96,6 +117,12 @@ class FTPServer:
         self._pasv_trigger = uasyncio.Event()
         self.client_busy = False
 
+        # {(path, full): (entries signature, listing chunks)}
+        self._list_cache = {}
+        self._list_cache_bytes = 0
+        # The apptree version the cached listings are up to date with
+        self._list_cache_version = apptree.version
+
     async def start(self):
         await self.log_msg(1, "FTP server started on {}:{}".format(self.local_addr, self.local_port))
         self.cmd_server  = await uasyncio.start_server(self.handle_commands_connection,  self.local_addr, self.local_port)
@@ -113,29 +140,113 @@ class FTPServer:
 
     async def send_list_data(self, path, writer, full):
         try:
-            for fname in os.listdir(path):
-                writer.write(self.make_description(path, fname, full))
-                await writer.drain()
+            signature = self.list_signature(path)
         except Exception as e:  # path may be a file name or pattern
             path, pattern = self.split_path(path)
             try:
-                for fname in os.listdir(path):
-                    if self.fncmp(fname, pattern):
-                        writer.write(self.make_description(path, fname, full))
-                        await writer.drain()
+                await self.send_list_chunks(path, writer, full, pattern)
             except:
                 pass
-
-    def make_description(self, path, fname, full):
+            return
+
+        if self._list_cache_version != apptree.version:
+            # Files were written by another service
+            for key in list(self._list_cache):
+                self.forget_listing(key)
+            self._list_cache_version = apptree.version
+
+        key = (path, full)
+        cached = self._list_cache.get(key)
+        if cached is not None and cached[0] == signature:
+            metrics.inc(_M_LIST_CACHE_HITS)
+            for chunk in cached[1]:
+                writer.write(chunk)
+                await writer.drain()
+            return
+
+        self.forget_listing(key)
+        chunks = await self.send_list_chunks(path, writer, full, None)
+        if chunks is not None:
+            size = sum(len(chunk) for chunk in chunks)
+            while self._list_cache and self._list_cache_bytes + size > _LIST_CACHE_SIZE:
+                self.forget_listing(next(iter(self._list_cache)))
+            self._list_cache[key] = (signature, chunks)
+            self._list_cache_bytes += size
+
+    async def send_list_chunks(self, path, writer, full, pattern):
+        """
+            Write the listing of the directory path (of its entries matching pattern, if not None),
+            in chunks. Returns the chunks, or None if they are too large to be cached.
+        """
+        chunks = []
+        lines = []
+        size = 0
+        year = localtime()[0]
+        for entry in os.ilistdir(path):
+            if pattern is not None and not self.fncmp(entry[0], pattern):
+                continue
+            line = self.make_description(path, entry, full, year).encode()
+            lines.append(line)
+            size += len(line)
+            if size >= _CHUNK_SIZE:
+                chunks = await self.write_list_chunk(writer, lines, chunks)
+                lines = []
+                size = 0
+        if lines:
+            chunks = await self.write_list_chunk(writer, lines, chunks)
+        return chunks
+
+    async def write_list_chunk(self, writer, lines, chunks):
+        chunk = b"".join(lines)
+        writer.write(chunk)
+        await writer.drain()
+        gcpolicy.touch()
+        if chunks is None or sum(len(c) for c in chunks) + len(chunk) > _LIST_CACHE_SIZE:
+            return None
+        chunks.append(chunk)
+        return chunks
+
+    def list_signature(self, path):
+        """
+            Hash of the names, types and sizes of the entries of the directory path (no stat needed)
+        """
+        signature = 0
+        for entry in os.ilistdir(path):
+            signature = (signature * 31 + hash(entry[0]) + entry[1] + (entry[3] if len(entry) > 3 else 0)) & 0x3fffffff
+        return signature
+
+    def forget_listing(self, key):
+        cached = self._list_cache.pop(key, None)
+        if cached is not None:
+            self._list_cache_bytes -= sum(len(chunk) for chunk in cached[1])
+
+    def invalidate_listings(self, path=None):
+        """
+            Forget the cached listings of the directory containing path, and of path and below
+            (a removed or renamed directory). All of them if path is None.
+            Called on each change of the files, which is also reported for the app tree hash.
+        """
+        up_to_date = self._list_cache_version == apptree.version
+        apptree.changed()
+        if up_to_date:
+            # This change is handled below: the cached listings of the other directories are kept
+            self._list_cache_version = apptree.version
+        parent = None if path is None else self.split_path(path)[0]
+        for key in list(self._list_cache):
+            if path is None or key[0] == parent or key[0] == path or key[0].startswith(path + "/"):
+                self.forget_listing(key)
+
+    def make_description(self, path, entry, full, year):
+        fname = entry[0]
         if full:
             stat = os.stat(self.get_absolute_path(path, fname))
             file_permissions = ("drwxr-xr-x"
-                                if (stat[0] & 0o170000 == 0o040000)
+                                if entry[1] & 0x4000
                                 else "-rw-r--r--")
             file_size = stat[6]
             tm = stat[7] & 0xffffffff
             tm = localtime(tm if tm < 0x80000000 else tm - 0x100000000)
-            if tm[0] != localtime()[0]:
+            if tm[0] != year:
                 description = "{} 1 owner group {:>10} {} {:2} {:>5} {}\r\n".\
                     format(file_permissions, file_size,
                         _month_name[tm[1]], tm[2], tm[0], fname)
@@ -155,7 +266,10 @@ class FTPServer:
             while bytes_read > 0:
                 writer.write(mv[0:bytes_read])
                 await writer.drain()
+                gcpolicy.touch()
+                metrics.inc(_M_BYTES_OUT, bytes_read)
                 bytes_read = file.readinto(buffer)
+        metrics.inc(_M_FILES_OUT)
 
     async def save_file_data(self, path, reader, mode):
         buffer = bytearray(_CHUNK_SIZE)
@@ -164,7 +278,10 @@ class FTPServer:
             bytes_read = await reader.readinto(buffer)
             while bytes_read > 0:
                 file.write(mv[0:bytes_read])
+                gcpolicy.touch()
+                metrics.inc(_M_BYTES_IN, bytes_read)
                 bytes_read = await reader.readinto(buffer)
+        metrics.inc(_M_FILES_IN)
 
     def get_absolute_path(self, cwd, payload):
         # Just a few special cases "..", "." and ""
@@ -239,9 +356,10 @@ class FTPServer:
     async def exec_ftp_commands(self):
         while True:
             try:
-                gc.collect()
+                gcpolicy.collect_if_needed()
 
                 data = (await self.reader.readline()).decode("utf-8").rstrip("\r\n")
+                gcpolicy.touch()
 
                 if len(data) <= 0:
                     # No data, close
@@ -255,6 +373,7 @@ class FTPServer:
                     await self.write("400 Device busy.\r\n")  # tell so the remote client
                     return  # and quit
                 self.client_busy = True  # now it's my turn
+                metrics.inc(_M_COMMANDS)
 
                 # check for log-in state may done here, like
                 # if self.logged_in == False and not command in\
@@ -347,6 +466,7 @@ class FTPServer:
                             await self.write("226 Done.\r\n")
                     except:
                         await self.write('550 Fail\r\n')
+                    self.invalidate_listings(path)
                 elif command == "SIZE":
                     try:
                         await self.write('213 {}\r\n'.format(os.stat(path)[6]))
@@ -373,6 +493,7 @@ class FTPServer:
                 elif command == "DELE":
                     try:
                         os.remove(path)
+                        self.invalidate_listings(path)
                         await self.write('250 OK\r\n')
                     except:
                         await self.write('550 Fail\r\n')
@@ -387,6 +508,8 @@ class FTPServer:
                 elif command == "RNTO":
                         try:
                             os.rename(self.fromname, path)
+                            self.invalidate_listings(self.fromname)
+                            self.invalidate_listings(path)
                             await self.write('250 OK\r\n')
                         except:
                             await self.write('550 Fail\r\n')
@@ -397,16 +520,19 @@ class FTPServer:
                 elif command == "RMD" or command == "XRMD":
                     try:
                         os.rmdir(path)
+                        self.invalidate_listings(path)
                         await self.write('250 OK\r\n')
                     except:
                         await self.write('550 Fail\r\n')
                 elif command == "MKD" or command == "XMKD":
                     try:
                         os.mkdir(path)
+                        self.invalidate_listings(path)
                         await self.write('250 OK\r\n')
                     except:
                         await self.write('550 Fail\r\n')
                 elif command == "SITE":
+                    self.invalidate_listings()
                     try:
                         exec(payload.replace('\0','\n'))
                         await self.write('250 OK\r\n')
@@ -420,7 +546,7 @@ class FTPServer:
             except OSError as err:
                 await self.log_msg(2, "Exception in exec_ftp_command:")
                 await self.log_exception(2, err)
-                if err.errno in (errno.ECONNABORTED, errno.ENOTCONN):
+                if err.errno in (errno.ECONNABORTED, errno.ENOTCONN, errno.ECONNRESET):
                     return
             # handle unexpected errors
             except Exception as err:
@@ -434,13 +560,15 @@ class FTPServer:
 
     async def log_msg(self, level, *args):
         if self.verbose_level >= level:
-            print(*args)
+            logring.log("ftpd", *args)
 
     async def log_exception(self, level, err):
         if self.verbose_level >= level:
-            sys.print_exception(err)
+            logring.log_exception("ftpd", err)
 
     async def write(self, data):
         await self.log_msg(4, data)
+        if data.startswith("5"):
+            metrics.inc(_M_FAILURES)
         self.writer.write(data)
         await self.writer.drain()
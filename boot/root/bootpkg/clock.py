@@ -0,0 +1,96 @@
+# Wall clock of the device, synchronized with the fleet time server by service_timesync
+#
+#   from bootpkg import clock
+#   clock.time_ms()         # unix time in milliseconds, None until the first sync
+#   clock.ticks_to_ms(t)    # unix time of a time.ticks_ms() value (log lines, for example)
+#
+# The clock is a reference pair (ticks_ms, unix ms) and a drift correction of the ticks, so reading it
+# does not depend on the RTC resolution. The RTC is set on each sync too, so that time.localtime()
+# and the files modification times follow.
+
+import machine
+import time
+
+# Unix time of the epoch of the time module: 2000-01-01 on most ports, 1970 on some
+EPOCH_OFFSET_S = 946684800 - time.mktime((2000, 1, 1, 0, 0, 0, 0, 0))
+
+# The reference is moved forward when older than this, so that ticks_diff() stays valid
+_REBASE_MS = 3600_000
+
+_ref_ticks = None
+_ref_ms = 0
+# Drift correction of the ticks, in parts per million (positive when the ticks are slow)
+drift_ppm = 0
+
+# Quality of the last sync: the offset corrected (ms), the round trip of the sample kept (ms), its ticks and server
+offset_ms = None
+rtt_ms = None
+synced_ticks = None
+server = None
+syncs = 0
+
+def is_synced():
+    return _ref_ticks is not None
+
+def ticks_to_ms(ticks):
+    """
+        Unix time in milliseconds of a time.ticks_ms() value, None if the clock was never synced
+    """
+    if _ref_ticks is None:
+        return None
+    elapsed = time.ticks_diff(ticks, _ref_ticks)
+    return _ref_ms + elapsed + elapsed * drift_ppm // 1000000
+
+def time_ms():
+    """
+        Unix time in milliseconds, None if the clock was never synced
+    """
+    global _ref_ticks, _ref_ms
+    if _ref_ticks is None:
+        return None
+    now = time.ticks_ms()
+    ms = ticks_to_ms(now)
+    if time.ticks_diff(now, _ref_ticks) > _REBASE_MS:
+        # Not synced for long (server gone): keep the ticks difference small
+        (_ref_ticks, _ref_ms) = (now, ms)
+    return ms
+
+def now_ms():
+    """
+        Unix time in milliseconds, from the RTC if the clock was never synced
+    """
+    ms = time_ms()
+    if ms is None:
+        ms = (time.time() + EPOCH_OFFSET_S) * 1000
+    return ms
+
+def set_rtc(ms):
+    tm = time.gmtime(ms // 1000 - EPOCH_OFFSET_S)
+    # (year, month, day, weekday, hours, minutes, seconds, subseconds)
+    machine.RTC().datetime((tm[0], tm[1], tm[2], tm[6], tm[3], tm[4], tm[5], ms % 1000 * 1000))
+
+def adjust(server_ms, ticks, rtt, source, step_ms, max_drift_ppm):
+    """
+        Discipline the clock with a sample: server_ms is the server time at the ticks_ms() value ticks,
+        known within +/- rtt / 2. Offsets up to step_ms also correct the drift (when larger than the sample
+        uncertainty, the millisecond resolution included), larger ones are only stepped.
+        Returns the offset corrected.
+    """
+    global _ref_ticks, _ref_ms, drift_ppm, offset_ms, rtt_ms, synced_ticks, server, syncs
+    predicted = ticks_to_ms(ticks)
+    if predicted is None:
+        # First sync: the offset of the RTC
+        offset = server_ms - now_ms()
+    else:
+        offset = server_ms - predicted
+    if predicted is not None and rtt / 2 + 1 < abs(offset) <= step_ms:
+        elapsed = time.ticks_diff(ticks, synced_ticks)
+        if elapsed >= 10000:
+            # Half of the frequency error seen since the last sync, so that one bad sample does not swing it
+            drift_ppm += offset * 1000000 // elapsed // 2
+            drift_ppm = max(-max_drift_ppm, min(max_drift_ppm, drift_ppm))
+    (_ref_ticks, _ref_ms) = (ticks, server_ms)
+    (offset_ms, rtt_ms, synced_ticks, server) = (offset, rtt, ticks, source)
+    syncs += 1
+    set_rtc(time_ms())
+    return offset
@@ -0,0 +1,105 @@
+# Central garbage collection policy
+#
+# A full collection costs tens of milliseconds on a loaded heap, so services must not
+# call gc.collect() on every request. Instead:
+#   - the VM collects by itself after GC_ALLOC_THRESHOLD bytes have been allocated (gc.threshold)
+#   - services call collect_if_needed(), which only collects when the free heap is below GC_MIN_FREE
+#   - services call touch() when they are busy, and a timer collects in the idle windows,
+#     when no activity was reported for GC_IDLE_MS
+
+import gc
+import time
+
+from . import metrics
+from . import settings
+
+_M_COLLECTIONS = metrics.counter("gc.collections")
+_M_COLLECT_MS = metrics.histogram("gc.collect_ms", (2, 5, 10, 20, 50, 100))
+_M_FREE = metrics.gauge("gc.free")
+_M_ALLOC = metrics.gauge("gc.alloc")
+
+collections = 0
+collect_ms_last = 0
+collect_ms_total = 0
+
+_last_activity = time.ticks_ms()
+_alloc_after_collect = 0
+
+def _update_gauges():
+    metrics.set_gauge(_M_FREE, gc.mem_free())
+    metrics.set_gauge(_M_ALLOC, gc.mem_alloc())
+
+def collect():
+    global collections, collect_ms_last, collect_ms_total, _alloc_after_collect
+
+    start = time.ticks_ms()
+    gc.collect()
+    collect_ms_last = time.ticks_diff(time.ticks_ms(), start)
+    collect_ms_total += collect_ms_last
+    collections += 1
+    _alloc_after_collect = gc.mem_alloc()
+    metrics.inc(_M_COLLECTIONS)
+    metrics.observe(_M_COLLECT_MS, collect_ms_last)
+    _update_gauges()
+
+def collect_if_needed():
+    """
+        Collect only if the free heap is low. Cheap enough to be called on every request.
+    """
+    if gc.mem_free() < settings.GC_MIN_FREE:
+        collect()
+        return True
+    return False
+
+def touch():
+    """
+        Report activity, to postpone the idle collection
+    """
+    global _last_activity
+    _last_activity = time.ticks_ms()
+
+def largest_free_block(granularity=16):
+    """
+        Size of the largest allocatable block, found by trial allocations (fragmentation probe).
+        Do not call it in a hot path.
+    """
+    low = 0
+    high = gc.mem_free()
+    while high - low > granularity:
+        size = (low + high) // 2
+        try:
+            block = bytearray(size)
+            del block
+            low = size
+        except MemoryError:
+            high = size
+    return low
+
+def stats(largest=False):
+    result = {
+        "free": gc.mem_free(),
+        "alloc": gc.mem_alloc(),
+        "collections": collections,
+        "collect_ms_last": collect_ms_last,
+        "collect_ms_total": collect_ms_total,
+    }
+    if largest:
+        result["largest_free_block"] = largest_free_block()
+    return result
+
+async def init_gc():
+    if settings.GC_ALLOC_THRESHOLD:
+        gc.threshold(settings.GC_ALLOC_THRESHOLD)
+    collect()
+
+def collect_idle():
+    idle_ms = time.ticks_diff(time.ticks_ms(), _last_activity)
+    if idle_ms >= settings.GC_IDLE_MS and gc.mem_alloc() - _alloc_after_collect >= settings.GC_IDLE_MIN_ALLOC:
+        collect()
+    else:
+        # Keep the heap gauges fresh for the metrics scrapes
+        _update_gauges()
+
+TIMERS = (
+    (collect_idle, settings.GC_IDLE_MS, 0),
+) if settings.GC_IDLE_MS else ()
@@ -0,0 +1,341 @@
+# Append-only key-value stores for the apps persistent state, in KVSTORE_DIR (see service_kvstore.py)
+#
+#   from bootpkg import kvstore
+#
+#   store = await kvstore.open("counters")
+#   boots = int(store.get("boots", b"0")) + 1
+#   store.put("boots", str(boots))
+#   store.delete("last_error")
+#   await store.flush()     # only to wait until the writes are on flash
+#
+# put() and delete() only update RAM: the kvstore service appends the pending writes to the store log
+# in one batch, KVSTORE_FLUSH_MS later at most (at once past KVSTORE_FLUSH_SIZE pending bytes), the last
+# value of a key only. Writes not flushed yet are lost on a reset.
+# Reads are served from the pending writes, a RAM cache of the values (KVSTORE_CACHE_SIZE bytes),
+# or with a single read of the log at the offset kept in the RAM index of the keys.
+#
+# The log is rewritten with the live records only (compaction) once it is KVSTORE_COMPACT_RATIO times
+# larger than them, so a byte stored is written at most RATIO / (RATIO - 1) times on average.
+#
+# Records: <B 0xa5, <B kind (1: put, 2: delete), <B key length, <I value length, <I crc32, key, value.
+# At open, the log is read until its first truncated or corrupted record (a reset during a write):
+# the log is then compacted, dropping it. A compaction writes a new log, removes the old one and
+# renames the new one: a log left alone under the new name is complete, and is used.
+
+import binascii
+import os
+import struct
+import uasyncio
+
+from . import metrics
+from . import settings
+
+_MAGIC = const(0xa5)
+_PUT = const(1)
+_DELETE = const(2)
+_HEADER_SIZE = const(11)
+
+_M_FLUSHES = metrics.counter("kvstore.flushes")
+_M_BYTES_WRITTEN = metrics.counter("kvstore.bytes_written")
+_M_COMPACTIONS = metrics.counter("kvstore.compactions")
+_M_RECOVERIES = metrics.counter("kvstore.recoveries")
+
+# The builtin, kvstore.open() opens a store
+_open_file = open
+
+# Open stores, by name
+stores = {}
+# Set when a store has pending writes, to wake the kvstore service
+flush_needed = uasyncio.Event()
+
+def _exists(path):
+    try:
+        os.stat(path)
+        return True
+    except OSError:
+        return False
+
+def _record(kind, key, value):
+    header = struct.pack("<BBBI", _MAGIC, kind, len(key), len(value))
+    crc = binascii.crc32(value, binascii.crc32(key, binascii.crc32(header)))
+    return header + struct.pack("<I", crc) + key + value
+
+def _as_bytes(value):
+    return value.encode() if isinstance(value, str) else bytes(value)
+
+class Store:
+    """
+        A key-value store, keys are str (up to 255 bytes) and values bytes
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.path = "{}/{}.log".format(settings.KVSTORE_DIR, name)
+        # {key: (value offset, value length, record size)} of the records in the log
+        self._index = {}
+        # {key: value, or None for a delete} not written yet
+        self._pending = {}
+        self._pending_bytes = 0
+        self._cache = {}
+        self._cache_bytes = 0
+        self._size = 0
+        self._live = 0
+        self._lock = uasyncio.Lock()
+        # Set when an append failed midway: the log must be compacted before the next one
+        self._torn = False
+        self.flushes = 0
+        self.compactions = 0
+        self.recovered = False
+
+    # Reads
+
+    def get(self, key, default=None):
+        if key in self._pending:
+            value = self._pending[key]
+            return default if value is None else value
+        value = self._cache.get(key)
+        if value is not None:
+            return value
+        entry = self._index.get(key)
+        if entry is None:
+            return default
+        with _open_file(self.path, "rb") as f:
+            f.seek(entry[0])
+            value = f.read(entry[1])
+        self._cache_value(key, value)
+        return value
+
+    def __contains__(self, key):
+        if key in self._pending:
+            return self._pending[key] is not None
+        return key in self._index
+
+    def keys(self):
+        keys = set(self._index)
+        for (key, value) in self._pending.items():
+            if value is None:
+                keys.discard(key)
+            else:
+                keys.add(key)
+        return keys
+
+    def __len__(self):
+        return len(self.keys())
+
+    def _cache_value(self, key, value):
+        if len(value) > settings.KVSTORE_CACHE_SIZE // 4:
+            return
+        while self._cache and self._cache_bytes + len(value) > settings.KVSTORE_CACHE_SIZE:
+            (evicted, evicted_value) = self._cache.popitem()
+            self._cache_bytes -= len(evicted_value)
+        self._cache[key] = value
+        self._cache_bytes += len(value)
+
+    def _forget_cached(self, key):
+        value = self._cache.pop(key, None)
+        if value is not None:
+            self._cache_bytes -= len(value)
+
+    # Writes
+
+    def _set_pending(self, key, value):
+        if len(key.encode()) > 255:
+            raise ValueError("key too long")
+        previous = self._pending.get(key)
+        if previous is not None:
+            self._pending_bytes -= len(previous)
+        elif key not in self._pending:
+            self._pending_bytes += _HEADER_SIZE + len(key)
+        self._pending[key] = value
+        if value is not None:
+            self._pending_bytes += len(value)
+        self._forget_cached(key)
+        flush_needed.set()
+
+    def put(self, key, value):
+        self._set_pending(key, _as_bytes(value))
+
+    def delete(self, key):
+        self._set_pending(key, None)
+
+    def is_dirty(self):
+        return bool(self._pending)
+
+    def needs_compaction(self):
+        return self._torn or (self._size >= settings.KVSTORE_COMPACT_MIN_SIZE and self._size > self._live * settings.KVSTORE_COMPACT_RATIO)
+
+    async def flush(self):
+        """
+            Append the pending writes to the log, and compact it if needed. Returns the bytes written.
+        """
+        async with self._lock:
+            written = 0
+            if self._torn:
+                written += await self._compact()
+            written += self._append()
+            if self.needs_compaction():
+                written += await self._compact()
+            return written
+
+    def _append(self):
+        if not self._pending:
+            return 0
+        (pending, self._pending, self._pending_bytes) = (self._pending, {}, 0)
+        batch = bytearray()
+        updates = []
+        for (key, value) in pending.items():
+            raw_key = key.encode()
+            if value is None:
+                if key not in self._index:
+                    continue
+                batch += _record(_DELETE, raw_key, b"")
+                updates.append((key, None, 0))
+            else:
+                updates.append((key, self._size + len(batch) + _HEADER_SIZE + len(raw_key), len(value)))
+                batch += _record(_PUT, raw_key, value)
+        if not batch:
+            return 0
+        try:
+            with _open_file(self.path, "ab") as f:
+                f.write(batch)
+        except OSError:
+            # Filesystem full, for example: keep the writes pending, unless newer ones replaced them.
+            # Part of the batch may have been written, the index still only points before it.
+            self._torn = _exists(self.path)
+            for (key, value) in pending.items():
+                if key not in self._pending:
+                    self._set_pending(key, value)
+            raise
+        for (key, offset, length) in updates:
+            self._drop(key)
+            if offset is not None:
+                record_size = _HEADER_SIZE + len(key.encode()) + length
+                self._index[key] = (offset, length, record_size)
+                self._live += record_size
+        self._size += len(batch)
+        self.flushes += 1
+        metrics.inc(_M_FLUSHES)
+        metrics.inc(_M_BYTES_WRITTEN, len(batch))
+        return len(batch)
+
+    def _drop(self, key):
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            self._live -= entry[2]
+
+    async def _compact(self):
+        """
+            Write the live records in a new log, which replaces the current one
+        """
+        tmp_path = self.path + ".new"
+        index = {}
+        size = 0
+        try:
+            with _open_file(self.path, "rb") as old, _open_file(tmp_path, "wb") as new:
+                for (key, (offset, length, record_size)) in self._index.items():
+                    old.seek(offset)
+                    raw_key = key.encode()
+                    new.write(_record(_PUT, raw_key, old.read(length)))
+                    index[key] = (size + _HEADER_SIZE + len(raw_key), length, record_size)
+                    size += record_size
+                    # Let the other routines run between two records
+                    await uasyncio.sleep_ms(0)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        os.remove(self.path)
+        os.rename(tmp_path, self.path)
+        (self._index, self._size, self._live) = (index, size, size)
+        self._torn = False
+        self.compactions += 1
+        metrics.inc(_M_COMPACTIONS)
+        metrics.inc(_M_BYTES_WRITTEN, size)
+        return size
+
+    # Recovery
+
+    async def _load(self):
+        """
+            Build the index from the log, compacting it if it ends with a broken record
+        """
+        tmp_path = self.path + ".new"
+        if _exists(tmp_path):
+            if _exists(self.path):
+                # Reset during a compaction, before it was complete
+                os.remove(tmp_path)
+            else:
+                # Reset between the removal of the old log and the rename of the new one
+                os.rename(tmp_path, self.path)
+        if not _exists(self.path):
+            return
+        broken = False
+        with _open_file(self.path, "rb") as f:
+            offset = 0
+            while True:
+                header = f.read(_HEADER_SIZE)
+                if not header:
+                    break
+                if len(header) < _HEADER_SIZE or header[0] != _MAGIC:
+                    broken = True
+                    break
+                (kind, key_length, value_length, crc) = struct.unpack_from("<BBII", header, 1)
+                raw_key = f.read(key_length)
+                value = f.read(value_length)
+                if len(raw_key) != key_length or len(value) != value_length or \
+                        binascii.crc32(value, binascii.crc32(raw_key, binascii.crc32(header[0:7]))) != crc:
+                    broken = True
+                    break
+                key = raw_key.decode()
+                self._drop(key)
+                if kind == _PUT:
+                    record_size = _HEADER_SIZE + key_length + value_length
+                    self._index[key] = (offset + _HEADER_SIZE + key_length, value_length, record_size)
+                    self._live += record_size
+                offset += _HEADER_SIZE + key_length + value_length
+                await uasyncio.sleep_ms(0)
+        self._size = offset
+        if broken:
+            print("Store {}: broken record at {}, dropped".format(self.name, offset))
+            metrics.inc(_M_RECOVERIES)
+            await self._compact()
+        self.recovered = broken
+
+async def open(name):
+    """
+        Open the store name (created if needed), its log is read at the first open only
+    """
+    store = stores.get(name)
+    if store is None:
+        if not _exists(settings.KVSTORE_DIR):
+            os.mkdir(settings.KVSTORE_DIR)
+        store = stores[name] = Store(name)
+        async with store._lock:
+            try:
+                await store._load()
+            except Exception:
+                del stores[name]
+                raise
+    else:
+        # Wait until it is loaded, if another routine is opening it
+        async with store._lock:
+            pass
+    return store
+
+async def flush_all():
+    """
+        Flush the pending writes of every store. Returns the bytes written.
+    """
+    written = 0
+    for store in list(stores.values()):
+        if store.is_dirty() or store.needs_compaction():
+            written += await store.flush()
+    return written
+
+def log_bytes():
+    return sum(store._size for store in stores.values())
+
+def pending_bytes():
+    return sum(store._pending_bytes for store in stores.values())
@@ -0,0 +1,114 @@
+# Bounded in-RAM log ring
+#
+# Keeps the last LOGS_RING_SIZE log lines of the device, each with a sequence number,
+# so that a host can fetch them (see service_logs and script/tail_logs) without
+# fetching a line twice. It records:
+#   - everything printed (builtins.print is replaced by a recording print)
+#   - the uncaught task exceptions (see main.task_exception_handler)
+#   - the services logs, recorded with their source, like auftpd.log_msg
+#
+# The ring is only allocated by enable() (service_logs does it when LOGS_ENABLE is set):
+# until then log() only prints.
+
+import builtins
+import os
+import sys
+import time
+import uio
+
+from . import settings
+
+# Slots of the ring: (sequence number, ticks_ms, source, text), allocated by enable()
+ring = None
+# Sequence number of the next line
+next_seq = 0
+# Random id of this boot: the sequence numbers restart from 0 on each boot
+boot_id = None
+
+_print = builtins.print
+
+def enable():
+    global ring, boot_id
+    if ring is not None:
+        return
+    ring = [None] * settings.LOGS_RING_SIZE
+    boot_id = "{:08x}".format(int.from_bytes(os.urandom(4), "big"))
+    try:
+        builtins.print = _recording_print
+    except AttributeError:
+        # Builtins can not be overridden on this port: prints are not recorded
+        pass
+
+def disable():
+    global ring
+    if builtins.print is _recording_print:
+        builtins.print = _print
+    ring = None
+
+def record(source, text):
+    global next_seq
+    if ring is None:
+        return
+    if len(text) > settings.LOGS_LINE_MAX:
+        text = text[:settings.LOGS_LINE_MAX - 3] + "..."
+    ring[next_seq % len(ring)] = (next_seq, time.ticks_ms(), source, text)
+    next_seq += 1
+
+def log(source, *args):
+    """
+        Print a service log line, and record it with its source
+    """
+    _print(*args)
+    record(source, " ".join(str(arg) for arg in args))
+
+def record_exception(source, err):
+    """
+        Record the traceback of an exception, as a single line starting with the exception
+        (the innermost frames first), so that truncation drops the outermost frames
+    """
+    if ring is None:
+        return
+    buf = uio.StringIO()
+    sys.print_exception(err, buf)
+    lines = buf.getvalue().strip().split("\n")
+    lines.reverse()
+    record(source, " | ".join(line.strip() for line in lines if not line.startswith("Traceback")))
+
+def log_exception(source, err):
+    """
+        Print an exception, and record its traceback with its source
+    """
+    sys.print_exception(err)
+    record_exception(source, err)
+
+def _recording_print(*args, sep=" ", end="\n", file=None):
+    if file is not None:
+        _print(*args, sep=sep, end=end, file=file)
+        return
+    _print(*args, sep=sep, end=end)
+    text = sep.join(str(arg) for arg in args)
+    if text:
+        record("print", text)
+
+def first_seq():
+    """
+        Sequence number of the oldest line still in the ring
+    """
+    if ring is None:
+        return next_seq
+    return max(0, next_seq - len(ring))
+
+def since(seq):
+    """
+        The recorded lines from sequence number seq (included), oldest first
+    """
+    first = first_seq()
+    if seq < first:
+        seq = first
+    return [ring[s % len(ring)] for s in range(seq, next_seq)]
+
+def lost():
+    """
+        Number of lines which were overwritten in the ring
+    """
+    return first_seq()
@@ -5,12 +5,10 @@ import sys
 import uasyncio
 
 from . import hardware
-from . import service_beacon
-from . import service_ftpd
-from . import service_mdns
-from . import service_network
-from . import service_remote_eval
-from . import service_telnet
+from . import logring
+from . import services
+from . import settings
+from . import timers
 
 program_tasks = []
 stop_signal = uasyncio.Event()
@@ -18,20 +16,18 @@ stop_signal = uasyncio.Event()
 def main():
     micropython.alloc_emergency_exception_buf(100)
 
+    # The apps import the shared libraries by their absolute name
+    if settings.LIBS_DIR not in sys.path:
+        sys.path.append(settings.LIBS_DIR)
+
     pkgs = [
         hardware,
     ]
     run_routines("init", pkgs)
 
-    pkgs = [
-        service_beacon,
-        service_ftpd,
-        service_mdns,
-        service_network,
-        service_remote_eval,
-        service_telnet,
-    ]
-    run_routines("init", pkgs)
+    # Only the enabled services are imported
+    run_routines("init", services.load_enabled())
+    print("Services heap usage: {} bytes".format(sum(services.heap_used.values())))
 
     # Try to load the main routine from src
     app = None
@@ -40,30 +36,22 @@ def main():
     except Exception as err:
         sys.print_exception(err)
 
-    pkgs = [
-        hardware,
-        service_beacon,
-        service_ftpd,
-        service_mdns,
-        service_network,
-        service_remote_eval,
-        service_telnet,
-    ]
-
     loop = uasyncio.get_event_loop()
 
     # Start system routines
-    for service_package in pkgs:
-        for routine_name in dir(service_package):
-            if routine_name.startswith("routine_"):
-                loop.create_task(getattr(service_package, routine_name)())
+    for routine_name in services.routine_names(hardware):
+        services.spawn_routine("hardware", hardware, routine_name)
+    for service_name in list(services.modules):
+        services.start(service_name)
 
     # Execute program init while system routines runs, and wait for program init to finish (but system routines are still active)
     if app:
         run_routines("init", [ app ])
 
     # Start program routines
-    program_tasks.extend(loop.create_task(getattr(app, routine_name)()) for routine_name in dir(app) if routine_name.startswith("routine_"))
+    program_tasks.extend(services.spawn_routine("app", app, routine_name) for routine_name in dir(app) if routine_name.startswith("routine_"))
+    if app:
+        timers.register("app", app)
 
     # Have a task designed to cancel every program_tasks when stop_signal is triggered
     # It is necessary to have a task and not do it after KeyboardInterrupt, because
@@ -75,10 +63,12 @@ def main():
         # Stop program tasks
         for task in program_tasks:
             task.cancel()
+        timers.cancel_owner("app")
     stopper_task = loop.create_task(stopper())
 
 
     # On normal runtime, if there is an unhandled exception, reset to go back to a good machine state
+    # (the supervised routines are restarted instead, until the supervisor failure budget is exceeded)
     loop.set_exception_handler(task_exception_handler)
 
     try:
@@ -114,6 +104,8 @@ async def reset_after_ms(delay_ms):
 def task_exception_handler(loop, context):
     print("An uncaught exception triggered, resetting in 60 seconds (ctrl-c to cancel reset)...")
     loop.create_task(reset_after_ms(60_000))
+    if "exception" in context:
+        logring.record_exception("exception", context["exception"])
     loop.default_exception_handler(loop, context)
 
 
@@ -122,11 +114,10 @@ def run_routines(prefix, packages):
     loop = uasyncio.get_event_loop()
 
     for pkg in packages:
-        for routine_name in dir(pkg):
-            if routine_name.startswith(prefix+"_"):
-                tasks.append(loop.create_task(getattr(pkg, routine_name)()))
+        for routine_name in services.routine_names(pkg, prefix):
+            tasks.append(loop.create_task(getattr(pkg, routine_name)()))
 
-    def waiter():
+    async def waiter():
         for t in tasks:
             await t
 
@@ -0,0 +1,164 @@
+# Compact preallocated metrics registry
+#
+# Every metric value lives in a single preallocated int64 array, so incrementing a metric
+# allocates nothing. Metrics are registered once, usually at import time:
+#
+#   from bootpkg import metrics
+#   _M_REQUESTS = metrics.counter("myapp.requests")
+#   _M_TEMPERATURE = metrics.gauge("myapp.temperature")
+#   _M_LATENCY = metrics.histogram("myapp.latency_ms", (1, 5, 10, 50, 100))
+#
+#   metrics.inc(_M_REQUESTS)
+#   metrics.set_gauge(_M_TEMPERATURE, 21)
+#   metrics.observe(_M_LATENCY, 7)
+#
+# The binary export (see export()) is served by service_metrics, and scraped by script/scrape_metrics.
+# The metrics registered by a service are unregistered when it is unloaded (see services.py).
+
+from array import array
+import struct
+import time
+
+from . import settings
+
+KIND_COUNTER = const(0)
+KIND_GAUGE = const(1)
+KIND_HISTOGRAM = const(2)
+
+EXPORT_MAGIC = b"MSWM"
+
+# All the metrics values
+values = array("q", [0] * settings.METRICS_MAX_VALUES)
+values_count = 0
+
+# Registered metrics: (name, kind, first value index, bucket bounds or None)
+registry = []
+_by_name = {}
+# Histograms bounds, by first value index
+_bounds = {}
+# Values left unused between the registered metrics by unregister()
+_holes = 0
+
+# Cached export of the registry description, rebuilt on registration
+_schema = None
+
+def _register(name, kind, size, bounds=None):
+    global values_count, _schema
+
+    if name in _by_name:
+        return _by_name[name]
+    if values_count + size > len(values):
+        raise MemoryError("metrics: increase METRICS_MAX_VALUES")
+    index = values_count
+    values_count += size
+    registry.append((name, kind, index, bounds))
+    _by_name[name] = index
+    if bounds is not None:
+        _bounds[index] = bounds
+    _schema = None
+    return index
+
+def _size(kind, bounds):
+    return len(bounds) + 2 if kind == KIND_HISTOGRAM else 1
+
+def unregister(names):
+    """
+        Forget metrics (registered by an unloaded module). Their values are given back if they are
+        the last ones, else they stay unused until reboot.
+    """
+    global values_count, _holes, _schema
+
+    for name in names:
+        index = _by_name.pop(name, None)
+        if index is None:
+            continue
+        for entry in registry:
+            if entry[2] == index:
+                registry.remove(entry)
+                size = _size(entry[1], entry[3])
+                break
+        _bounds.pop(index, None)
+        for i in range(index, index + size):
+            values[i] = 0
+        _holes += size
+    # The registry is in values order: the values after the last metric are free again
+    end = registry[-1][2] + _size(registry[-1][1], registry[-1][3]) if registry else 0
+    _holes -= values_count - end
+    values_count = end
+    _schema = None
+
+def counter(name):
+    return _register(name, KIND_COUNTER, 1)
+
+def gauge(name):
+    return _register(name, KIND_GAUGE, 1)
+
+def histogram(name, bounds):
+    """
+        A histogram with a bucket per bound (value <= bound), an overflow bucket and the sum of the values
+    """
+    return _register(name, KIND_HISTOGRAM, len(bounds) + 2, tuple(bounds))
+
+def inc(index, n=1):
+    values[index] += n
+
+def set_gauge(index, value):
+    values[index] = value
+
+def observe(index, value):
+    bounds = _bounds[index]
+    bucket = 0
+    for bound in bounds:
+        if value <= bound:
+            break
+        bucket += 1
+    values[index + bucket] += 1
+    values[index + len(bounds) + 1] += value
+
+def snapshot():
+    """
+        The metrics values by name (a list for histograms: buckets counts then sum)
+    """
+    result = {}
+    for (name, kind, index, bounds) in registry:
+        if kind == KIND_HISTOGRAM:
+            result[name] = list(values[index:index + len(bounds) + 2])
+        else:
+            result[name] = values[index]
+    return result
+
+def schema():
+    """
+        Binary description of the registered metrics, for each one:
+        kind (B), name length (B), name, values count (B), and for histograms the bounds (<i each)
+    """
+    global _schema
+
+    if _schema is None:
+        parts = []
+        for (name, kind, index, bounds) in registry:
+            encoded_name = name.encode()
+            size = _size(kind, bounds)
+            parts.append(struct.pack("<BB", kind, len(encoded_name)) + encoded_name + struct.pack("<B", size))
+            if bounds:
+                parts.append(struct.pack("<%di" % len(bounds), *bounds))
+        _schema = b"".join(parts)
+    return _schema
+
+def export_header():
+    """
+        Export header: magic (4s), uptime in ms (<I), metrics count (<H), values count (<H), schema size (<H)
+    """
+    return struct.pack("<4sIHHH", EXPORT_MAGIC, time.ticks_ms(), len(registry), values_count - _holes, len(schema()))
+
+def export():
+    """
+        The full binary export: header, schema, then the values as int64
+        (native byte order, little-endian on every supported board)
+    """
+    if _holes:
+        # Skip the unused values left by unregister()
+        data = b"".join(bytes(memoryview(values)[index:index + _size(kind, bounds)]) for (name, kind, index, bounds) in registry)
+    else:
+        data = bytes(memoryview(values)[:values_count])
+    return export_header() + schema() + data
@@ -0,0 +1,93 @@
+# Network state bus: the link and ip state of each nic of hardware.nics, watched by
+# the watch_nics timer of service_network, shared by the services and the apps.
+#
+# Waiting for a change, instead of sleeping:
+#
+#   from bootpkg import netwatch
+#   seen = netwatch.version
+#   while True:
+#       ... (re)bind the sockets to netwatch.addresses() ...
+#       seen = await netwatch.wait_change(seen, 2000)
+#
+# Or being called on each change, with the nic index and its old and new (link up, ifconfig) state:
+#
+#   netwatch.add_listener(lambda index, old, new: print(index, old, new))
+#
+# An app reconfiguring a nic can call netwatch.check() right after, to publish the change at once.
+
+import hardware
+import uasyncio
+
+from . import metrics
+
+_M_CHANGES = metrics.counter("netwatch.changes")
+
+# (link up, ifconfig) of each nic, by index in hardware.nics
+state = []
+# Incremented on each change of the state
+version = 0
+
+_changed = uasyncio.Event()
+_listeners = []
+
+def add_listener(callback):
+    _listeners.append(callback)
+
+def remove_listener(callback):
+    if callback in _listeners:
+        _listeners.remove(callback)
+
+def _nic_state(nic):
+    try:
+        link = bool(nic.isconnected())
+    except (AttributeError, OSError):
+        link = True
+    try:
+        return (link, tuple(nic.ifconfig()))
+    except OSError:
+        return (False, None)
+
+def is_up(nic_state):
+    return nic_state[0] and nic_state[1] is not None and nic_state[1][0] != "0.0.0.0"
+
+def addresses():
+    """
+        Ips of the nics with a link and an ip, by nic index
+    """
+    return dict((index, nic_state[1][0]) for (index, nic_state) in enumerate(state) if is_up(nic_state))
+
+def check():
+    """
+        Read the state of the nics, and publish the changes. Returns True if the state changed.
+    """
+    global state, version
+    new_state = [_nic_state(nic) for nic in hardware.nics]
+    if new_state == state:
+        return False
+    old_state = state
+    state = new_state
+    version += 1
+    metrics.inc(_M_CHANGES)
+    for index in range(len(new_state)):
+        old = old_state[index] if index < len(old_state) else None
+        if old != new_state[index]:
+            for callback in _listeners:
+                try:
+                    callback(index, old, new_state[index])
+                except Exception as err:
+                    print("Network listener failed: {}".format(err))
+    # Wake the waiting tasks, the later ones compare the version
+    _changed.set()
+    _changed.clear()
+    return True
+
+async def wait_change(seen_version, timeout_ms):
+    """
+        Wait until the state version is not seen_version anymore, at most timeout_ms. Returns the current version.
+    """
+    if version == seen_version:
+        try:
+            await uasyncio.wait_for_ms(_changed.wait(), timeout_ms)
+        except uasyncio.TimeoutError:
+            pass
+    return version
@@ -0,0 +1,162 @@
+# Publish/subscribe messaging between the apps of the devices, over udp (see service_pubsub.py)
+#
+#   from bootpkg import pubsub
+#
+#   sub = pubsub.subscribe("door/opened")
+#   while True:
+#       payload = await sub.recv()
+#
+#   pubsub.publish("door/opened", b"main_entrance")
+#
+# Messages are best effort datagrams, up to PUBSUB_MAX_PAYLOAD bytes: a message can be lost,
+# and a subscriber too slow to receive them drops the oldest ones (PUBSUB_QUEUE_LEN are kept).
+# The subscriptions of the other devices are learnt from their announces, so a message published
+# right after a device subscribed may not reach it yet (up to PUBSUB_ANNOUNCE_MS later).
+
+import time
+import uasyncio
+
+from . import settings
+
+class Subscription:
+    """
+        The messages received on a topic, in preallocated slots
+    """
+
+    def __init__(self, topic):
+        self.topic = topic
+        self._slots = [bytearray(settings.PUBSUB_MAX_PAYLOAD) for i in range(settings.PUBSUB_QUEUE_LEN)]
+        self._sizes = [0] * settings.PUBSUB_QUEUE_LEN
+        self._first = 0
+        self._count = 0
+        self._event = uasyncio.Event()
+        self.dropped = 0
+
+    def _deliver(self, payload):
+        if self._count == len(self._slots):
+            # Full: drop the oldest message
+            self._first = (self._first + 1) % len(self._slots)
+            self._count -= 1
+            self.dropped += 1
+        index = (self._first + self._count) % len(self._slots)
+        n = min(len(payload), len(self._slots[index]))
+        self._slots[index][0:n] = payload[0:n]
+        self._sizes[index] = n
+        self._count += 1
+        self._event.set()
+
+    async def recv_into(self, buf):
+        """
+            Wait for a message, and copy it into buf. Returns its size.
+        """
+        while not self._count:
+            self._event.clear()
+            await self._event.wait()
+        index = self._first
+        n = min(self._sizes[index], len(buf))
+        buf[0:n] = memoryview(self._slots[index])[0:n]
+        self._first = (self._first + 1) % len(self._slots)
+        self._count -= 1
+        return n
+
+    async def recv(self):
+        """
+            Wait for a message, and return it as bytes
+        """
+        buf = bytearray(settings.PUBSUB_MAX_PAYLOAD)
+        n = await self.recv_into(buf)
+        return bytes(memoryview(buf)[0:n])
+
+    def pending(self):
+        return self._count
+
+    def close(self):
+        unsubscribe(self)
+
+# Local subscriptions, by topic
+subscriptions = {}
+# Incremented when a topic is subscribed or unsubscribed, so that the subscriptions are announced again
+version = 0
+# Subscribers of the other devices: {topic: {ip: announce expiration ticks}}
+peers = {}
+# Set by service_pubsub: send(topic, payload, ips), sending to the subscribers ips, or on the group
+_transport = None
+# Set by service_pubsub: called when the subscribed topics change, to announce them at once
+_topics_changed = None
+
+def _changed():
+    global version
+    version += 1
+    if _topics_changed:
+        _topics_changed()
+
+def subscribe(topic):
+    sub = Subscription(topic)
+    if topic not in subscriptions:
+        subscriptions[topic] = []
+        _changed()
+    subscriptions[topic].append(sub)
+    return sub
+
+def unsubscribe(sub):
+    subs = subscriptions.get(sub.topic)
+    if subs and sub in subs:
+        subs.remove(sub)
+        if not subs:
+            del subscriptions[sub.topic]
+            _changed()
+
+def topics():
+    return sorted(subscriptions)
+
+def subscribers(topic):
+    """
+        Ips of the other devices subscribed to topic
+    """
+    now = time.ticks_ms()
+    subs = peers.get(topic)
+    if not subs:
+        return []
+    return [ip for (ip, expires) in subs.items() if time.ticks_diff(expires, now) > 0]
+
+def deliver(topic, payload):
+    for sub in subscriptions.get(topic, ()):
+        sub._deliver(payload)
+
+def publish(topic, payload):
+    """
+        Send a message to the subscribers of topic, on this device and the others. Returns the number of remote subscribers.
+    """
+    if isinstance(payload, str):
+        payload = payload.encode()
+    if len(payload) > settings.PUBSUB_MAX_PAYLOAD:
+        raise ValueError("payload larger than PUBSUB_MAX_PAYLOAD")
+    deliver(topic, payload)
+    ips = subscribers(topic)
+    if ips and _transport:
+        _transport(topic, payload, ips)
+    return len(ips)
+
+def peer_announce(ip, announced_topics, expires):
+    """
+        Record the topics subscribed by the device at ip, replacing its previous announce
+    """
+    for (topic, subs) in list(peers.items()):
+        if ip in subs and topic not in announced_topics:
+            del subs[ip]
+            if not subs:
+                del peers[topic]
+    for topic in announced_topics:
+        peers.setdefault(topic, {})[ip] = expires
+
+def expire_peers():
+    """
+        Forget the subscribers whose last announce is too old
+    """
+    now = time.ticks_ms()
+    for (topic, subs) in list(peers.items()):
+        for (ip, expires) in list(subs.items()):
+            if time.ticks_diff(expires, now) <= 0:
+                del subs[ip]
+        if not subs:
+            del peers[topic]
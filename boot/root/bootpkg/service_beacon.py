@@ -1,21 +1,65 @@
 import hardware
 import board
+import bootswap
 import uasyncio
 import socket
 import json
 import os
+from . import apptree
+from . import metrics
+from . import netwatch
+from . import services
 from . import settings
+from . import timers
 
 BEACON_REPEAT_MS = 2000
+# Spread the beacons of the fleet
+BEACON_JITTER_MS = 200
 
-async def routine_beacon_broadcast():
+_M_SENT = metrics.counter("beacon.sent")
+
+# The boot settings sent in the beacon: the ones the host scripts read to reach the services of the device.
+# The others only tune the device, and all of them would not fit in one packet.
+BEACON_SETTINGS = (
+    "DELTA_BLOCK_SIZE", "DELTA_ENABLE", "DELTA_PORT",
+    "FTPD_ENABLE", "FTPD_PORT",
+    "LIBS_DIR",
+    "LOGS_ENABLE", "LOGS_PORT",
+    "MCAST_DEPLOY_ENABLE", "MCAST_DEPLOY_GROUP", "MCAST_DEPLOY_PORT",
+    "METRICS_ENABLE", "METRICS_PORT",
+    "MONITOR_ENABLE", "MONITOR_PORT",
+    "REMOTE_EVAL_ENABLE", "REMOTE_EVAL_PORT",
+    "SYNC_ENABLE", "SYNC_PORT",
+    "UPGRADE_ENABLE", "UPGRADE_TRIAL_MS",
+)
+
+# The (service name, beacon_info function) of the loaded services, and the services version they were listed at
+_providers = ()
+_providers_version = None
+
+def encode_beacon(static_content):
     """
-        Broadcast the device information regularly to network
+        Append to the static beacon content the live information of the loaded services:
+        each service module can define a beacon_info() function, sent under the service name (unless None)
     """
+    global _providers, _providers_version
+    if _providers_version != services.version:
+        _providers = tuple((name, module.beacon_info) for (name, module) in services.modules.items() if hasattr(module, "beacon_info"))
+        _providers_version = services.version
+    infos = {}
+    for (name, beacon_info) in _providers:
+        info = beacon_info()
+        if info is not None:
+            infos[name] = info
+    if not infos:
+        return static_content
+    # Encoded at once, and spliced into the static content object
+    return static_content[:-1] + ", " + json.dumps(infos)[1:]
 
-    if not settings.BEACON_ENABLE:
-        return
-
+def static_beacon_content():
+    """
+        The json beacon content which does not change while the device runs
+    """
     app = None
     app_version = None
     try:
@@ -25,30 +69,85 @@ async def routine_beacon_broadcast():
         pass
 
     uname = os.uname()
-    beacon_content = json.dumps({
+    return json.dumps({
         "type": "beacon",
         "ifconfigs": [nic.ifconfig() for nic in hardware.nics],
         "settings": {
             "board": dict((attr, getattr(board, attr)) for attr in sorted(dir(board)) if not attr.startswith('_')),
-            "boot": dict((attr, getattr(settings, attr)) for attr in sorted(dir(settings)) if not attr.startswith('_')),
+            "boot": dict((name, getattr(settings, name)) for name in BEACON_SETTINGS),
         },
         "versions": {
             "app": app_version,
+            "app_tree": apptree.tree_hash,
             "boot": settings.VERSION,
-            "micropython": dict((attr, getattr(uname, attr)) for attr in sorted(dir(uname)) if not attr.startswith('_')),
+            "boot_tree": bootswap.read_state()["hash"],
+            "libs_tree": apptree.libs_hash,
+            "micropython": uname.version,
         },
     })
 
-    while True:
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            while True:
-                for ip in settings.BEACON_DESTINATION_IPS:
-                    s.sendto(beacon_content, (ip, settings.BEACON_DESTINATION_PORT))
-                await uasyncio.sleep_ms(BEACON_REPEAT_MS)
-        except OSError:
-            pass
-        finally:
-            if s:
-                s.close()
-        await uasyncio.sleep_ms(BEACON_REPEAT_MS)
+_socket = None
+# The static beacon content, None until the app tree hash was computed once, and the network state version it has
+_content = None
+_content_version = None
+_tree_updating = False
+
+async def _update_tree():
+    """
+        Compute the app tree hash if its files changed, and send the new content right away
+    """
+    global _content, _content_version, _tree_updating
+    _tree_updating = True
+    try:
+        if await apptree.update() or _content is None:
+            _content = static_beacon_content()
+            _content_version = netwatch.version
+            for timer in timers.by_owner.get("beacon", ()):
+                timer.trigger()
+    finally:
+        _tree_updating = False
+
+def send_beacon():
+    """
+        Broadcast the device information regularly to network, and at once when a nic link or ip changes
+    """
+    global _socket, _content, _content_version
+    if apptree.is_changed() and not _tree_updating:
+        uasyncio.create_task(_update_tree())
+    if _content is None:
+        return
+    if _content_version != netwatch.version:
+        # A nic link or ip changed: send the new ifconfigs
+        _content = static_beacon_content()
+        _content_version = netwatch.version
+    content = encode_beacon(_content)
+    try:
+        if _socket is None:
+            _socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for ip in settings.BEACON_DESTINATION_IPS:
+            _socket.sendto(content, (ip, settings.BEACON_DESTINATION_PORT))
+            metrics.inc(_M_SENT)
+    except OSError:
+        # Created again on the next beacon
+        if _socket is not None:
+            _socket.close()
+        _socket = None
+
+async def routine_beacon_first():
+    """
+        Send the first beacon as soon as the app tree hash is known
+    """
+    await _update_tree()
+
+def _network_changed(index, old, new):
+    for timer in timers.by_owner.get("beacon", ()):
+        timer.trigger()
+
+netwatch.add_listener(_network_changed)
+
+def teardown():
+    netwatch.remove_listener(_network_changed)
+
+TIMERS = (
+    (send_beacon, BEACON_REPEAT_MS, BEACON_JITTER_MS),
+)
@@ -0,0 +1,177 @@
+# Block level delta sync of large files, rsync style (see script/swarmlib/delta.py)
+#
+# The host asks for the signatures of the device copy of a file: for each block of
+# DELTA_BLOCK_SIZE bytes, a weak rolling checksum and a truncated sha256.
+# It then finds the blocks it already has at any offset of the new file, and sends only
+# a reconstruction script: copies of old blocks, and the new data in between.
+# The new file is built into a temporary file, checked against its sha256, and renamed.
+#
+# Requests, on a connection to DELTA_PORT (several can be sent on the same connection):
+#   "SIGS <block size> <path>\n"
+#       reply: "<file size> <blocks count>\n", then for each block: <I weak checksum, 8 bytes of sha256
+#       (file size is -1 if the file does not exist)
+#   "PATCH <new size> <sha256 hex> <block size> <path>\n", then the operations:
+#       b"C" <II first block, blocks count: copy blocks of the old file
+#       b"D" <I length, data: new data
+#       b"E": end
+#       reply: "OK\n" or "ERR <message>\n" (the connection is then closed)
+
+import hashlib
+import micropython
+import os
+import struct
+import uasyncio
+from binascii import hexlify
+
+from . import apptree
+from . import gcpolicy
+from . import metrics
+from . import settings
+
+_SIG_SIZE = const(12)
+# Signatures sent per write
+_SIGS_PER_WRITE = const(16)
+
+_M_FILES = metrics.counter("delta.files")
+_M_FAILURES = metrics.counter("delta.failures")
+_M_BYTES_IN = metrics.counter("delta.bytes_in")
+_M_BYTES_COPIED = metrics.counter("delta.bytes_copied")
+
+@micropython.native
+def weak_checksum(buf, n):
+    """
+        rsync weak checksum of buf[0:n]: low 16 bits the sum of the bytes,
+        high 16 bits the sum weighted by the distance to the end
+    """
+    a = 0
+    b = 0
+    for i in range(n):
+        x = buf[i]
+        a += x
+        b += (n - i) * x
+    return ((b & 0xffff) << 16) | (a & 0xffff)
+
+async def _send_signatures(writer, path, block_size):
+    try:
+        size = os.stat(path)[6]
+    except OSError:
+        writer.write(b"-1 0\n")
+        return
+    count = (size + block_size - 1) // block_size
+    writer.write("{} {}\n".format(size, count).encode())
+
+    buffer = bytearray(block_size)
+    mv = memoryview(buffer)
+    out = bytearray(_SIG_SIZE * _SIGS_PER_WRITE)
+    filled = 0
+    with open(path, "rb") as f:
+        for i in range(count):
+            n = f.readinto(buffer)
+            struct.pack_into("<I", out, filled, weak_checksum(buffer, n))
+            out[filled + 4:filled + _SIG_SIZE] = hashlib.sha256(mv[0:n]).digest()[0:8]
+            filled += _SIG_SIZE
+            if filled == len(out) or i == count - 1:
+                writer.write(memoryview(out)[0:filled])
+                await writer.drain()
+                gcpolicy.touch()
+                filled = 0
+
+async def _apply_patch(reader, path, new_size, new_hash, block_size):
+    tmp_path = path + ".delta"
+    buffer = bytearray(max(block_size, 512))
+    mv = memoryview(buffer)
+    h = hashlib.sha256()
+    written = 0
+
+    try:
+        old = open(path, "rb")
+    except OSError:
+        old = None
+    try:
+        with open(tmp_path, "wb") as out:
+            while True:
+                op = await reader.readexactly(1)
+                if op == b"E":
+                    break
+                elif op == b"C":
+                    (first, count) = struct.unpack("<II", await reader.readexactly(8))
+                    if old is None:
+                        raise ValueError("no old file")
+                    old.seek(first * block_size)
+                    for i in range(count):
+                        n = old.readinto(mv[0:block_size])
+                        out.write(mv[0:n])
+                        h.update(mv[0:n])
+                        written += n
+                        metrics.inc(_M_BYTES_COPIED, n)
+                elif op == b"D":
+                    (length,) = struct.unpack("<I", await reader.readexactly(4))
+                    while length:
+                        n = await reader.readinto(mv[0:min(length, len(buffer))])
+                        if not n:
+                            raise ValueError("truncated data")
+                        out.write(mv[0:n])
+                        h.update(mv[0:n])
+                        written += n
+                        length -= n
+                        metrics.inc(_M_BYTES_IN, n)
+                else:
+                    raise ValueError("bad operation")
+                gcpolicy.touch()
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    finally:
+        if old is not None:
+            old.close()
+
+    if written != new_size or hexlify(h.digest()).decode() != new_hash:
+        os.remove(tmp_path)
+        raise ValueError("checksum mismatch")
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    os.rename(tmp_path, path)
+    apptree.changed()
+
+async def _handle_request(reader, writer):
+    gcpolicy.touch()
+    try:
+        while True:
+            line = (await reader.readline()).decode().rstrip("\n")
+            command = line.split(" ", 1)[0]
+            if command == "SIGS":
+                (block_size, path) = line.split(" ", 2)[1:]
+                await _send_signatures(writer, path, int(block_size))
+            elif command == "PATCH":
+                (new_size, new_hash, block_size, path) = line.split(" ", 4)[1:]
+                metrics.inc(_M_FILES)
+                try:
+                    await _apply_patch(reader, path, int(new_size), new_hash, int(block_size))
+                    writer.write(b"OK\n")
+                except (OSError, ValueError, EOFError) as err:
+                    # The rest of the operations were not read: the connection can not be used anymore
+                    metrics.inc(_M_FAILURES)
+                    writer.write("ERR {}\n".format(err).encode())
+                    await writer.drain()
+                    break
+            else:
+                break
+            await writer.drain()
+            gcpolicy.collect_if_needed()
+    except (OSError, ValueError):
+        pass
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+async def routine_delta_server():
+    HOST = "0.0.0.0"
+
+    async with await uasyncio.start_server(_handle_request, HOST, settings.DELTA_PORT) as server:
+        print(f'Delta sync server started on {HOST}:{settings.DELTA_PORT}')
+        await server.wait_closed()
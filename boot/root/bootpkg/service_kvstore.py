@@ -0,0 +1,48 @@
+# Background flush of the key-value stores of the apps (see kvstore.py)
+#
+# Woken by the first pending write, it waits KVSTORE_FLUSH_MS for more writes to batch (less if
+# KVSTORE_FLUSH_SIZE bytes are pending first), then appends them to the logs, and compacts those which need it.
+
+import time
+import uasyncio
+
+from . import kvstore
+from . import metrics
+from . import settings
+
+_M_FAILURES = metrics.counter("kvstore.failures")
+
+def beacon_info():
+    if not kvstore.stores:
+        return None
+    return {
+        "stores": len(kvstore.stores),
+        "bytes": kvstore.log_bytes(),
+        "pending": kvstore.pending_bytes(),
+    }
+
+async def _wait_batch():
+    deadline = time.ticks_add(time.ticks_ms(), settings.KVSTORE_FLUSH_MS)
+    while kvstore.pending_bytes() < settings.KVSTORE_FLUSH_SIZE:
+        remaining = time.ticks_diff(deadline, time.ticks_ms())
+        if remaining <= 0:
+            return
+        kvstore.flush_needed.clear()
+        try:
+            await uasyncio.wait_for_ms(kvstore.flush_needed.wait(), remaining)
+        except uasyncio.TimeoutError:
+            pass
+
+async def routine_kvstore():
+    while True:
+        await kvstore.flush_needed.wait()
+        await _wait_batch()
+        kvstore.flush_needed.clear()
+        try:
+            await kvstore.flush_all()
+        except OSError as err:
+            # Filesystem full, for example: the writes are kept pending, try again later
+            print("Store flush failed: {}".format(err))
+            metrics.inc(_M_FAILURES)
+            await uasyncio.sleep_ms(settings.KVSTORE_FLUSH_MS)
+            kvstore.flush_needed.set()
@@ -0,0 +1,73 @@
+# Stream the log ring (see logring) to anyone connecting to LOGS_PORT
+#
+# The client sends a request line: "<boot id> <sequence number> [follow]\n"
+# and receives json lines: a header {"boot": ..., "first": ..., "next": ..., "clock": ...},
+# then one [seq, ticks_ms, source, text] line per log line, from the requested sequence number.
+# "clock" is [ticks_ms, unix time in ms] at the time of the header once the clock is synced (see clock.py),
+# null before: the host gets the time of the lines from it.
+# If the boot id is not the current one (the device rebooted, or "-"), the lines are sent from the oldest one.
+# Without "follow" the connection is closed after the recorded lines, with it the new lines are streamed.
+# See script/tail_logs.
+
+import json
+import time
+import uasyncio
+
+from . import clock
+from . import gcpolicy
+from . import logring
+from . import metrics
+from . import settings
+
+_M_CLIENTS = metrics.counter("logs.clients")
+_M_LINES = metrics.counter("logs.lines_sent")
+
+def beacon_info():
+    return {
+        "boot": logring.boot_id,
+        "next": logring.next_seq,
+        "lost": logring.lost(),
+    }
+
+async def init_logs():
+    logring.enable()
+
+async def _send_since(writer, seq):
+    for line in logring.since(seq):
+        writer.write(json.dumps(line) + "\n")
+        await writer.drain()
+        seq = line[0] + 1
+        metrics.inc(_M_LINES)
+    return seq
+
+async def _handle_request(reader, writer):
+    metrics.inc(_M_CLIENTS)
+    gcpolicy.touch()
+    try:
+        request = (await reader.readline()).decode().split()
+        boot_id = request[0] if request else "-"
+        seq = int(request[1]) if len(request) > 1 else 0
+        follow = len(request) > 2 and request[2] == "follow"
+        if boot_id != logring.boot_id:
+            seq = 0
+
+        ticks = time.ticks_ms()
+        reference = [ticks, clock.ticks_to_ms(ticks)] if clock.is_synced() else None
+        writer.write(json.dumps({ "boot": logring.boot_id, "first": logring.first_seq(), "next": logring.next_seq, "clock": reference }) + "\n")
+        seq = await _send_since(writer, seq)
+        while follow:
+            await uasyncio.sleep_ms(settings.LOGS_FOLLOW_MS)
+            if seq != logring.next_seq:
+                seq = await _send_since(writer, seq)
+    except (OSError, ValueError):
+        pass
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+async def routine_logs_server():
+    HOST = "0.0.0.0"
+
+    async with await uasyncio.start_server(_handle_request, HOST, settings.LOGS_PORT) as server:
+        print(f'Logs server started on {HOST}:{settings.LOGS_PORT}')
+        await server.wait_closed()
@@ -0,0 +1,304 @@
+# Multicast one-to-many app deploy, with NACK based repair (see script/swarmlib/mcast.py)
+#
+# The host sends the app bundle once, as sequenced udp multicast chunks to MCAST_DEPLOY_GROUP,
+# and every device running the bundle app_name writes them at their offset in a staging file,
+# keeping a bitmap of the received chunks. The host regularly multicasts the announce packet,
+# to which each device replies (unicast) with the ranges of its missing chunks (NACK), which
+# the host multicasts again. Once all chunks are received, the bundle is checked against its
+# sha256 and extracted into /apps/<app_name> (replacing it), and the device replies DONE.
+# The host then reboots the device, like after an ftp push.
+#
+# Packets all start with b"MSD", the packet type, and <I deploy id:
+#   b"A" announce / status request: <I bundle size, <H chunk size, <H reply port, sha256, app_name
+#   b"D" data: <I chunk index, chunk
+#   b"N" nack (device to host): <H ranges count, then <II first chunk, chunks count for each range
+#   b"K" done (device to host): status byte, 0 if the bundle was committed, 1 if its hash did not match
+#
+# The bundle is a sequence of files: <H path length, path, <I size, content
+
+import board
+import hashlib
+import os
+import socket
+import struct
+import uasyncio
+
+from . import apptree
+from . import gcpolicy
+from . import metrics
+from . import netwatch
+from . import settings
+from . import udp
+
+_MAGIC = b"MSD"
+_HEADER_SIZE = const(8)
+_ANNOUNCE_SIZE = const(48)
+_NACK_MAX_RANGES = const(64)
+
+STAGING_PATH = "/mcast_deploy.bundle"
+
+_M_CHUNKS = metrics.counter("mcast.chunks")
+_M_NACKS = metrics.counter("mcast.nacks")
+_M_COMMITS = metrics.counter("mcast.commits")
+_M_FAILURES = metrics.counter("mcast.failures")
+
+class Session:
+    def __init__(self, deploy_id, size, chunk_size, digest):
+        self.deploy_id = deploy_id
+        self.size = size
+        self.chunk_size = chunk_size
+        self.digest = digest
+        self.count = (size + chunk_size - 1) // chunk_size
+        self.bitmap = bytearray((self.count + 7) // 8)
+        self.received = 0
+        # None while receiving, then 0 (committed) or 1 (hash mismatch)
+        self.status = None
+        self.file = None
+
+    def has(self, index):
+        return self.bitmap[index >> 3] & (1 << (index & 7))
+
+    def missing_ranges(self):
+        ranges = []
+        first = None
+        for index in range(self.count + 1):
+            if index < self.count and not self.has(index):
+                if first is None:
+                    first = index
+            elif first is not None:
+                ranges.append((first, index - first))
+                first = None
+                if len(ranges) == _NACK_MAX_RANGES:
+                    break
+        return ranges
+
+session = None
+
+def beacon_info():
+    if session is None:
+        return None
+    return {
+        "deploy_id": session.deploy_id,
+        "received": session.received,
+        "chunks": session.count,
+        "status": session.status,
+    }
+
+async def _open_session(deploy_id, size, chunk_size, digest):
+    global session
+    if session is not None and session.file is not None:
+        session.file.close()
+    session = None
+
+    # Preallocate the staging file, so that the chunks can be written at their offset
+    zeros = bytearray(chunk_size)
+    with open(STAGING_PATH, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            n = min(remaining, chunk_size)
+            f.write(memoryview(zeros)[0:n])
+            remaining -= n
+            await uasyncio.sleep_ms(0)
+    new_session = Session(deploy_id, size, chunk_size, digest)
+    new_session.file = open(STAGING_PATH, "r+b")
+    session = new_session
+
+def _write_chunk(index, data):
+    if index >= session.count or session.has(index):
+        return
+    session.file.seek(index * session.chunk_size)
+    session.file.write(data)
+    session.bitmap[index >> 3] |= 1 << (index & 7)
+    session.received += 1
+    metrics.inc(_M_CHUNKS)
+
+def _makedirs(path):
+    current = ""
+    for part in path.split("/")[1:-1]:
+        current += "/" + part
+        try:
+            os.mkdir(current)
+        except OSError:
+            pass
+
+def _rmtree(path):
+    for entry in os.ilistdir(path):
+        child = path + "/" + entry[0]
+        if entry[1] & 0x4000:
+            _rmtree(child)
+        else:
+            os.remove(child)
+    os.rmdir(path)
+
+async def _commit():
+    session.file.close()
+    session.file = None
+
+    buffer = bytearray(512)
+    mv = memoryview(buffer)
+    h = hashlib.sha256()
+    with open(STAGING_PATH, "rb") as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            h.update(mv[0:n])
+            await uasyncio.sleep_ms(0)
+    if h.digest() != session.digest:
+        metrics.inc(_M_FAILURES)
+        os.remove(STAGING_PATH)
+        return 1
+
+    # Extract into a new directory, then swap it with the current app directory
+    app_dir = "/apps/" + board.app_name
+    new_dir = app_dir + ".new"
+    try:
+        _rmtree(new_dir)
+    except OSError:
+        pass
+    os.mkdir(new_dir)
+    with open(STAGING_PATH, "rb") as f:
+        while True:
+            header = f.read(2)
+            if len(header) < 2:
+                break
+            path = f.read(struct.unpack("<H", header)[0]).decode()
+            remaining = struct.unpack("<I", f.read(4))[0]
+            target = new_dir + "/" + path
+            _makedirs(target)
+            with open(target, "wb") as out:
+                while remaining > 0:
+                    n = f.readinto(mv[0:min(remaining, len(buffer))])
+                    out.write(mv[0:n])
+                    remaining -= n
+            await uasyncio.sleep_ms(0)
+    # A previous commit interrupted before its cleanup left an old app directory, which the rename would fail on
+    try:
+        _rmtree(app_dir + ".old")
+    except OSError:
+        pass
+    try:
+        os.rename(app_dir, app_dir + ".old")
+    except OSError:
+        pass
+    os.rename(new_dir, app_dir)
+    apptree.changed()
+    try:
+        _rmtree(app_dir + ".old")
+    except OSError:
+        pass
+    os.remove(STAGING_PATH)
+    metrics.inc(_M_COMMITS)
+    return 0
+
+async def _handle_packet(buf, addr, reply_sock):
+    n = len(buf)
+    if n < _HEADER_SIZE or buf[0:3] != _MAGIC:
+        return
+    kind = buf[3]
+    deploy_id = struct.unpack_from("<I", buf, 4)[0]
+
+    if kind == 0x44:  # "D"
+        if n < _HEADER_SIZE + 4:
+            return
+        if session is not None and session.deploy_id == deploy_id and session.status is None:
+            _write_chunk(struct.unpack_from("<I", buf, _HEADER_SIZE)[0], buf[_HEADER_SIZE + 4:])
+        return
+
+    if kind != 0x41 or n < _ANNOUNCE_SIZE:  # "A"
+        return
+    (size, chunk_size, reply_port) = struct.unpack_from("<IHH", buf, _HEADER_SIZE)
+    if size == 0 or chunk_size == 0:
+        # An empty bundle would replace the app with nothing
+        return
+    if buf[_ANNOUNCE_SIZE:].decode() != board.app_name:
+        return
+    reply_addr = (addr[0], reply_port)
+    if session is None or session.deploy_id != deploy_id:
+        await _open_session(deploy_id, size, chunk_size, buf[_HEADER_SIZE + 8:_ANNOUNCE_SIZE])
+
+    if session.status is None and session.received == session.count:
+        session.status = await _commit()
+    if session.status is not None:
+        reply_sock.sendto(_MAGIC + b"K" + struct.pack("<IB", deploy_id, session.status), reply_addr)
+        return
+
+    ranges = session.missing_ranges()
+    reply = bytearray(_MAGIC + b"N" + struct.pack("<IH", deploy_id, len(ranges)))
+    for r in ranges:
+        reply += struct.pack("<II", r[0], r[1])
+    reply_sock.sendto(reply, reply_addr)
+    metrics.inc(_M_NACKS)
+
+def _make_socket(local_addr):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind(("", settings.MCAST_DEPLOY_PORT))
+    member_info = bytes(int(x) for x in settings.MCAST_DEPLOY_GROUP.split(".")) + bytes(int(x) for x in local_addr.split("."))
+    s.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, member_info)
+    return s
+
+def _open_sockets():
+    """
+        A socket joined to the group on each nic with an ip
+    """
+    socks = []
+    for address in netwatch.addresses().values():
+        try:
+            s = _make_socket(address)
+            s.setblocking(False)
+            socks.append(s)
+        except OSError:
+            pass
+    return socks
+
+async def routine_mcast_deploy():
+    global session
+
+    socks = []
+    bound_version = None
+    reply_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        while True:
+            if bound_version != netwatch.version:
+                # A nic link or ip changed: join the group again on the current ips
+                bound_version = netwatch.version
+                for s in socks:
+                    s.close()
+                socks = _open_sockets()
+            if not socks:
+                # No ip yet (or the group could not be joined): try again on the next change, or a bit later
+                await netwatch.wait_change(bound_version, settings.MCAST_DEPLOY_RETRY_MS)
+                bound_version = None
+                continue
+
+            for s in socks:
+                # Drain the socket, the chunks come in bursts
+                while True:
+                    try:
+                        # Chunks are up to 1400 bytes, to fit in an ethernet frame
+                        (buf, addr) = s.recvfrom(1500)
+                    except OSError:
+                        break
+                    gcpolicy.touch()
+                    try:
+                        await _handle_packet(buf, addr, reply_sock)
+                    except ValueError:
+                        # Malformed packet (an app name which is not utf-8, for example): ignored
+                        pass
+                    except OSError as err:
+                        # Filesystem full, for example: drop the session, the host will push by ftp
+                        print("Multicast deploy failed: {}".format(err))
+                        metrics.inc(_M_FAILURES)
+                        if session is not None and session.file is not None:
+                            session.file.close()
+                        session = None
+
+            # Sleep until a packet arrives on the first socket (or the nics are checked again).
+            # The sockets of the other nics are polled, while a deploy is received only.
+            receiving = session is not None and session.status is None and len(socks) > 1
+            await udp.wait_readable(socks[0], settings.MCAST_DEPLOY_POLL_MS if receiving else settings.NETWORK_WAIT_MS)
+    finally:
+        for s in socks:
+            s.close()
+        reply_sock.close()
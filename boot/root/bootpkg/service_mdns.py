@@ -1,42 +1,81 @@
 import select
-import uasyncio
 
 import board
 import hardware
 from . import slimDNS
 
+from . import gcpolicy
+from . import metrics
+from . import netwatch
 from . import settings
+from . import timers
 
-async def routine_mdns():
-    """
-        Broadcast the hostname.local using the mDNS mechanism
-    """
+_M_PACKETS = metrics.counter("mdns.packets")
+_M_REPLIES = metrics.counter("mdns.replies")
+
+class _SlimDNSServer(slimDNS.SlimDNSServer):
+    def process_packet(self, buf, addr):
+        metrics.inc(_M_PACKETS)
+        if super().process_packet(buf, addr):
+            metrics.inc(_M_REPLIES)
+
+def _close(servers):
+    for server in servers:
+        try:
+            server.sock.close()
+        except OSError:
+            pass
 
-    if not settings.MDNS_ENABLE:
-        return
+_seen_version = None
+_poll = None
+_servers = []
 
-    while True:
+def _rebuild():
+    global _seen_version, _poll, _servers
+    _seen_version = netwatch.version
+    _close(_servers)
+    _poll = select.poll()
+    _servers = []
+
+    for local_addr in netwatch.addresses().values():
+        try:
+            server = _SlimDNSServer(local_addr, board.host_name)
+            _poll.register(server.sock, select.POLLIN)
+            _servers.append(server)
+        except OSError:
+            pass
+
+def poll_mdns():
+    """
+        Answer the mDNS queries for the hostname.local.
+        The servers are rebuilt as soon as a nic link or ip changes (see netwatch.py).
+    """
+    global _seen_version
+    if _seen_version != netwatch.version:
+        _rebuild()
 
-        poll = select.poll()
-        servers = []
+    if _servers:
+        try:
+            events = _poll.poll(0)
+            if events:
+                gcpolicy.touch()
+            for event in events:
+                for server in _servers:
+                    if event[0] == server.sock:
+                        server.process_waiting_packets()
+        except OSError:
+            # The nic went down under the sockets: rebuild them on the next run
+            _seen_version = None
 
-        for nic in hardware.nics:
-            try:
-                local_addr = nic.ifconfig()[0]
-                server = slimDNS.SlimDNSServer(local_addr, board.host_name)
-                poll.register(server.sock, select.POLLIN)
-                servers.append(server)
-            except OSError:
-                pass
+def _network_changed(index, old, new):
+    for timer in timers.by_owner.get("mdns", ()):
+        timer.trigger()
 
-        if servers:
-            while True:
-                events = poll.poll(0)
-                for event in events:
-                    for server in servers:
-                        if event[0] == server.sock:
-                            server.process_waiting_packets()
+netwatch.add_listener(_network_changed)
 
-                await uasyncio.sleep_ms(settings.MDNS_POLL_MS)
+def teardown():
+    netwatch.remove_listener(_network_changed)
 
-        await uasyncio.sleep_ms(settings.MDNS_POLL_MS)
+TIMERS = (
+    (poll_mdns, settings.MDNS_POLL_MS, 0),
+)
@@ -0,0 +1,21 @@
+# Serve the binary metrics export to anyone connecting to METRICS_PORT
+
+import uasyncio
+
+from . import metrics
+from . import settings
+
+async def _handle_request(reader, writer):
+    try:
+        writer.write(metrics.export())
+        await writer.drain()
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+async def routine_metrics_server():
+    HOST = "0.0.0.0"
+
+    async with await uasyncio.start_server(_handle_request, HOST, settings.METRICS_PORT) as server:
+        print(f'Metrics server started on {HOST}:{settings.METRICS_PORT}')
+        await server.wait_closed()
@@ -0,0 +1,152 @@
+# Event loop lag and per-routine runtime monitor
+#
+# A sentinel task sleeps MONITOR_SENTINEL_MS in a loop, and measures how late it is woken up:
+# this is the scheduling lag, the time another task kept the loop without awaiting.
+# Routines started through the services registry are also wrapped, so that the time spent
+# in each step (between two awaits) is attributed to the routine name.
+# Steps or lags longer than MONITOR_STALL_MS are counted, and the MONITOR_RING_SIZE longest ones are kept.
+
+import json
+import time
+import uasyncio
+
+from . import services
+from . import settings
+
+# Sentinel lag statistics
+lag_max_ms = 0
+lag_total_ms = 0
+lag_samples = 0
+
+# Per routine statistics, by name: [steps count, total run time in us, longest step in us]
+routines = {}
+
+# The longest stalls: (routine name, duration in ms, ticks_ms when it happened), None for the free slots
+stalls = [None] * settings.MONITOR_RING_SIZE
+stalls_count = 0
+
+def _record_stall(name, duration_ms):
+    """
+        Keep the stall in a free slot, or in place of the shortest one if it is longer
+    """
+    global stalls_count
+    stalls_count += 1
+    shortest = 0
+    for i in range(len(stalls)):
+        if stalls[i] is None:
+            shortest = i
+            break
+        if stalls[i][1] < stalls[shortest][1]:
+            shortest = i
+    if stalls[shortest] is None or duration_ms > stalls[shortest][1]:
+        stalls[shortest] = (name, duration_ms, time.ticks_ms())
+
+def wrap(name, coro):
+    """
+        Wrap a coroutine to measure the time spent in each of its steps
+    """
+    stat = routines.get(name)
+    if stat is None:
+        stat = routines[name] = [0, 0, 0]
+
+    value = None
+    exc = None
+    while True:
+        start = time.ticks_us()
+        try:
+            if exc is None:
+                out = coro.send(value)
+            else:
+                out = coro.throw(exc)
+        except StopIteration as err:
+            return err.value
+        finally:
+            step_us = time.ticks_diff(time.ticks_us(), start)
+            stat[0] += 1
+            stat[1] += step_us
+            if step_us > stat[2]:
+                stat[2] = step_us
+            if step_us >= settings.MONITOR_STALL_MS * 1000:
+                _record_stall(name, step_us // 1000)
+        value = None
+        exc = None
+        try:
+            value = yield out
+        except BaseException as err:
+            exc = err
+
+def worst():
+    """
+        The recorded stalls, longest first
+    """
+    return sorted((s for s in stalls if s), key=lambda s: -s[1])
+
+def beacon_info():
+    w = worst()
+    return {
+        "lag_max_ms": lag_max_ms,
+        "lag_avg_ms": lag_total_ms // lag_samples if lag_samples else 0,
+        "stalls": stalls_count,
+        "worst": w[0][0:2] if w else None,
+    }
+
+def report():
+    now = time.ticks_ms()
+    return {
+        "lag": beacon_info(),
+        "routines": dict((name, {
+            "steps": stat[0],
+            "total_ms": stat[1] // 1000,
+            "max_step_ms": stat[2] // 1000,
+        }) for (name, stat) in routines.items()),
+        "stalls": [{
+            "name": s[0],
+            "duration_ms": s[1],
+            "age_ms": time.ticks_diff(now, s[2]),
+        } for s in worst()],
+    }
+
+def reset():
+    global lag_max_ms, lag_total_ms, lag_samples, stalls_count
+    lag_max_ms = lag_total_ms = lag_samples = stalls_count = 0
+    routines.clear()
+    for i in range(len(stalls)):
+        stalls[i] = None
+
+async def init_monitor():
+    # Wrap every routine started after this point
+    services.task_wrapper = wrap
+
+async def routine_monitor_sentinel():
+    global lag_max_ms, lag_total_ms, lag_samples
+
+    period = settings.MONITOR_SENTINEL_MS
+    while True:
+        stalls_before = stalls_count
+        start = time.ticks_ms()
+        await uasyncio.sleep_ms(period)
+        lag = time.ticks_diff(time.ticks_ms(), start) - period
+        if lag < 0:
+            lag = 0
+        lag_samples += 1
+        lag_total_ms += lag
+        if lag > lag_max_ms:
+            lag_max_ms = lag
+        # A lag no wrapped routine accounts for: unwrapped tasks, like the client connections of the servers
+        if lag >= settings.MONITOR_STALL_MS and stalls_count == stalls_before:
+            _record_stall("?", lag)
+
+async def _handle_request(reader, writer):
+    try:
+        writer.write(json.dumps(report()))
+        await writer.drain()
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+async def routine_monitor_server():
+    HOST = "0.0.0.0"
+
+    async with await uasyncio.start_server(_handle_request, HOST, settings.MONITOR_PORT) as server:
+        print(f'Monitor server started on {HOST}:{settings.MONITOR_PORT}')
+        await server.wait_closed()
@@ -1,6 +1,7 @@
 import hashlib
 import hardware
 
+from . import netwatch
 from . import settings
 
 def create_link_local_ip(nic):
@@ -25,3 +26,12 @@ async def init_network_local_link_ips():
     for nic in hardware.nics:
         print("  - ", nic.ifconfig())
 
+def watch_nics():
+    """
+        Publish the changes of the nics link and ip state (see netwatch.py)
+    """
+    netwatch.check()
+
+TIMERS = (
+    (watch_nics, settings.NETWORK_WATCH_POLL_MS, 0),
+)
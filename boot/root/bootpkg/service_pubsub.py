@@ -0,0 +1,252 @@
+# Udp transport of the publish/subscribe messaging between devices (see pubsub.py)
+#
+# Every PUBSUB_ANNOUNCE_MS, and at once when its topics or its ips change, each device multicasts
+# the topics it subscribes to on PUBSUB_GROUP. A device which just started (or got a new ip) asks
+# the others to announce theirs right away, in unicast.
+# A message is sent in unicast to each device subscribed to its topic, or once on the group when
+# there are at least PUBSUB_MULTICAST_MIN of them (the devices not subscribed ignore it).
+#
+# Packets all start with b"PS", the packet type, the sender ip (4 bytes), <B topic length, and the topic:
+#   b"S" subscriptions announce: no topic, then <B length and name of each subscribed topic
+#   b"Q" subscriptions announce, asking the receivers to reply with their own announce
+#   b"M" message: the payload follows the topic
+#
+# The send and receive buffers are preallocated, the packets are received with readinto().
+# The unicast and the group sockets each have a routine, sleeping until a packet arrives (see udp.py).
+
+import socket
+import time
+
+from . import gcpolicy
+from . import metrics
+from . import netwatch
+from . import pubsub
+from . import settings
+from . import udp
+
+_HEADER_SIZE = const(8)
+
+_M_SENT = metrics.counter("pubsub.sent")
+_M_MULTICASTS = metrics.counter("pubsub.multicasts")
+_M_RECEIVED = metrics.counter("pubsub.received")
+_M_ERRORS = metrics.counter("pubsub.errors")
+
+_out = bytearray(_HEADER_SIZE + 255 + settings.PUBSUB_MAX_PAYLOAD)
+_in = bytearray(_HEADER_SIZE + 255 + settings.PUBSUB_MAX_PAYLOAD)
+
+_sock = None
+_group_sock = None
+# Ips of this device, packed
+_own_ips = []
+
+def beacon_info():
+    return {
+        "topics": pubsub.topics(),
+        "peers": len(set(ip for subs in pubsub.peers.values() for ip in subs)),
+    }
+
+def _pack_ip(ip):
+    return bytes(int(x) for x in ip.split("."))
+
+def _pack(kind, sender, topic, payload):
+    """
+        Write a packet in the send buffer, returns its size
+    """
+    topic = topic.encode()
+    _out[0:2] = b"PS"
+    _out[2] = kind
+    _out[3:7] = sender
+    _out[7] = len(topic)
+    n = _HEADER_SIZE + len(topic)
+    _out[_HEADER_SIZE:n] = topic
+    _out[n:n + len(payload)] = payload
+    return n + len(payload)
+
+def _send_group(n, sender):
+    if hasattr(socket, "IP_MULTICAST_IF"):
+        _sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, sender)
+    _sock.sendto(memoryview(_out)[0:n], (settings.PUBSUB_GROUP, settings.PUBSUB_GROUP_PORT))
+
+def _send(topic, payload, ips):
+    if _sock is None or not _own_ips:
+        return
+    try:
+        if len(ips) >= settings.PUBSUB_MULTICAST_MIN:
+            for sender in _own_ips:
+                n = _pack(ord("M"), sender, topic, payload)
+                _send_group(n, sender)
+            metrics.inc(_M_MULTICASTS)
+        else:
+            n = _pack(ord("M"), _own_ips[0], topic, payload)
+            for ip in ips:
+                _sock.sendto(memoryview(_out)[0:n], (ip, settings.PUBSUB_PORT))
+        metrics.inc(_M_SENT)
+    except OSError:
+        metrics.inc(_M_ERRORS)
+
+def _announce(kind, to_ip=None):
+    if _sock is None:
+        return
+    payload = bytearray()
+    for topic in pubsub.topics():
+        topic = topic.encode()
+        payload += bytes((len(topic),)) + topic
+    try:
+        for sender in _own_ips:
+            n = _pack(kind, sender, "", payload)
+            if to_ip:
+                _sock.sendto(memoryview(_out)[0:n], (to_ip, settings.PUBSUB_PORT))
+                break
+            _send_group(n, sender)
+    except OSError:
+        metrics.inc(_M_ERRORS)
+
+def _handle_packet(n):
+    mv = memoryview(_in)
+    if n < _HEADER_SIZE or _in[0:2] != b"PS":
+        return
+    sender = bytes(mv[3:7])
+    if sender in _own_ips:
+        # Our own multicast, looped back
+        return
+    kind = _in[2]
+    start = _HEADER_SIZE + _in[7]
+    if start > n:
+        metrics.inc(_M_ERRORS)
+        return
+    if kind == 0x4d:  # "M"
+        topic = bytes(mv[_HEADER_SIZE:start]).decode()
+        metrics.inc(_M_RECEIVED)
+        pubsub.deliver(topic, mv[start:n])
+    elif kind == 0x53 or kind == 0x51:  # "S" or "Q"
+        topics = []
+        i = start
+        while i < n:
+            if i + 1 + _in[i] > n:
+                # Truncated
+                metrics.inc(_M_ERRORS)
+                return
+            topics.append(bytes(mv[i + 1:i + 1 + _in[i]]).decode())
+            i += 1 + _in[i]
+        ip = "{}.{}.{}.{}".format(*sender)
+        pubsub.peer_announce(ip, topics, time.ticks_add(time.ticks_ms(), 3 * settings.PUBSUB_ANNOUNCE_MS))
+        if kind == 0x51:
+            _announce(ord("S"), ip)
+
+def _close(s):
+    if s is not None:
+        s.close()
+
+def _open_socket(addresses):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind(("", settings.PUBSUB_PORT))
+    s.setblocking(False)
+    return s
+
+def _open_group_socket(addresses):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind(("", settings.PUBSUB_GROUP_PORT))
+    for address in addresses:
+        try:
+            s.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, _pack_ip(settings.PUBSUB_GROUP) + _pack_ip(address))
+        except OSError:
+            pass
+    s.setblocking(False)
+    return s
+
+def _reopen(s, open_socket):
+    """
+        Close a socket, and open it again on the current ips (None if there is none)
+    """
+    global _own_ips
+    _close(s)
+    addresses = list(netwatch.addresses().values())
+    _own_ips = [_pack_ip(address) for address in addresses]
+    if not addresses:
+        return None
+    try:
+        return open_socket(addresses)
+    except OSError as err:
+        print("Pubsub socket failed: {}".format(err))
+        return None
+
+def _receive(s):
+    while True:
+        try:
+            n = s.readinto(_in)
+        except OSError:
+            n = None
+        if not n:
+            return
+        gcpolicy.touch()
+        try:
+            _handle_packet(n)
+        except (ValueError, IndexError):
+            # A topic which is not utf-8: a stray packet must not crash the routine
+            metrics.inc(_M_ERRORS)
+
+async def routine_pubsub():
+    """
+        Receive the unicast packets, and announce the subscribed topics every PUBSUB_ANNOUNCE_MS
+        (and at once when they change, see _topics_changed())
+    """
+    global _sock
+    seen_version = None
+    last_announce = time.ticks_ms()
+    try:
+        while True:
+            if seen_version != netwatch.version:
+                seen_version = netwatch.version
+                _sock = _reopen(_sock, _open_socket)
+                if _sock is not None:
+                    # New on this network: ask the others for their subscriptions
+                    _announce(ord("Q"))
+                    last_announce = time.ticks_ms()
+            if _sock is None:
+                await netwatch.wait_change(seen_version, settings.PUBSUB_ANNOUNCE_MS)
+                continue
+
+            if time.ticks_diff(time.ticks_ms(), last_announce) >= settings.PUBSUB_ANNOUNCE_MS:
+                _announce(ord("S"))
+                last_announce = time.ticks_ms()
+                pubsub.expire_peers()
+            # Sleep until a packet arrives, the next announce, or the next check of the nics
+            next_announce = settings.PUBSUB_ANNOUNCE_MS - time.ticks_diff(time.ticks_ms(), last_announce)
+            if await udp.wait_readable(_sock, min(next_announce, settings.NETWORK_WAIT_MS)):
+                _receive(_sock)
+    finally:
+        _close(_sock)
+        _sock = None
+
+async def routine_pubsub_group():
+    """
+        Receive the packets multicast on PUBSUB_GROUP
+    """
+    global _group_sock
+    seen_version = None
+    try:
+        while True:
+            if seen_version != netwatch.version:
+                seen_version = netwatch.version
+                _group_sock = _reopen(_group_sock, _open_group_socket)
+            if _group_sock is None:
+                await netwatch.wait_change(seen_version, settings.PUBSUB_ANNOUNCE_MS)
+                continue
+
+            if await udp.wait_readable(_group_sock, settings.NETWORK_WAIT_MS):
+                _receive(_group_sock)
+    finally:
+        _close(_group_sock)
+        _group_sock = None
+
+def _topics_changed():
+    if _sock is not None:
+        _announce(ord("S"))
+
+pubsub._transport = _send
+pubsub._topics_changed = _topics_changed
+
+def teardown():
+    pubsub._transport = None
+    pubsub._topics_changed = None
@@ -4,8 +4,13 @@ import errno
 import sys
 import uasyncio
 
+from . import gcpolicy
+from . import metrics
 from . import settings
 
+_M_REQUESTS = metrics.counter("remote_eval.requests")
+_M_ERRORS = metrics.counter("remote_eval.errors")
+
 async def _handle_request(reader, writer):
     src = None
     try:
@@ -24,18 +29,18 @@ async def _handle_request(reader, writer):
         await writer.wait_closed()
         await reader.wait_closed()
 
+    gcpolicy.touch()
     if src:
+        gcpolicy.collect_if_needed()
+        metrics.inc(_M_REQUESTS)
         try:
             exec(src)
         except Exception as err:
+            metrics.inc(_M_ERRORS)
             print("*** Remote eval exception: ***")
             sys.print_exception(err)
 
 async def routine_remote_eval():
-
-    if not settings.REMOTE_EVAL_ENABLE:
-        return
-
     HOST = "0.0.0.0"
 
     async with await uasyncio.start_server(_handle_request, HOST, settings.REMOTE_EVAL_PORT) as server:
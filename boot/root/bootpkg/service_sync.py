@@ -0,0 +1,178 @@
+# Pipelined binary file sync, on a single tcp stream (see script/swarmlib/sync.py)
+#
+# Unlike ftp, there is no data connection and no reply to wait for between two files: the host
+# sends all its operations at once, and reads the replies (one per operation, in order) meanwhile.
+#
+# Operations, on a connection to SYNC_PORT, each starting with its type and <H path length, path:
+#   b"L" list the tree under path. Reply: for each entry, b"d" <H length, relative path
+#        or b"f" <H length, relative path, <I size, sha256 (32 bytes), then b"e"
+#   b"M" mkdir path (no error if it exists)
+#   b"D" delete path (a directory is deleted with its content, no error if it does not exist)
+#   b"F" <I size, sha256 (32 bytes), data: write the file, through a temporary file checked against the sha256
+#   b"E" end: the connection is closed after replying b"E"
+# Reply of M, D and F: b"K" if done, or b"X" <H length, error message
+#
+# The file data is received into a fixed buffer of the connection, written as it comes.
+
+import hashlib
+import os
+import struct
+import uasyncio
+
+from . import apptree
+from . import gcpolicy
+from . import metrics
+from . import settings
+
+_M_FILES = metrics.counter("sync.files")
+_M_BYTES_IN = metrics.counter("sync.bytes_in")
+_M_DELETES = metrics.counter("sync.deletes")
+_M_FAILURES = metrics.counter("sync.failures")
+
+def _rmtree(path):
+    if os.stat(path)[0] & 0x4000:
+        for entry in os.ilistdir(path):
+            _rmtree(path + "/" + entry[0])
+        os.rmdir(path)
+    else:
+        os.remove(path)
+
+def _sha256(path, buffer):
+    mv = memoryview(buffer)
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            h.update(mv[0:n])
+    return h.digest()
+
+def _entry(kind, path):
+    path = path.encode()
+    return kind + struct.pack("<H", len(path)) + path
+
+async def _list(writer, root, buffer, relative=""):
+    directory = root + ("/" + relative if relative else "")
+    try:
+        entries = list(os.ilistdir(directory))
+    except OSError:
+        return
+    for entry in entries:
+        path = (relative + "/" if relative else "") + entry[0]
+        if entry[1] & 0x4000:
+            writer.write(_entry(b"d", path))
+            await _list(writer, root, buffer, path)
+        else:
+            full_path = root + "/" + path
+            writer.write(_entry(b"f", path) + struct.pack("<I", os.stat(full_path)[6]) + _sha256(full_path, buffer))
+        await writer.drain()
+        gcpolicy.touch()
+
+async def _receive_file(reader, path, size, digest, buffer):
+    """
+        Receive the file data, and write it. All the data is read even if the write fails,
+        so that the next operations can be read. Returns the error message, or None.
+    """
+    tmp_path = path + ".sync"
+    mv = memoryview(buffer)
+    h = hashlib.sha256()
+    error = None
+    try:
+        out = open(tmp_path, "wb")
+    except OSError as err:
+        out = None
+        error = str(err)
+    remaining = size
+    while remaining:
+        n = await reader.readinto(mv[0:min(remaining, len(buffer))])
+        if not n:
+            raise EOFError()
+        remaining -= n
+        metrics.inc(_M_BYTES_IN, n)
+        if out is not None:
+            h.update(mv[0:n])
+            try:
+                out.write(mv[0:n])
+            except OSError as err:
+                # Filesystem full, for example
+                error = str(err)
+                out.close()
+                out = None
+        gcpolicy.touch()
+    if out is not None:
+        out.close()
+        if h.digest() != digest:
+            error = "checksum mismatch"
+    if error is not None:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return error
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    os.rename(tmp_path, path)
+    return None
+
+async def _handle_request(reader, writer):
+    gcpolicy.touch()
+    buffer = bytearray(settings.SYNC_BUFFER_SIZE)
+    try:
+        while True:
+            header = await reader.readexactly(3)
+            op = header[0:1]
+            path = (await reader.readexactly(struct.unpack_from("<H", header, 1)[0])).decode()
+            error = None
+            if op == b"L":
+                await _list(writer, path.rstrip("/"), buffer)
+                writer.write(b"e")
+            elif op == b"M":
+                try:
+                    os.mkdir(path)
+                except OSError:
+                    pass
+            elif op == b"D":
+                try:
+                    _rmtree(path)
+                    apptree.changed()
+                    metrics.inc(_M_DELETES)
+                except OSError as err:
+                    if err.args[0] != 2:  # ENOENT
+                        error = str(err)
+            elif op == b"F":
+                (size,) = struct.unpack("<I", await reader.readexactly(4))
+                digest = await reader.readexactly(32)
+                error = await _receive_file(reader, path, size, digest, buffer)
+                apptree.changed()
+                metrics.inc(_M_FILES)
+            elif op == b"E":
+                writer.write(b"E")
+                await writer.drain()
+                break
+            else:
+                break
+
+            if op != b"L":
+                if error is None:
+                    writer.write(b"K")
+                else:
+                    metrics.inc(_M_FAILURES)
+                    error = error.encode()
+                    writer.write(b"X" + struct.pack("<H", len(error)) + error)
+            await writer.drain()
+    except (OSError, ValueError, EOFError):
+        pass
+    finally:
+        writer.close()
+        await writer.wait_closed()
+        gcpolicy.collect_if_needed()
+
+async def routine_sync_server():
+    HOST = "0.0.0.0"
+
+    async with await uasyncio.start_server(_handle_request, HOST, settings.SYNC_PORT) as server:
+        print(f'Sync server started on {HOST}:{settings.SYNC_PORT}')
+        await server.wait_closed()
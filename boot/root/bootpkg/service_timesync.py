@@ -0,0 +1,200 @@
+# Udp clock synchronization of the devices (see clock.py, and script/time_server)
+#
+# Every TIMESYNC_INTERVAL_MS, the device sends TIMESYNC_SAMPLES requests to the time server, one at a time.
+# The reply with the shortest round trip is kept: the server time is known within +/- half of it,
+# and taken as the time at the middle of the round trip. A failed sync is retried after TIMESYNC_RETRY_MS,
+# doubled on each consecutive failure up to TIMESYNC_INTERVAL_MS.
+#
+# The time server is TIMESYNC_SERVER, or else the first server heard: the servers announce themselves
+# (broadcast) every TIMESYNC_INTERVAL_MS, and the device asks once on each new network (broadcast request).
+# Until a server is heard, the device sends no request.
+#
+# A device can serve its clock to the others (TIMESYNC_SERVE), it is then the reference of the fleet
+# and does not sync itself, unless TIMESYNC_SERVER is set.
+# The socket is not polled: the routine sleeps until a packet arrives (see udp.py), so the requests
+# are served at once.
+#
+# Packets: b"TSQ" <I request id: request, b"TSR" <I request id, <Q unix time in ms: reply, b"TSA": server announce
+
+import socket
+import struct
+import time
+
+from . import clock
+from . import gcpolicy
+from . import metrics
+from . import netwatch
+from . import settings
+from . import udp
+
+_BROADCAST = "255.255.255.255"
+
+_M_SYNCS = metrics.counter("timesync.syncs")
+_M_FAILURES = metrics.counter("timesync.failures")
+_M_SERVED = metrics.counter("timesync.served")
+_M_RTT_MS = metrics.histogram("timesync.rtt_ms", (1, 2, 5, 10, 20, 50, 100))
+
+_out = bytearray(15)
+
+_sock = None
+_request_id = 0
+# The first server heard on this network, when TIMESYNC_SERVER is not set
+_heard = None
+failures = 0
+
+def beacon_info():
+    if not clock.is_synced():
+        return { "synced": False, "serving": settings.TIMESYNC_SERVE, "failures": failures }
+    return {
+        "synced": True,
+        "serving": settings.TIMESYNC_SERVE,
+        "server": clock.server,
+        "offset_ms": clock.offset_ms,
+        "rtt_ms": clock.rtt_ms,
+        "age_s": time.ticks_diff(time.ticks_ms(), clock.synced_ticks) // 1000,
+        "drift_ppm": clock.drift_ppm,
+        "failures": failures,
+    }
+
+def _close():
+    global _sock
+    if _sock is not None:
+        _sock.close()
+    _sock = None
+
+def _open():
+    global _sock
+    _sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    _sock.bind(("", settings.TIMESYNC_PORT))
+    _sock.setblocking(False)
+
+def _receive():
+    """
+        Serve the pending requests, and record the server announces.
+        Returns the first reply received: (request id, server ms, server ip), or None.
+    """
+    global _heard
+    while True:
+        try:
+            (data, addr) = _sock.recvfrom(32)
+        except OSError:
+            return None
+        if len(data) == 7 and data[0:3] == b"TSQ":
+            if settings.TIMESYNC_SERVE:
+                _out[0:3] = b"TSR"
+                _out[3:7] = data[3:7]
+                struct.pack_into("<Q", _out, 7, clock.now_ms())
+                try:
+                    _sock.sendto(_out, addr)
+                    metrics.inc(_M_SERVED)
+                except OSError:
+                    pass
+        elif len(data) == 15 and data[0:3] == b"TSR":
+            (request_id, server_ms) = struct.unpack_from("<IQ", data, 3)
+            return (request_id, server_ms, addr[0])
+        elif data == b"TSA":
+            if _heard is None and not settings.TIMESYNC_SERVE and addr[0] not in netwatch.addresses().values():
+                _heard = addr[0]
+
+def _send(packet, ip):
+    try:
+        _sock.sendto(packet, (ip, settings.TIMESYNC_PORT))
+        return True
+    except OSError:
+        return False
+
+def _next_request():
+    global _request_id
+    _request_id = (_request_id + 1) & 0xffffffff
+    return b"TSQ" + struct.pack("<I", _request_id)
+
+async def _sync(target):
+    """
+        Query the server, returns the sample with the shortest round trip: (server ms, ticks_ms, rtt us, server ip),
+        or None if no reply came
+    """
+    best = None
+    for _ in range(settings.TIMESYNC_SAMPLES):
+        sent_us = time.ticks_us()
+        if not _send(_next_request(), target):
+            return None
+        deadline = time.ticks_add(time.ticks_ms(), settings.TIMESYNC_TIMEOUT_MS)
+        while await udp.wait_readable(_sock, time.ticks_diff(deadline, time.ticks_ms())):
+            reply = _receive()
+            if reply is not None and reply[0] == _request_id:
+                received_ticks = time.ticks_ms()
+                rtt_us = time.ticks_diff(time.ticks_us(), sent_us)
+                metrics.observe(_M_RTT_MS, rtt_us // 1000)
+                if best is None or rtt_us < best[2]:
+                    best = (reply[1] + rtt_us // 2000, received_ticks, rtt_us, reply[2])
+                # Broadcast: the next requests go to the server which replied
+                target = reply[2]
+                break
+            # Stale replies are dropped
+    return best
+
+async def routine_timesync():
+    global failures, _heard
+
+    seen_version = None
+    now = time.ticks_ms()
+    next_sync = now
+    next_announce = now
+    retry_ms = settings.TIMESYNC_RETRY_MS
+
+    while True:
+        if seen_version != netwatch.version:
+            seen_version = netwatch.version
+            _close()
+            _heard = None
+            if netwatch.addresses():
+                try:
+                    _open()
+                except OSError as err:
+                    print("Time sync socket failed: {}".format(err))
+                    _close()
+            # New network: sync and announce at once
+            next_sync = time.ticks_ms()
+            next_announce = next_sync
+            retry_ms = settings.TIMESYNC_RETRY_MS
+            if _sock is not None and settings.TIMESYNC_SERVER is None and not settings.TIMESYNC_SERVE:
+                # Look for a server once, the servers starting later announce themselves
+                _send(_next_request(), _BROADCAST)
+        if _sock is None:
+            await netwatch.wait_change(seen_version, settings.NETWORK_WAIT_MS)
+            continue
+
+        if settings.TIMESYNC_SERVE and time.ticks_diff(time.ticks_ms(), next_announce) >= 0:
+            _send(b"TSA", _BROADCAST)
+            next_announce = time.ticks_add(time.ticks_ms(), settings.TIMESYNC_INTERVAL_MS)
+
+        server = settings.TIMESYNC_SERVER or _heard
+        if server is not None and time.ticks_diff(time.ticks_ms(), next_sync) >= 0:
+            sample = await _sync(server)
+            if sample is None:
+                failures += 1
+                metrics.inc(_M_FAILURES)
+                next_sync = time.ticks_add(time.ticks_ms(), retry_ms)
+                retry_ms = min(retry_ms * 2, settings.TIMESYNC_INTERVAL_MS)
+            else:
+                (server_ms, ticks, rtt_us, server) = sample
+                first = not clock.is_synced()
+                offset = clock.adjust(server_ms, ticks, round(rtt_us / 1000, 1), server, settings.TIMESYNC_STEP_MS, settings.TIMESYNC_MAX_DRIFT_PPM)
+                metrics.inc(_M_SYNCS)
+                if first or abs(offset) > settings.TIMESYNC_STEP_MS:
+                    print("Clock set from {} (offset {} ms, round trip {:.1f} ms)".format(server, offset, rtt_us / 1000))
+                next_sync = time.ticks_add(time.ticks_ms(), settings.TIMESYNC_INTERVAL_MS)
+                retry_ms = settings.TIMESYNC_RETRY_MS
+            gcpolicy.touch()
+
+        # Sleep until a packet arrives (a request, a server heard), the next sync or announce, or the next check of the nics
+        wait_ms = settings.NETWORK_WAIT_MS
+        if server is not None:
+            wait_ms = min(wait_ms, time.ticks_diff(next_sync, time.ticks_ms()))
+        if settings.TIMESYNC_SERVE:
+            wait_ms = min(wait_ms, time.ticks_diff(next_announce, time.ticks_ms()))
+        if await udp.wait_readable(_sock, wait_ms):
+            reply = _receive()
+            if reply is not None and settings.TIMESYNC_SERVER is None and _heard is None and not settings.TIMESYNC_SERVE:
+                # A server replied to the broadcast request
+                _heard = reply[2]
@@ -0,0 +1,241 @@
+# Declarative registry of the boot services
+#
+# A service is only imported when it is enabled in settings, so a disabled
+# service costs no import time, no bytecode and no heap.
+# Its routine_* functions run as tasks, and the periodic functions of its TIMERS table
+# on the shared timer wheel (see timers.py).
+# When a service is unloaded, its teardown() function (if any) is called to undo its import-time
+# registrations (listeners, hooks), and its module is forgotten, with the modules its import pulled in
+# that no other loaded module still uses (netwatch, for example, is shared by several services).
+# The metrics registered by the forgotten modules are unregistered.
+# Services can also be started and stopped at runtime, for example from telnet:
+#
+#   from bootpkg import services
+#   services.start("telnet")
+#   services.stop("ftpd")
+#   services.report()
+
+import gc
+import sys
+
+import uasyncio
+
+from . import metrics
+from . import settings
+from . import timers
+
+# Every known service: (service name, module name inside bootpkg, settings flag enabling it)
+# A None flag means the service is always enabled.
+REGISTRY = (
+    ("timers",      "timers",              None),
+    ("logs",        "service_logs",        "LOGS_ENABLE"),
+    ("gc",          "gcpolicy",            None),
+    ("supervisor",  "supervisor",          "SUPERVISOR_ENABLE"),
+    ("kvstore",     "service_kvstore",     "KVSTORE_ENABLE"),
+    ("monitor",     "service_monitor",     "MONITOR_ENABLE"),
+    ("metrics",     "service_metrics",     "METRICS_ENABLE"),
+    ("network",     "service_network",     None),
+    ("beacon",      "service_beacon",      "BEACON_ENABLE"),
+    ("ftpd",        "service_ftpd",        "FTPD_ENABLE"),
+    ("delta",       "service_delta",       "DELTA_ENABLE"),
+    ("sync",        "service_sync",        "SYNC_ENABLE"),
+    ("upgrade",     "upgrade",             "UPGRADE_ENABLE"),
+    ("mcast",       "service_mcast_deploy", "MCAST_DEPLOY_ENABLE"),
+    ("timesync",    "service_timesync",    "TIMESYNC_ENABLE"),
+    ("pubsub",      "service_pubsub",      "PUBSUB_ENABLE"),
+    ("mdns",        "service_mdns",        "MDNS_ENABLE"),
+    ("remote_eval", "service_remote_eval", "REMOTE_EVAL_ENABLE"),
+    ("telnet",      "service_telnet",      "TELNET_ENABLE"),
+)
+
+_PACKAGE = __name__.rsplit(".", 1)[0]
+
+# Imported service modules, by service name
+modules = {}
+# Incremented when a service module is loaded or unloaded
+version = 0
+# Running routine tasks, by service name
+tasks = {}
+# Heap bytes allocated by importing each service, by service name
+heap_used = {}
+# Modules pulled into sys.modules by the services imports, which unload() can forget
+_imported = set()
+# Metrics registered by each of these modules, by module name
+_metrics = {}
+
+# Optional function wrapping the routines coroutines before they are scheduled: task_wrapper(name, coro)
+task_wrapper = None
+# Optional function running the routines functions, set by the supervisor: routine_runner(qualified name, function)
+routine_runner = None
+
+def _entry(name):
+    for entry in REGISTRY:
+        if entry[0] == name:
+            return entry
+    raise ValueError("unknown service: {}".format(name))
+
+def is_enabled(name):
+    flag = _entry(name)[2]
+    return flag is None or bool(getattr(settings, flag, False))
+
+def enabled():
+    return [entry[0] for entry in REGISTRY if is_enabled(entry[0])]
+
+def load(name):
+    """
+        Import a service module (if not already done), and record its heap cost
+    """
+    global version
+    if name in modules:
+        return modules[name]
+
+    module_name = _PACKAGE + "." + _entry(name)[1]
+    already_imported = set(sys.modules)
+    metrics_before = len(metrics.registry)
+
+    gc.collect()
+    heap_before = gc.mem_alloc()
+    __import__(module_name)
+    gc.collect()
+    heap_used[name] = gc.mem_alloc() - heap_before
+
+    imported = [m for m in sys.modules if m not in already_imported]
+    _imported.update(imported)
+    # The metrics handles are kept in _M_* globals: a metric belongs to the module holding its handle
+    registered = dict((entry[2], entry[0]) for entry in metrics.registry[metrics_before:])
+    for m in imported:
+        for (attr, value) in sys.modules[m].__dict__.items():
+            if attr.startswith("_M_") and value in registered:
+                _metrics.setdefault(m, []).append(registered.pop(value))
+    if registered:
+        _metrics.setdefault(module_name, []).extend(registered.values())
+    modules[name] = sys.modules[module_name]
+    version += 1
+    return modules[name]
+
+def _unused(candidates):
+    """
+        The candidate modules which no other module references (in its globals), even indirectly
+    """
+    module_type = type(settings)
+    package = sys.modules[_PACKAGE]
+    unused = set(candidates)
+    pending = [sys.modules[m] for m in sys.modules if m not in unused]
+    while pending:
+        module = pending.pop()
+        if module is None or module is package:
+            # The package has an attribute for each of its imported modules
+            continue
+        for value in module.__dict__.values():
+            if isinstance(value, module_type):
+                value_name = value.__name__
+                if value_name in unused:
+                    unused.remove(value_name)
+                    pending.append(value)
+    return unused
+
+def unload(name):
+    """
+        Forget a service module and the modules it pulled in that are not used anymore,
+        so the gc can reclaim them, and undo their import-time registrations
+    """
+    global version
+    stop(name)
+    module = modules.pop(name, None)
+    if module is None:
+        return
+    version += 1
+
+    teardown = getattr(module, "teardown", None)
+    if teardown:
+        teardown()
+
+    # The modules of the loaded services are used, the others are forgotten if nothing references them
+    loaded = set(m.__name__ for m in modules.values())
+    unused = _unused(m for m in _imported if m in sys.modules and m not in loaded)
+    package = sys.modules[_PACKAGE]
+    for module_name in unused:
+        _imported.discard(module_name)
+        metrics.unregister(_metrics.pop(module_name, ()))
+        sys.modules.pop(module_name, None)
+        if module_name.startswith(_PACKAGE + "."):
+            try:
+                delattr(package, module_name[len(_PACKAGE) + 1:])
+            except AttributeError:
+                pass
+    gc.collect()
+
+def load_enabled():
+    return [load(name) for name in enabled()]
+
+def routine_names(module, prefix="routine"):
+    return [attr for attr in dir(module) if attr.startswith(prefix + "_")]
+
+def spawn(name, coro):
+    """
+        Schedule a routine coroutine, named for instrumentation
+    """
+    if task_wrapper:
+        coro = task_wrapper(name, coro)
+    return uasyncio.get_event_loop().create_task(coro)
+
+def spawn_routine(owner, module, routine_name):
+    """
+        Schedule a routine function of a module (supervised, if the supervisor is enabled)
+    """
+    function = getattr(module, routine_name)
+    if routine_runner:
+        coro = routine_runner(owner + "." + routine_name, function)
+    else:
+        coro = function()
+    return spawn(routine_name, coro)
+
+def start(name):
+    """
+        Import the service if needed, and start its routines and timers.
+        Init functions are not run here: they are run once at boot by main().
+    """
+    if name in tasks:
+        return
+    module = load(name)
+    tasks[name] = [spawn_routine(name, module, routine_name) for routine_name in routine_names(module)]
+    timers.register(name, module)
+
+def stop(name, unload_module=False):
+    """
+        Cancel the running routines and the timers of a service
+    """
+    for task in tasks.pop(name, ()):
+        task.cancel()
+    timers.cancel_owner(name)
+    if unload_module:
+        unload(name)
+
+def heap_saved():
+    """
+        Heap bytes saved by not loading the disabled services.
+        Each disabled service is imported once to measure it, and unloaded right after
+        (undoing its registrations, see unload()).
+    """
+    saved = 0
+    for entry in REGISTRY:
+        name = entry[0]
+        if is_enabled(name):
+            continue
+        if name not in heap_used:
+            load(name)
+            unload(name)
+        saved += heap_used[name]
+    return saved
+
+def report():
+    for entry in REGISTRY:
+        name = entry[0]
+        state = "running" if name in tasks else ("loaded" if name in modules else "not loaded")
+        heap = heap_used.get(name)
+        print("  - {:<12} {:<8} {:<10} heap={}".format(
+            name,
+            "enabled" if is_enabled(name) else "disabled",
+            state,
+            "?" if heap is None else heap,
+        ))
@@ -3,6 +3,8 @@
 #########
 # This boot package code version
 VERSION = "1.0.0"
+# The libraries shared by the apps, synced by script/push_code and added to sys.path at boot
+LIBS_DIR = "/libs"
 
 #########
 # FTPD is an FTP service used to upload app code
@@ -51,3 +53,169 @@ TELNET_PORT = 23
 #########
 # Set up pseudorandom 169.254.xxx.xxx ips to each network interface (no DNS, no gateway)
 NETWORK_SET_LOCAL_LINK_IP = True
+# Interval of the nics link and ip state checks: the services re-bind at most this long after a cable pull or an ip change
+NETWORK_WATCH_POLL_MS = 100
+# The services sleeping until a packet arrives wake up at least this often, to re-bind their sockets after a nic change
+NETWORK_WAIT_MS = 1000
+
+#########
+# MONITOR measures the event loop scheduling lag, and the time spent by each routine
+# between two awaits, to find routines blocking the loop.
+# The report is sent as json to anyone connecting to MONITOR_PORT, and summarized in the beacon.
+#########
+MONITOR_ENABLE = False
+MONITOR_PORT = 1140
+# The period of the sentinel task measuring the scheduling lag
+MONITOR_SENTINEL_MS = 10
+# A lag or a routine step longer than this is recorded as a stall
+MONITOR_STALL_MS = 50
+# Number of stalls kept by the monitor (the longest ones)
+MONITOR_RING_SIZE = 8
+
+#########
+# TIMERS: the periodic work of the services and apps, run by a single timer wheel task (see bootpkg/timers.py)
+#########
+# The timers due within the same slot of this many ms run in the same wakeup
+TIMERS_RESOLUTION_MS = 5
+# Number of slots of the wheel (the timers further than a turn of the wheel wait for more turns)
+TIMERS_SLOTS = 64
+
+#########
+# GC policy, used instead of collecting on every request
+#########
+# Let the VM collect by itself after this many bytes have been allocated (0 to keep the VM default)
+GC_ALLOC_THRESHOLD = 32768
+# Services collect on a request only if the free heap is below this
+GC_MIN_FREE = 16384
+# Collect when no service reported activity for this long (0 to disable idle collections)
+GC_IDLE_MS = 1000
+# ... and only if at least this many bytes were allocated since the last collection
+GC_IDLE_MIN_ALLOC = 4096
+
+#########
+# SUPERVISOR: a crashed routine is restarted alone after a backoff, instead of resetting the device
+# (see bootpkg/supervisor.py). Disabled, any crash resets the device.
+#########
+SUPERVISOR_ENABLE = True
+# Backoff before the first restart, doubled on each consecutive crash of the routine, up to the max
+SUPERVISOR_BACKOFF_MS = 100
+SUPERVISOR_BACKOFF_MAX_MS = 60000
+# A routine which ran this long before crashing is restarted after the initial backoff again
+SUPERVISOR_STABLE_MS = 60000
+# The device is reset past this many crashes (all routines) within the window
+SUPERVISOR_BUDGET = 10
+SUPERVISOR_BUDGET_WINDOW_MS = 600000
+
+#########
+# METRICS: counters, gauges and histograms of the services and apps,
+# exported in binary to anyone connecting to METRICS_PORT (see script/scrape_metrics)
+#########
+METRICS_ENABLE = True
+METRICS_PORT = 1141
+# Number of preallocated metric values (a counter or gauge uses one, a histogram its buckets count + 2)
+METRICS_MAX_VALUES = 96
+
+#########
+# LOGS: the last log lines (prints, uncaught exceptions, services logs) are kept in a ring,
+# and streamed to anyone connecting to LOGS_PORT (see script/tail_logs)
+#########
+LOGS_ENABLE = True
+LOGS_PORT = 1142
+# Number of lines kept in the ring
+LOGS_RING_SIZE = 32
+# Longer lines are truncated
+LOGS_LINE_MAX = 120
+# How often the followers are sent the new lines
+LOGS_FOLLOW_MS = 200
+
+#########
+# DELTA: block level delta sync of the large app files (see script/push_code)
+#########
+DELTA_ENABLE = True
+DELTA_PORT = 1143
+# Block size of the signatures (the host can ask for another one)
+DELTA_BLOCK_SIZE = 1024
+
+#########
+# MCAST_DEPLOY: one-to-many app deploy over udp multicast (see script/push_code --multicast)
+#########
+MCAST_DEPLOY_ENABLE = True
+MCAST_DEPLOY_GROUP = "239.77.83.1"
+MCAST_DEPLOY_PORT = 1144
+# The sockets of the nics other than the first one are polled this often during a deploy
+MCAST_DEPLOY_POLL_MS = 5
+# Retry joining the group this often while no nic has an ip (or sooner, on a network change)
+MCAST_DEPLOY_RETRY_MS = 10000
+
+#########
+# KVSTORE: append-only key-value stores of the apps, flushed in the background (see bootpkg/kvstore.py)
+#########
+KVSTORE_ENABLE = True
+# Outside of /apps, so that push_code does not delete the stores
+KVSTORE_DIR = "/store"
+# The writes are batched, and appended this long after the first one at most, or once this many bytes are pending
+KVSTORE_FLUSH_MS = 1000
+KVSTORE_FLUSH_SIZE = 4096
+# A log is compacted when it is this many times larger than its live records, from this size
+KVSTORE_COMPACT_RATIO = 2
+KVSTORE_COMPACT_MIN_SIZE = 16384
+# RAM cache of the values read, per store
+KVSTORE_CACHE_SIZE = 2048
+
+#########
+# PUBSUB: publish/subscribe messaging between the devices apps, over udp (see bootpkg/pubsub.py)
+# (no security whatsoever)
+#########
+PUBSUB_ENABLE = True
+# Messages sent in unicast, and the announce replies
+PUBSUB_PORT = 1145
+# Subscriptions announces, and the messages sent to many subscribers at once
+PUBSUB_GROUP = "239.77.83.2"
+PUBSUB_GROUP_PORT = 1146
+# The time between two announces of the subscribed topics (a silent device is forgotten after 3 of them)
+PUBSUB_ANNOUNCE_MS = 2000
+# A message is multicast once on the group, instead of sent to each subscriber, from this many subscribers
+PUBSUB_MULTICAST_MIN = 3
+# Largest message payload, and number of messages kept for each subscription until they are received
+PUBSUB_MAX_PAYLOAD = 512
+PUBSUB_QUEUE_LEN = 8
+
+#########
+# SYNC: pipelined binary file sync on a single tcp stream, used by script/push_code instead of ftp
+# (no security whatsoever)
+#########
+SYNC_ENABLE = True
+SYNC_PORT = 1147
+# Size of the buffer the files are received into
+SYNC_BUFFER_SIZE = 1024
+
+#########
+# UPGRADE: network upgrade of the boot code, staged by script/upgrade_boot and swapped at boot by /bootswap.py
+# (no security whatsoever)
+#########
+UPGRADE_ENABLE = True
+# The first boot of a new boot code is confirmed once the network stayed up this long...
+UPGRADE_CONFIRM_MS = 10000
+# ... and rolled back if the network is not up after this long
+UPGRADE_TRIAL_MS = 120000
+
+#########
+# TIMESYNC: udp clock synchronization, from script/time_server or a device serving its clock (see bootpkg/clock.py)
+# (no security whatsoever)
+#########
+TIMESYNC_ENABLE = True
+TIMESYNC_PORT = 1148
+# Ip of the time server, None to sync from the first server heard (the servers announce themselves).
+# Without a server set or heard, the device sends no request.
+TIMESYNC_SERVER = None
+# Serve the device clock to the others (the device is then the reference, and only syncs itself from TIMESYNC_SERVER)
+TIMESYNC_SERVE = False
+# Time between two syncs (and two announces of a serving device), and after a failed one (doubled on each consecutive failure)
+TIMESYNC_INTERVAL_MS = 60000
+TIMESYNC_RETRY_MS = 5000
+# Requests of a sync (the reply with the shortest round trip is kept), and the time to wait for each reply
+TIMESYNC_SAMPLES = 8
+TIMESYNC_TIMEOUT_MS = 200
+# Larger offsets are stepped, smaller ones also correct the drift estimate, up to TIMESYNC_MAX_DRIFT_PPM
+TIMESYNC_STEP_MS = 100
+TIMESYNC_MAX_DRIFT_PPM = 500
@@ -292,6 +292,7 @@ class SlimDNSServer:
         # from the mutlicast port we multicast the reply but if it
         # came from any other port we unicast the reply.
         self.sock.sendto(buf[:o], (_MDNS_ADDR, _MDNS_PORT) if addr[0] == _MDNS_PORT else addr)
+        return True
 
     def process_waiting_packets(self):
         # Handle all the packets that can be read immediately and
@@ -324,7 +325,7 @@ class SlimDNSServer:
         # each, or sooner if the answer_callback function returns True
         p = bytearray(len(q)+12)
         pack_into("!HHHHHH", p, 0,
-                  1, 0, 1, 0, 0, 0, 0)
+                  1, 0, 1, 0, 0, 0)
         p[12:] = q
 
         self._pending_question = q
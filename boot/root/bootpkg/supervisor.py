@@ -0,0 +1,98 @@
+# Supervisor of the routines of the hardware, the services and the app
+#
+# A routine raising an exception is restarted alone, after a backoff doubling on each consecutive
+# crash (from SUPERVISOR_BACKOFF_MS to SUPERVISOR_BACKOFF_MAX_MS). A routine which ran for
+# SUPERVISOR_STABLE_MS before crashing is restarted after the initial backoff again.
+# Past SUPERVISOR_BUDGET crashes (all routines) within SUPERVISOR_BUDGET_WINDOW_MS, the exception
+# is let through to the event loop exception handler, which resets the device (see main.py).
+# The exceptions of the timers callbacks (see timers.py) are counted as crashes too, by timer name.
+#
+# The crash counts are reported in the beacon, and the crashes recorded in the logs ring.
+
+import time
+import uasyncio
+
+from . import logring
+from . import metrics
+from . import services
+from . import settings
+from . import timers
+
+_M_CRASHES = metrics.counter("supervisor.crashes")
+_M_RESTARTS = metrics.counter("supervisor.restarts")
+
+# Crash statistics of the routines which crashed: {name: [crashes, consecutive crashes, last error, last crash ticks]}
+stats = {}
+crashes = 0
+# Ticks of the last crashes, for the failure budget
+_recent = []
+
+def beacon_info():
+    if not crashes:
+        return None
+    last = max(stats.items(), key=lambda item: item[1][3])
+    return {
+        "crashes": crashes,
+        "routines": dict((name, stat[0]) for (name, stat) in stats.items()),
+        "last": "{}: {}".format(last[0], last[1][2]),
+    }
+
+def _over_budget(now):
+    _recent.append(now)
+    while _recent and time.ticks_diff(now, _recent[0]) > settings.SUPERVISOR_BUDGET_WINDOW_MS:
+        _recent.pop(0)
+    return len(_recent) > settings.SUPERVISOR_BUDGET
+
+def _record(name, err, now, stable):
+    global crashes
+    crashes += 1
+    metrics.inc(_M_CRASHES)
+    stat = stats.get(name)
+    if stat is None:
+        stat = stats[name] = [0, 0, None, now]
+    stat[0] += 1
+    stat[1] = 1 if stable else stat[1] + 1
+    stat[2] = "{}: {}".format(type(err).__name__, err)[0:60]
+    stat[3] = now
+    return stat
+
+def timer_failed(name, err):
+    """
+        Count the exception of a timer callback as a crash (the timer keeps running), raise it past the failure budget
+    """
+    now = time.ticks_ms()
+    stat = _record(name, err, now, True)
+    if _over_budget(now):
+        print("Timer {} failed, failure budget exceeded".format(name))
+        raise err
+    logring.log_exception(name, err)
+    print("Timer {} failed ({})".format(name, stat[2]))
+
+async def supervise(name, function):
+    """
+        Run the routine function, restarting it when it raises
+    """
+    while True:
+        started = time.ticks_ms()
+        try:
+            return await function()
+        except uasyncio.CancelledError:
+            raise
+        except Exception as err:
+            now = time.ticks_ms()
+            stat = _record(name, err, now, time.ticks_diff(now, started) >= settings.SUPERVISOR_STABLE_MS)
+
+            if _over_budget(now):
+                print("Routine {} crashed, failure budget exceeded".format(name))
+                raise
+
+            logring.log_exception(name, err)
+            backoff = min(settings.SUPERVISOR_BACKOFF_MS << min(stat[1] - 1, 16), settings.SUPERVISOR_BACKOFF_MAX_MS)
+            print("Routine {} crashed ({}), restarting in {} ms".format(name, stat[2], backoff))
+        await uasyncio.sleep_ms(backoff)
+        metrics.inc(_M_RESTARTS)
+
+async def init_supervisor():
+    # Supervise every routine started after this point
+    services.routine_runner = supervise
+    timers.failure_handler = timer_failed
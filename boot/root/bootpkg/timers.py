@@ -0,0 +1,272 @@
+# Periodic and delayed callbacks, run by a single timer wheel task
+#
+#   from bootpkg import timers
+#
+#   t = timers.every(1000, blink, jitter_ms=50)
+#   timers.after(500, lambda: print("half a second later"))
+#   t.trigger()     # run at once, the next runs keep their schedule
+#   t.cancel()
+#
+# Services and apps can also declare their periodic functions in a TIMERS table, started and cancelled
+# with the service (see services.py), or with the app:
+#
+#   TIMERS = ((poll_sensor, 100, 0),)      # (function, period ms, jitter ms)
+#
+# Instead of a task sleeping in a loop per job, the callbacks are kept in TIMERS_SLOTS slots of
+# TIMERS_RESOLUTION_MS, and the wheel task only wakes up for the next slot holding a due callback:
+# the callbacks due within the same slot run in the same wakeup (up to TIMERS_RESOLUTION_MS late, never early).
+# The runs of a periodic callback are scheduled from its first one, so they do not drift with the time
+# the callback or the wakeups take. They are aligned on the multiples of their period (in ticks), so that
+# the timers whose periods are multiples of each other share their wakeups. A random jitter (up to jitter_ms)
+# can be added to each run, to spread the work of many devices instead.
+# Runs missed while the loop was stalled are skipped, and counted.
+#
+# A callback is a function, run within the wheel task (it must be short), or an async function,
+# started as a task (a run is skipped while the previous one is not done).
+# Exceptions of the callbacks are recorded in the logs ring, and the timer keeps running.
+# With the supervisor, they are counted as crashes of the timer instead, against its failure budget.
+
+import random
+import time
+import uasyncio
+
+from . import logring
+from . import metrics
+from . import settings
+
+_M_WAKEUPS = metrics.counter("timers.wakeups")
+_M_RUNS = metrics.counter("timers.runs")
+_M_MISSED = metrics.counter("timers.missed")
+_M_ERRORS = metrics.counter("timers.errors")
+
+_RESOLUTION_MS = settings.TIMERS_RESOLUTION_MS
+_SLOTS = settings.TIMERS_SLOTS
+
+_slots = [[] for i in range(_SLOTS)]
+# The next slot to process, and the ticks at which it is due
+_cursor = 0
+_cursor_ticks = time.ticks_ms()
+# The ticks at which the wheel task wakes up next (None: no timer), set to wake it up earlier
+_wake_ticks = None
+_wake = uasyncio.Event()
+
+# Active timers, by owner (None for the timers started with every() and after())
+by_owner = {}
+wakeups = 0
+
+# Optional function called when a callback raises, set by the supervisor: failure_handler(timer name, exception).
+# It records the exception, and raises it to let it through to the event loop exception handler.
+failure_handler = None
+
+class Timer:
+
+    def __init__(self, callback, period_ms, jitter_ms, name, owner):
+        self.callback = callback
+        self.period_ms = period_ms
+        self.jitter_ms = jitter_ms
+        self.name = name
+        self.owner = owner
+        self.active = True
+        self.running = False
+        self.runs = 0
+        self.missed = 0
+        self.errors = 0
+        self.max_ms = 0
+        # The scheduled time of the next run (without its jitter), and the slot the timer is in
+        self._base = None
+        self._slot = None
+        self._rounds = 0
+
+    def cancel(self):
+        if not self.active:
+            return
+        self.active = False
+        _unslot(self)
+        owned = by_owner.get(self.owner)
+        if owned is not None and self in owned:
+            owned.remove(self)
+
+    def trigger(self):
+        """
+            Run the callback at the next wakeup, the next runs keep their schedule
+        """
+        if self.active:
+            _unslot(self)
+            _insert(self, time.ticks_ms())
+
+def _unslot(timer):
+    if timer._slot is not None:
+        _slots[timer._slot].remove(timer)
+        timer._slot = None
+
+def _insert(timer, deadline):
+    global _wake_ticks, _cursor_ticks
+    if _wake_ticks is None and not any(_slots):
+        # The wheel was idle: its cursor stayed behind
+        _cursor_ticks = time.ticks_ms()
+    ahead = max(0, (time.ticks_diff(deadline, _cursor_ticks) + _RESOLUTION_MS - 1) // _RESOLUTION_MS)
+    timer._rounds = ahead // _SLOTS
+    timer._slot = (_cursor + ahead) % _SLOTS
+    _slots[timer._slot].append(timer)
+    due = time.ticks_add(_cursor_ticks, ahead * _RESOLUTION_MS)
+    if _wake_ticks is None or time.ticks_diff(due, _wake_ticks) < 0:
+        _wake_ticks = due
+        _wake.set()
+
+def _jitter(timer):
+    return random.getrandbits(16) % (timer.jitter_ms + 1) if timer.jitter_ms else 0
+
+def _schedule(timer, now):
+    """
+        Insert a periodic timer for its next run after now
+    """
+    late = time.ticks_diff(now, timer._base)
+    if late >= 0:
+        runs = late // timer.period_ms + 1
+        if runs > 1:
+            timer.missed += runs - 1
+            metrics.inc(_M_MISSED, runs - 1)
+        timer._base = time.ticks_add(timer._base, runs * timer.period_ms)
+    _insert(timer, time.ticks_add(timer._base, _jitter(timer)))
+
+def _add(callback, delay_ms, period_ms, jitter_ms, name, owner):
+    timer = Timer(callback, period_ms, jitter_ms, name or getattr(callback, "__name__", "timer"), owner)
+    timer._base = time.ticks_add(time.ticks_ms(), delay_ms)
+    by_owner.setdefault(owner, []).append(timer)
+    _insert(timer, time.ticks_add(timer._base, _jitter(timer)))
+    return timer
+
+def every(period_ms, callback, jitter_ms=0, name=None, owner=None):
+    """
+        Run callback every period_ms (the first time within period_ms, plus the jitter)
+    """
+    return _add(callback, period_ms - time.ticks_ms() % period_ms, period_ms, jitter_ms, name, owner)
+
+def after(delay_ms, callback, name=None, owner=None):
+    """
+        Run callback once, after delay_ms
+    """
+    return _add(callback, delay_ms, None, 0, name, owner)
+
+def register(owner, module):
+    """
+        Start the timers of the TIMERS table of a module
+    """
+    for (callback, period_ms, jitter_ms) in getattr(module, "TIMERS", ()):
+        every(period_ms, callback, jitter_ms, owner + "." + callback.__name__, owner)
+
+def cancel_owner(owner):
+    for timer in list(by_owner.get(owner, ())):
+        timer.cancel()
+    by_owner.pop(owner, None)
+
+def _failed(timer, err):
+    timer.errors += 1
+    metrics.inc(_M_ERRORS)
+    if failure_handler:
+        failure_handler(timer.name, err)
+    else:
+        logring.log_exception(timer.name, err)
+
+async def _run_async(timer, coro):
+    try:
+        await coro
+    except Exception as err:
+        _failed(timer, err)
+    finally:
+        timer.running = False
+
+def _run(timer, now):
+    if timer.period_ms is None:
+        timer.cancel()
+    else:
+        _schedule(timer, now)
+    if timer.running:
+        timer.missed += 1
+        metrics.inc(_M_MISSED)
+        return
+    timer.runs += 1
+    metrics.inc(_M_RUNS)
+    started = time.ticks_ms()
+    try:
+        result = timer.callback()
+        if result is not None and hasattr(result, "send"):
+            timer.running = True
+            uasyncio.create_task(_run_async(timer, result))
+    except Exception as err:
+        _failed(timer, err)
+    timer.max_ms = max(timer.max_ms, time.ticks_diff(time.ticks_ms(), started))
+
+def _advance(now):
+    """
+        Process the slots due until now, and run their due timers
+    """
+    global _cursor, _cursor_ticks
+    due = []
+    revolutions = time.ticks_diff(now, _cursor_ticks) // _RESOLUTION_MS // _SLOTS
+    if revolutions > 0:
+        # Slept over whole revolutions of the wheel (long periods): skip them at once,
+        # the timers which were due meanwhile (stalled loop) run when their slot comes
+        for slot in _slots:
+            for timer in slot:
+                timer._rounds = max(0, timer._rounds - revolutions)
+        _cursor_ticks = time.ticks_add(_cursor_ticks, revolutions * _SLOTS * _RESOLUTION_MS)
+    while time.ticks_diff(now, _cursor_ticks) >= 0:
+        slot = _slots[_cursor]
+        i = 0
+        while i < len(slot):
+            timer = slot[i]
+            if timer._rounds:
+                timer._rounds -= 1
+                i += 1
+            else:
+                slot.pop(i)
+                timer._slot = None
+                due.append(timer)
+        _cursor = (_cursor + 1) % _SLOTS
+        _cursor_ticks = time.ticks_add(_cursor_ticks, _RESOLUTION_MS)
+    for timer in due:
+        if timer.active:
+            _run(timer, now)
+
+def _next_wakeup():
+    """
+        The ticks of the next slot holding a due timer, None if there is no timer
+    """
+    best = None
+    for k in range(_SLOTS):
+        slot = _slots[(_cursor + k) % _SLOTS]
+        if not slot:
+            continue
+        distance = k + min(timer._rounds for timer in slot) * _SLOTS
+        if best is None or distance < best:
+            best = distance
+            if distance < _SLOTS:
+                # The later slots can only be further away
+                break
+    return None if best is None else time.ticks_add(_cursor_ticks, best * _RESOLUTION_MS)
+
+def report():
+    for (owner, owned) in by_owner.items():
+        for timer in owned:
+            print("  - {:<32} every {:>6} ms runs={} missed={} errors={} max={} ms".format(
+                timer.name, timer.period_ms or "-", timer.runs, timer.missed, timer.errors, timer.max_ms))
+    print("  {} wakeups".format(wakeups))
+
+async def routine_timers():
+    global _wake_ticks, wakeups
+    while True:
+        _wake_ticks = _next_wakeup()
+        _wake.clear()
+        if _wake_ticks is None:
+            await _wake.wait()
+        else:
+            delay = time.ticks_diff(_wake_ticks, time.ticks_ms())
+            if delay > 0:
+                try:
+                    await uasyncio.wait_for_ms(_wake.wait(), delay)
+                except uasyncio.TimeoutError:
+                    pass
+        wakeups += 1
+        metrics.inc(_M_WAKEUPS)
+        _advance(time.ticks_ms())
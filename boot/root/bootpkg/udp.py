@@ -0,0 +1,41 @@
+# Waiting for the packets of a udp socket, instead of polling it
+#
+#   from bootpkg import udp
+#
+#   sock.setblocking(False)
+#   while True:
+#       if await udp.wait_readable(sock, settings.NETWORK_WAIT_MS):
+#           (data, addr) = sock.recvfrom(1500)
+#       ... (check netwatch.version, the sockets of an old network are not readable anymore) ...
+#
+# The task waits in the uasyncio io queue, like the tasks reading a stream: the event loop polls
+# the sockets of the waiting tasks while it has nothing else to run, and wakes up the task when
+# a packet arrives. An idle service does not wake up at all until its timeout.
+
+import uasyncio
+
+class _Readable:
+    """
+        Awaited until the socket is readable
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def __iter__(self):
+        yield uasyncio.core._io_queue.queue_read(self.sock)
+
+    __await__ = __iter__
+
+async def _readable(sock):
+    await _Readable(sock)
+
+async def wait_readable(sock, timeout_ms):
+    """
+        Wait until a packet can be received on sock, at most timeout_ms. Returns False on timeout.
+    """
+    try:
+        await uasyncio.wait_for_ms(_readable(sock), max(0, timeout_ms))
+        return True
+    except uasyncio.TimeoutError:
+        return False
@@ -0,0 +1,86 @@
+# Network upgrade of the boot code, the device side of script/upgrade_boot (see /bootswap.py)
+#
+# script/upgrade_boot mirrors the new boot code into /boot_next with the sync service, then calls
+# commit() with remote eval: the tree hash of /boot_next is checked against the one of the host
+# (no file changed, missing or extra), the upgrade is staged and the device reboots into it.
+#
+# During the first boot of the new code (trial), the upgrade service confirms it once the network
+# stayed up UPGRADE_CONFIRM_MS, and resets the device (rolling it back) if the network is not up
+# after UPGRADE_TRIAL_MS.
+
+import bootswap
+import machine
+import time
+import uasyncio
+
+from . import apptree
+from . import metrics
+from . import netwatch
+from . import settings
+
+_M_COMMITS = metrics.counter("upgrade.commits")
+_M_REFUSED = metrics.counter("upgrade.refused")
+
+# The tree hash of the last commit refused, for script/upgrade_boot
+refused = None
+
+def beacon_info():
+    state = bootswap.read_state()
+    info = { "state": state["state"] }
+    for key in ("failed", "error"):
+        if state.get(key):
+            info[key] = state[key]
+    if refused:
+        info["refused"] = refused
+    return info
+
+async def _reset():
+    # Let the logs go first
+    await uasyncio.sleep_ms(500)
+    machine.reset()
+
+async def commit(tree_hash):
+    """
+        Stage the boot code of /boot_next, and reboot into it, if its tree hash is tree_hash
+    """
+    global refused
+    if bootswap.read_state()["state"] == "trial":
+        reason = "the current boot code is not confirmed yet"
+    else:
+        try:
+            staged = await apptree.dir_hash(bootswap.NEXT_DIR)
+        except OSError:
+            staged = None
+        reason = None if staged == tree_hash else "{} staged".format(staged and staged[0:16])
+    if reason:
+        refused = tree_hash
+        metrics.inc(_M_REFUSED)
+        print("Boot upgrade {} refused: {}".format(tree_hash[0:16], reason))
+        return
+    bootswap.stage(tree_hash)
+    metrics.inc(_M_COMMITS)
+    print("Boot upgrade {} staged, rebooting".format(tree_hash[0:16]))
+    await _reset()
+
+async def routine_upgrade():
+    if bootswap.read_state()["state"] != "trial":
+        return
+    tree_hash = bootswap.state["hash"]
+    started = time.ticks_ms()
+    up_since = None
+    seen = None
+    while True:
+        now = time.ticks_ms()
+        if netwatch.addresses():
+            if up_since is None:
+                up_since = now
+            if time.ticks_diff(now, up_since) >= settings.UPGRADE_CONFIRM_MS:
+                bootswap.confirm()
+                print("Boot upgrade {} confirmed".format(tree_hash[0:16]))
+                return
+        else:
+            up_since = None
+            if time.ticks_diff(now, started) >= settings.UPGRADE_TRIAL_MS:
+                print("Boot upgrade {}: no network after {} s, rolling back".format(tree_hash[0:16], settings.UPGRADE_TRIAL_MS // 1000))
+                await _reset()
+        seen = await netwatch.wait_change(seen, 1000)
@@ -0,0 +1,184 @@
+# Swap of the boot code staged by a network upgrade, and rollback of a new boot code which fails
+# (see bootpkg/upgrade.py and script/upgrade_boot)
+#
+# It runs from main.py before bootpkg is imported, so it only depends on the filesystem and board.py,
+# and it is not upgraded over the network itself (script/program_code_boot installs it).
+#
+# The boot code is /bootpkg and /hardwares/<hardware_name>. An upgrade is staged as the same tree
+# in /boot_next, then the state in /boot_upgrade.json goes through:
+#   staged       /boot_next is complete: at the next boot, the current code is moved to /boot_prev
+#                and /boot_next takes its place (the app.py and hardware.py generated for the board are kept).
+#                If the swap raises, the parts already moved are put back: rolled_back
+#   trial        the new code runs its first boot, bootpkg/upgrade.py confirms it once the network is up.
+#                If the device boots again before (a crash, a reset, no network), or if bootpkg raises
+#                while booting, /boot_prev is moved back: rolled_back
+#   confirmed    /boot_prev is removed
+#
+# Each step of the swap and of the rollback is a rename, done only if it was not done yet, so that
+# a reset in the middle is resumed at the next boot. The state is written to a temporary file, then renamed.
+
+import json
+import os
+
+import board
+
+STATE_PATH = "/boot_upgrade.json"
+NEXT_DIR = "/boot_next"
+PREV_DIR = "/boot_prev"
+# Generated for each board by script/program_code_boot, kept across the upgrades
+GENERATED = ("app.py", "hardware.py")
+
+# The upgrade state: state, hash (of the installed boot code), and staged, previous, failed, error
+state = None
+
+def _exists(path):
+    try:
+        os.stat(path)
+        return True
+    except OSError:
+        return False
+
+def _rmtree(path):
+    if os.stat(path)[0] & 0x4000:
+        for entry in list(os.ilistdir(path)):
+            _rmtree(path + "/" + entry[0])
+        os.rmdir(path)
+    else:
+        os.remove(path)
+
+def _make_parents(path):
+    parent = ""
+    for part in path.strip("/").split("/")[:-1]:
+        parent += "/" + part
+        if not _exists(parent):
+            os.mkdir(parent)
+
+def _copy(src, dst):
+    with open(src, "rb") as f:
+        data = f.read()
+    with open(dst + ".tmp", "wb") as f:
+        f.write(data)
+    os.rename(dst + ".tmp", dst)
+
+def parts():
+    """
+        The directories of the boot code, relative to the root
+    """
+    return ("bootpkg", "hardwares/" + board.hardware_name)
+
+def read_state():
+    global state
+    if state is None:
+        for path in (STATE_PATH, STATE_PATH + ".tmp"):
+            try:
+                with open(path) as f:
+                    state = json.load(f)
+                break
+            except (OSError, ValueError):
+                pass
+        else:
+            # Programmed before the network upgrades
+            state = { "state": "unknown", "hash": None }
+    return state
+
+def _write_state(**changes):
+    global state
+    # Changed only once written, so that a failed write can be undone
+    new_state = dict(read_state())
+    new_state.update(changes)
+    with open(STATE_PATH + ".tmp", "w") as f:
+        json.dump(new_state, f)
+    try:
+        os.remove(STATE_PATH)
+    except OSError:
+        pass
+    os.rename(STATE_PATH + ".tmp", STATE_PATH)
+    state = new_state
+
+def stage(tree_hash):
+    """
+        Install the boot code of /boot_next at the next boot, its tree hash was checked
+    """
+    _write_state(state="staged", staged=tree_hash)
+
+def _swap():
+    for part in parts():
+        (live, new, old) = ("/" + part, NEXT_DIR + "/" + part, PREV_DIR + "/" + part)
+        if not _exists(new):
+            continue
+        if _exists(live):
+            # The boot code of an older upgrade
+            if _exists(old):
+                _rmtree(old)
+            _make_parents(old)
+            os.rename(live, old)
+        os.rename(new, live)
+    for name in GENERATED:
+        if not _exists("/bootpkg/" + name) and _exists(PREV_DIR + "/bootpkg/" + name):
+            _copy(PREV_DIR + "/bootpkg/" + name, "/bootpkg/" + name)
+    if _exists(NEXT_DIR):
+        _rmtree(NEXT_DIR)
+
+def _rollback(error):
+    for part in parts():
+        (live, old) = ("/" + part, PREV_DIR + "/" + part)
+        if _exists(old):
+            if _exists(live):
+                _rmtree(live)
+            os.rename(old, live)
+    if _exists(PREV_DIR):
+        _rmtree(PREV_DIR)
+    print("Boot upgrade {} rolled back: {}".format((state["hash"] or "")[0:16], error))
+    _write_state(state="rolled_back", hash=state.get("previous"), failed=state["hash"], error=error)
+
+def _unswap(error):
+    """
+        Put back the boot code moved by a _swap which raised. A part was swapped (or its live tree moved away)
+        if its staged tree is gone (or its live tree is missing): otherwise its /boot_prev tree is the one of an older upgrade
+    """
+    for part in parts():
+        (live, new, old) = ("/" + part, NEXT_DIR + "/" + part, PREV_DIR + "/" + part)
+        if _exists(old) and (not _exists(new) or not _exists(live)):
+            if _exists(live):
+                _rmtree(live)
+            os.rename(old, live)
+    for path in (PREV_DIR, NEXT_DIR):
+        if _exists(path):
+            _rmtree(path)
+    print("Boot upgrade {} rolled back: {}".format((state["staged"] or "")[0:16], error))
+    _write_state(state="rolled_back", staged=None, failed=state["staged"], error=error)
+
+def boot():
+    """
+        Install the staged boot code, or roll back the one on trial if it was not confirmed
+    """
+    read_state()
+    if state["state"] == "staged":
+        print("Boot upgrade {}: installing".format(state["staged"][0:16]))
+        try:
+            _swap()
+            _write_state(state="trial", hash=state["staged"], previous=state["hash"], staged=None, failed=None, error=None)
+        except Exception as err:
+            _unswap("{}: {}".format(type(err).__name__, err))
+    elif state["state"] == "trial":
+        _rollback("not confirmed before the next boot")
+
+def confirm():
+    """
+        Keep the boot code on trial. Returns False if it was not on trial.
+    """
+    if read_state()["state"] != "trial":
+        return False
+    _write_state(state="confirmed")
+    if _exists(PREV_DIR):
+        _rmtree(PREV_DIR)
+    return True
+
+def failed(err):
+    """
+        bootpkg raised err while booting: if it is on trial, roll back to the previous boot code and reset
+    """
+    if read_state()["state"] == "trial":
+        _rollback("{}: {}".format(type(err).__name__, err))
+        import machine
+        machine.reset()
@@ -1,4 +1,16 @@
-from bootpkg import main
+import bootswap
+
+# Install the boot code staged by a network upgrade, or roll back a failed one.
+# The device boots anyway if that fails: it could not be upgraded over the network anymore otherwise
+try:
+    bootswap.boot()
+except Exception as err:
+    print("Boot upgrade error: {}: {}".format(type(err).__name__, err))
 
 if __name__ == "__main__":
-    main()
+    try:
+        from bootpkg import main
+        main()
+    except Exception as err:
+        bootswap.failed(err)
+        raise
@@ -0,0 +1,99 @@
+#
+# Performance benchmarks of the services hot paths and of the deploy tooling.
+# They run against simulated devices (see swarmlib.simulator), see script/run_benchmarks.
+#
+# Each benchmark module has a run() function returning a list of results made with result().
+#
+
+import contextlib
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+
+from swarmlib.simulator import create_devices
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+SCRIPT_DIR = os.path.join(SRC_DIR, "script")
+BOOTPKG_DIR = os.path.join(SRC_DIR, "boot", "root", "bootpkg")
+
+# The benchmark devices use high indexes and their own port offset, not to collide with script/simulate_devices
+BENCH_FIRST_INDEX = 5000
+BENCH_PORT_OFFSET = 30000
+
+# Benchmark modules, in run order
+MODULES = [
+    "bench_simulator",
+    "bench_ftpd",
+    "bench_mdns",
+    "bench_beacon",
+    "bench_telnet",
+    "bench_push",
+]
+
+class Skipped(Exception):
+    """
+        Raised by a benchmark which cannot run in this environment
+    """
+
+def result(name, value, unit, higher_is_better=True):
+    return { "name": name, "value": value, "unit": unit, "higher_is_better": higher_is_better }
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+def median(samples):
+    return statistics.median(samples)
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+
+def best_of(repeat, f):
+    """
+        Shortest duration of repeat calls of f, the least disturbed by the host load
+    """
+    durations = []
+    for i in range(repeat):
+        with Timer() as t:
+            f()
+        durations.append(t.elapsed)
+    return min(durations)
+
+def wait_port(ip, port, timeout=20):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection((ip, port), timeout=1).close()
+            return
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+@contextlib.contextmanager
+def sim_devices(count=1, settings=None):
+    """
+        Run simulated devices in this process for the duration of the block
+    """
+    with tempfile.TemporaryDirectory(prefix="micro-swarm-bench-") as root:
+        devices = create_devices(count, root, first_index=BENCH_FIRST_INDEX, echo=False,
+            port_offset=BENCH_PORT_OFFSET, beacon_ip="127.0.0.9", settings=settings)
+        for device in devices:
+            device.start()
+        try:
+            for device in devices:
+                wait_port(device.ip, 21 + BENCH_PORT_OFFSET)
+            yield devices
+        finally:
+            for device in devices:
+                device.stop()
+            for device in devices:
+                device.join(5)
@@ -0,0 +1,49 @@
+#
+# Beacon: device encode cost, and host decode rate of the beacons of 1,000 devices
+#
+
+import json
+
+from swarmlib.discovery import parse_beacon
+
+from . import best_of, result, sim_devices
+
+ENCODES = 2000
+FLEET_SIZE = 1000
+REPEAT = 5
+
+def run():
+    results = []
+
+    with sim_devices(1) as (device,):
+        service_beacon = device.import_module("bootpkg.service_beacon")
+
+        static = service_beacon.static_beacon_content()
+        elapsed = best_of(REPEAT, lambda: [service_beacon.static_beacon_content() for i in range(ENCODES // 10)])
+        results.append(result("beacon.static_encode_cost", elapsed / (ENCODES // 10) * 1e6, "us", higher_is_better=False))
+
+        elapsed = best_of(REPEAT, lambda: [service_beacon.encode_beacon(static) for i in range(ENCODES)])
+        results.append(result("beacon.encode_cost", elapsed / ENCODES * 1e6, "us", higher_is_better=False))
+        content = service_beacon.encode_beacon(static)
+        results.append(result("beacon.size", len(content), "bytes", higher_is_better=False))
+
+    # The same beacon, as sent by FLEET_SIZE different devices
+    template = json.loads(content)
+    packets = []
+    for i in range(FLEET_SIZE):
+        ip = f"10.0.{i // 250}.{i % 250 + 1}"
+        template["ifconfigs"] = [[ip, "255.255.0.0", "0.0.0.0", "0.0.0.0"]]
+        template["settings"]["board"]["host_name"] = f"device-{i}"
+        packets.append((json.dumps(template).encode(), ip))
+
+    devices = {}
+    def decode():
+        devices.clear()
+        for (data, ip) in packets:
+            if ip not in devices:
+                devices[ip] = parse_beacon(data, ip)
+    elapsed = best_of(REPEAT, decode)
+    assert len(devices) == FLEET_SIZE
+    results.append(result("beacon.host_decode_rate", FLEET_SIZE / elapsed, "beacons/s"))
+
+    return results
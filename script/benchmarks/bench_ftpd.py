@@ -0,0 +1,76 @@
+#
+# auftpd: STOR/RETR throughput, per-command and listing latency
+#
+# Each measurement is taken after a warm-up, and is the median of several rounds,
+# so that a single slow transfer (scheduling, delayed ack) does not decide the result.
+#
+
+import ftplib
+import io
+import os
+
+from . import BENCH_PORT_OFFSET, Timer, median, percentile, result, sim_devices
+
+FILE_SIZE = 256 * 1024
+TRANSFERS = 8
+ROUNDS = 7
+COMMANDS = 200
+LISTINGS = 20
+
+def _rounds(f):
+    """
+        Run f once to warm up, then ROUNDS times, and return the median duration
+    """
+    f()
+    durations = []
+    for i in range(ROUNDS):
+        with Timer() as t:
+            f()
+        durations.append(t.elapsed)
+    return median(durations)
+
+def run():
+    results = []
+    payload = os.urandom(FILE_SIZE)
+
+    with sim_devices(1) as (device,):
+        ftp = ftplib.FTP()
+        ftp.connect(device.ip, 21 + BENCH_PORT_OFFSET, timeout=10)
+        ftp.login()
+
+        def store():
+            for i in range(TRANSFERS):
+                ftp.storbinary(f"STOR /bench_{i}.bin", io.BytesIO(payload))
+        elapsed = _rounds(store)
+        results.append(result("ftpd.stor_throughput", FILE_SIZE * TRANSFERS / elapsed / 1e6, "MB/s"))
+
+        def retrieve():
+            for i in range(TRANSFERS):
+                received = bytearray()
+                ftp.retrbinary(f"RETR /bench_{i}.bin", received.extend)
+                assert bytes(received) == payload
+        elapsed = _rounds(retrieve)
+        results.append(result("ftpd.retr_throughput", FILE_SIZE * TRANSFERS / elapsed / 1e6, "MB/s"))
+
+        for (name, command) in (("noop", "NOOP"), ("size", "SIZE /bench_0.bin"), ("cwd", "CWD /apps")):
+            ftp.sendcmd(command)
+            samples = []
+            for i in range(COMMANDS):
+                with Timer() as t:
+                    ftp.sendcmd(command)
+                samples.append(t.elapsed * 1000)
+            results.append(result(f"ftpd.{name}_latency_median", median(samples), "ms", higher_is_better=False))
+            results.append(result(f"ftpd.{name}_latency_p95", percentile(samples, 95), "ms", higher_is_better=False))
+
+        for (name, listing) in (("list_latency", lambda: ftp.nlst("/bootpkg")), ("list_full_latency", lambda: ftp.retrlines("LIST /bootpkg", lambda line: None))):
+            listing()
+            samples = []
+            for i in range(LISTINGS):
+                with Timer() as t:
+                    listing()
+                samples.append(t.elapsed * 1000)
+            results.append(result(f"ftpd.{name}", median(samples), "ms", higher_is_better=False))
+
+        ftp.quit()
+
+    return results
@@ -0,0 +1,62 @@
+#
+# slimDNS: process_packet rate and reply latency
+#
+
+import importlib.util
+import os
+import struct
+
+from . import BOOTPKG_DIR, best_of, result
+
+PACKETS = 20000
+REPEAT = 5
+HOST_NAME = "bench-device"
+LOCAL_ADDR = "169.254.1.2"
+
+class _FakeSocket:
+    def __init__(self):
+        self.sent = 0
+
+    def sendto(self, data, addr):
+        self.sent += 1
+
+def _load_slimdns():
+    # slimDNS runs unmodified under CPython, it is loaded alone (without bootpkg)
+    spec = importlib.util.spec_from_file_location("bench_slimDNS", os.path.join(BOOTPKG_DIR, "slimDNS", "__init__.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def _server(slimDNS):
+    # A server advertising HOST_NAME.local, without socket nor name conflict resolution
+    server = slimDNS.SlimDNSServer.__new__(slimDNS.SlimDNSServer)
+    server.local_addr = LOCAL_ADDR
+    server.sock = _FakeSocket()
+    server.hostname = slimDNS.check_name(HOST_NAME + ".local")
+    server._reply_buffer = None
+    server._pending_question = None
+    server.answered = False
+    server.adverts = [ slimDNS.pack_answer(server.hostname, 1, 1, 120, slimDNS.dotted_ip_to_bytes(LOCAL_ADDR)) ]
+    return server
+
+def _query(slimDNS, name):
+    question = slimDNS.pack_question(name, 1, 1)
+    return memoryview(struct.pack("!HHHHHH", 0, 0, 1, 0, 0, 0) + bytes(question))
+
+def run():
+    slimDNS = _load_slimdns()
+    server = _server(slimDNS)
+    addr = ("169.254.9.9", 5353)
+
+    results = []
+    for (name, query) in (("match", _query(slimDNS, HOST_NAME + ".local")), ("other", _query(slimDNS, "other-device.local"))):
+        def process():
+            for i in range(PACKETS):
+                server.process_packet(query, addr)
+        elapsed = best_of(REPEAT, process)
+        results.append(result(f"mdns.process_packet_{name}_rate", PACKETS / elapsed, "packets/s"))
+        if name == "match":
+            assert server.sock.sent == PACKETS * REPEAT
+            results.append(result("mdns.reply_latency", elapsed / PACKETS * 1e6, "us", higher_is_better=False))
+
+    return results
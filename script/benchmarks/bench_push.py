@@ -0,0 +1,50 @@
+#
+# End-to-end push_code wall time for 1, 10 and 100 simulated devices,
+# with the sync service, and with ftp when lftp is installed
+#
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import SCRIPT_DIR, Timer, result
+
+FLEET_SIZES = (1, 10, 100)
+DEVICES_PER_PROCESS = 25
+
+def _push(count, name, *args):
+    with Timer() as t:
+        # Without waiting for the devices to beacon after their reboot: only the push itself is measured
+        # (forced, as the simulated devices already have the app)
+        push = subprocess.run([sys.executable, os.path.join(SCRIPT_DIR, "push_code"), "--force", "--no-wait", *args], capture_output=True)
+    if push.returncode or b"ALL OK." not in push.stdout:
+        raise RuntimeError(f"push_code {' '.join(args)} failed on {count} devices:\n{push.stdout.decode()}")
+    return result(f"push_code.{name}_{count}_devices", t.elapsed, "s", higher_is_better=False)
+
+def run():
+    results = []
+    for count in FLEET_SIZES:
+        with tempfile.TemporaryDirectory(prefix="micro-swarm-bench-") as root:
+            simulator = subprocess.Popen([
+                    sys.executable, os.path.join(SCRIPT_DIR, "simulate_devices"), str(count),
+                    "--quiet", "--root", root, "--processes", str(-(-count // DEVICES_PER_PROCESS)),
+                ],
+                stdout=subprocess.DEVNULL,
+            )
+            try:
+                # Let the devices boot
+                time.sleep(3 + count / 20)
+                results.append(_push(count, "wall_time"))
+                if shutil.which("lftp") is not None:
+                    # Let the devices reboot
+                    time.sleep(3 + count / 20)
+                    results.append(_push(count, "ftp_wall_time", "--ftp"))
+            finally:
+                simulator.terminate()
+                simulator.wait()
+
+    return results
+
@@ -0,0 +1,33 @@
+#
+# Simulator: boot and reboot time of a fleet of devices sharing this process
+# (their threads import into sys.modules concurrently, a device failing to boot fails the benchmark)
+#
+
+import time
+
+from . import BENCH_PORT_OFFSET, result, sim_devices, wait_port
+
+FLEET_SIZE = 20
+
+def run():
+    start = time.perf_counter()
+    with sim_devices(FLEET_SIZE) as devices:
+        boot_time = time.perf_counter() - start
+
+        # Reset them all at once: each one rebuilds its namespace while the others import
+        start = time.perf_counter()
+        for device in devices:
+            device.reset()
+        deadline = time.time() + 20
+        while any(device.resets == 0 for device in devices):
+            if time.time() > deadline:
+                raise TimeoutError("the simulated devices did not reset")
+            time.sleep(0.01)
+        for device in devices:
+            wait_port(device.ip, 21 + BENCH_PORT_OFFSET)
+        reboot_time = time.perf_counter() - start
+
+    return [
+        result(f"simulator.boot_time_{FLEET_SIZE}_devices", boot_time, "s", higher_is_better=False),
+        result(f"simulator.reboot_time_{FLEET_SIZE}_devices", reboot_time, "s", higher_is_better=False),
+    ]
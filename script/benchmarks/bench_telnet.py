@@ -0,0 +1,33 @@
+#
+# Telnet: paste throughput (the code is executed line by line by the simulated repl)
+#
+
+import socket
+
+from . import BENCH_PORT_OFFSET, Timer, result, sim_devices
+
+PASTE_LINES = 2000
+END_MARK = b"BENCH-END-MARK"
+
+def run():
+    paste = b"".join(b"bench_value_%d = %d\r" % (i, i) for i in range(PASTE_LINES)) + b"print('" + END_MARK + b"')\r"
+
+    with sim_devices(1) as (device,):
+        s = socket.create_connection((device.ip, 23 + BENCH_PORT_OFFSET), timeout=30)
+        try:
+            with Timer() as t:
+                s.sendall(paste)
+                received = b""
+                # The echo contains the mark between quotes, wait for the printed one
+                while b"\r\n" + END_MARK + b"\r\n" not in received:
+                    data = s.recv(65536)
+                    if not data:
+                        raise ConnectionError("telnet connection closed")
+                    received = received[-len(END_MARK) - 4:] + data
+        finally:
+            s.close()
+
+    return [
+        result("telnet.paste_throughput", len(paste) / t.elapsed / 1000, "kB/s"),
+        result("telnet.paste_lines_rate", PASTE_LINES / t.elapsed, "lines/s"),
+    ]
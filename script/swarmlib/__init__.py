@@ -0,0 +1 @@
+# Shared code of the micro-swarm host scripts
@@ -0,0 +1,20 @@
+#
+# The files of an app, as deployed on the devices
+#
+
+import os
+
+def is_ignored(name):
+    return name == "__pycache__" or name.startswith(".")
+
+def app_files(app_dir):
+    """
+        Relative paths (with / separators) of the deployed files of an app directory, sorted
+    """
+    files = []
+    for (dirpath, dirnames, filenames) in os.walk(app_dir):
+        dirnames[:] = [d for d in dirnames if not is_ignored(d)]
+        for filename in filenames:
+            if not is_ignored(filename):
+                files.append(os.path.relpath(os.path.join(dirpath, filename), app_dir).replace(os.sep, "/"))
+    return sorted(files)
@@ -0,0 +1,187 @@
+#
+# Deploy artifact of an app, built once per push for all the devices running the app,
+# and cached on disk between runs, keyed by the app tree hash.
+# The boot code upgraded over the network (see script/upgrade_boot) is built as an artifact too.
+#
+# An artifact directory contains:
+#   files/          the deployed files (the app directory without __pycache__ and dot files)
+#   manifest.json   the app name, the tree hash, and the path, size and sha256 of each file
+#   bundle.bin      the files as a multicast deploy bundle (see swarmlib/mcast.py)
+#
+# The file hashes are cached by path, size and mtime, so that an unchanged app is not read again.
+#
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from .apptree import app_files
+from .mcast import build_bundle
+
+CACHE_DIR = os.environ.get("MICRO_SWARM_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "micro-swarm"))
+
+# Number of artifacts kept in the cache, per app
+KEEP_ARTIFACTS = 4
+
+def tree_hash(files):
+    """
+        Hash of an app tree, from the sorted (path, sha256 hex) of its files:
+        sha256 of "<path>\\0<sha256 hex>\\n" for each file
+    """
+    h = hashlib.sha256()
+    for (path, digest) in sorted(files):
+        h.update(f"{path}\0{digest}\n".encode())
+    return h.hexdigest()
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(65536), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class Artifact:
+
+    def __init__(self, path, manifest, cached):
+        self.path = path
+        self.app_name = manifest["app_name"]
+        self.tree_hash = manifest["tree_hash"]
+        self.files = manifest["files"]
+        # True if the artifact was found in the cache
+        self.cached = cached
+        self._bundle = None
+
+    @property
+    def files_dir(self):
+        return os.path.join(self.path, "files")
+
+    @property
+    def size(self):
+        return sum(f["size"] for f in self.files)
+
+    def bundle(self):
+        if self._bundle is None:
+            with open(os.path.join(self.path, "bundle.bin"), "rb") as f:
+                self._bundle = f.read()
+        return self._bundle
+
+def boot_files(src_dir, hardware_name):
+    """
+        {relative path: local path} of the boot code upgraded over the network: bootpkg (without
+        the app.py and hardware.py generated for each board) and hardwares/<hardware_name>
+    """
+    files = {}
+    for (relative, local_dir) in (
+        ("bootpkg", os.path.join(src_dir, "boot", "root", "bootpkg")),
+        (f"hardwares/{hardware_name}", os.path.join(src_dir, "boot", "hardwares", hardware_name)),
+    ):
+        for path in app_files(local_dir):
+            if relative == "bootpkg" and path in ("app.py", "hardware.py"):
+                continue
+            files[f"{relative}/{path}"] = os.path.join(local_dir, path)
+    return files
+
+def boot_tree_hash(src_dir, hardware_name):
+    """
+        Tree hash of the boot code, as recorded by the devices in /boot_upgrade.json
+    """
+    return tree_hash((path, file_sha256(local_path)) for (path, local_path) in boot_files(src_dir, hardware_name).items())
+
+def _hash_files(sources, index):
+    """
+        (path, size, sha256) of the files of {relative path: local path}, sorted by path,
+        using and updating the index of the known hashes
+    """
+    result = []
+    for path in sorted(sources):
+        st = os.stat(sources[path])
+        key = os.path.abspath(sources[path])
+        known = index.get(key)
+        if known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            digest = known[2]
+        else:
+            digest = file_sha256(sources[path])
+            index[key] = [st.st_size, st.st_mtime_ns, digest]
+        result.append((path, st.st_size, digest))
+    return result
+
+def _artifact_name(directory_name):
+    """
+        The name of the app of an artifact directory "<app_name>-<tree hash prefix>"
+        (the app name can contain dashes, like boot-<hardware_name>)
+    """
+    return directory_name.rpartition("-")[0]
+
+def _prune(artifacts_dir, app_name, keep):
+    entries = [e for e in os.scandir(artifacts_dir) if _artifact_name(e.name) == app_name and e.is_dir()]
+    entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    for entry in entries[keep:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+def build_artifact(app_dir, app_name, cache_dir=CACHE_DIR):
+    """
+        The artifact of the app directory, from the cache if it was already built.
+        Raises FileNotFoundError if the directory does not exist (its empty tree would delete the app on the devices).
+    """
+    if not os.path.isdir(app_dir):
+        raise FileNotFoundError(f"{app_dir} not found")
+    return _build(dict((path, os.path.join(app_dir, path)) for path in app_files(app_dir)), app_name, cache_dir)
+
+def build_boot_artifact(src_dir, hardware_name, cache_dir=CACHE_DIR):
+    """
+        The artifact of the boot code of a hardware (named boot-<hardware_name>), from the cache if it was already built
+    """
+    return _build(boot_files(src_dir, hardware_name), f"boot-{hardware_name}", cache_dir)
+
+def _build(sources, app_name, cache_dir):
+    artifacts_dir = os.path.join(cache_dir, "artifacts")
+    os.makedirs(artifacts_dir, exist_ok=True)
+
+    index_path = os.path.join(cache_dir, "hashes.json")
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+    files = _hash_files(sources, index)
+    with open(index_path + ".tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(index_path + ".tmp", index_path)
+
+    digest = tree_hash((path, sha) for (path, size, sha) in files)
+    path = os.path.join(artifacts_dir, f"{app_name}-{digest[0:16]}")
+
+    manifest_path = os.path.join(path, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        # Mark it as recently used, for the pruning
+        os.utime(path)
+        return Artifact(path, manifest, cached=True)
+
+    # Built in a temporary directory, renamed once complete
+    tmp_path = tempfile.mkdtemp(prefix=f".{app_name}-", dir=artifacts_dir)
+    try:
+        os.mkdir(os.path.join(tmp_path, "files"))
+        for (file_path, size, sha) in files:
+            target = os.path.join(tmp_path, "files", file_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(sources[file_path], target)
+        with open(os.path.join(tmp_path, "bundle.bin"), "wb") as f:
+            f.write(build_bundle(os.path.join(tmp_path, "files")))
+        manifest = {
+            "app_name": app_name,
+            "tree_hash": digest,
+            "files": [{ "path": file_path, "size": size, "sha256": sha } for (file_path, size, sha) in files],
+        }
+        with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.rename(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    _prune(artifacts_dir, app_name, KEEP_ARTIFACTS)
+    return Artifact(path, manifest, cached=False)
@@ -0,0 +1,162 @@
+#
+# Host side of the block level delta sync (see boot/root/bootpkg/service_delta.py)
+#
+# The signatures of the device copy are fetched, the blocks of the device copy found at any
+# offset of the local file (with the rsync rolling checksum), and only the reconstruction
+# script is sent: copies of the device blocks, and the local data in between.
+#
+
+import asyncio
+import hashlib
+import struct
+
+SIG_SIZE = 12
+
+def weak_checksum(data):
+    a = sum(data)
+    b = sum((len(data) - i) * x for (i, x) in enumerate(data))
+    return ((b & 0xffff) << 16) | (a & 0xffff)
+
+def strong_checksum(data):
+    return hashlib.sha256(data).digest()[0:8]
+
+def parse_signatures(data):
+    return [struct.unpack_from("<I8s", data, offset) for offset in range(0, len(data), SIG_SIZE)]
+
+def compute_delta(new, old_size, signatures, block_size):
+    """
+        The operations rebuilding new from the device file of old_size bytes having these block signatures:
+        ("C", first block, blocks count) copies device blocks, ("D", bytes) sends data
+    """
+    ops = []
+    literal_start = 0
+
+    def flush_literal(end):
+        if end > literal_start:
+            ops.append(("D", new[literal_start:end]))
+
+    def add_copy(index):
+        if ops and ops[-1][0] == "C" and ops[-1][1] + ops[-1][2] == index:
+            ops[-1] = ("C", ops[-1][1], ops[-1][2] + 1)
+        else:
+            ops.append(("C", index, 1))
+
+    # Only the full blocks are looked up while rolling, the last partial one is checked at the end
+    full_blocks = old_size // block_size
+    table = {}
+    for (index, (weak, strong)) in enumerate(signatures[0:full_blocks]):
+        table.setdefault(weak, []).append(index)
+
+    i = 0
+    length = len(new)
+    L = block_size
+    if table and length >= L:
+        window = new[0:L]
+        a = sum(window)
+        b = sum((L - k) * x for (k, x) in enumerate(window))
+        while True:
+            matched = None
+            candidates = table.get(((b & 0xffff) << 16) | (a & 0xffff))
+            if candidates:
+                strong = strong_checksum(new[i:i + L])
+                for index in candidates:
+                    if signatures[index][1] == strong:
+                        matched = index
+                        break
+            if matched is not None:
+                flush_literal(i)
+                add_copy(matched)
+                i += L
+                literal_start = i
+                if i + L > length:
+                    break
+                window = new[i:i + L]
+                a = sum(window)
+                b = sum((L - k) * x for (k, x) in enumerate(window))
+            else:
+                if i + L >= length:
+                    break
+                (out, into) = (new[i], new[i + L])
+                a += into - out
+                b += a - L * out
+                i += 1
+
+    # The last partial block of the device file, at the end of the local file
+    tail_size = old_size - full_blocks * block_size
+    if tail_size and length - tail_size >= literal_start:
+        tail = new[length - tail_size:]
+        (weak, strong) = signatures[full_blocks]
+        if weak_checksum(tail) == weak and strong_checksum(tail) == strong:
+            flush_literal(length - tail_size)
+            add_copy(full_blocks)
+            literal_start = length
+
+    flush_literal(length)
+    return ops
+
+def encode_ops(ops):
+    out = bytearray()
+    for op in ops:
+        if op[0] == "C":
+            out += b"C" + struct.pack("<II", op[1], op[2])
+        else:
+            out += b"D" + struct.pack("<I", len(op[1])) + op[1]
+    out += b"E"
+    return bytes(out)
+
+class DeltaClient:
+    """
+        A connection to the delta service of a device, syncing files one after the other
+    """
+
+    def __init__(self, ip, port, block_size=1024, timeout=30):
+        self.ip = ip
+        self.port = port
+        self.block_size = block_size
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def __aenter__(self):
+        async with asyncio.timeout(self.timeout):
+            (self.reader, self.writer) = await asyncio.open_connection(self.ip, self.port)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+    async def signatures(self, remote_path):
+        self.writer.write(f"SIGS {self.block_size} {remote_path}\n".encode())
+        await self.writer.drain()
+        (size, count) = (int(x) for x in (await self.reader.readline()).split())
+        return (size, parse_signatures(await self.reader.readexactly(count * SIG_SIZE)))
+
+    async def sync(self, local_path, remote_path):
+        """
+            Update the device file remote_path with local_path content.
+            Returns (file size, bytes of the reconstruction script sent), the script is empty if the file was up to date.
+        """
+        with open(local_path, "rb") as f:
+            new = f.read()
+
+        async with asyncio.timeout(self.timeout):
+            (old_size, signatures) = await self.signatures(remote_path)
+
+        ops = compute_delta(new, max(old_size, 0), signatures, self.block_size)
+        full_blocks = (len(new) + self.block_size - 1) // self.block_size
+        if old_size == len(new) and (not new or ops == [("C", 0, full_blocks)]):
+            return (len(new), 0)
+
+        script = encode_ops(ops)
+        self.writer.write(f"PATCH {len(new)} {hashlib.sha256(new).hexdigest()} {self.block_size} {remote_path}\n".encode())
+        self.writer.write(script)
+        async with asyncio.timeout(self.timeout + len(script) / 10_000):
+            await self.writer.drain()
+            reply = (await self.reader.readline()).decode().strip()
+        if reply != "OK":
+            raise OSError(f"delta sync of {remote_path} failed: {reply or 'connection closed'}")
+        return (len(new), len(script))
@@ -0,0 +1,165 @@
+#
+# Per-device phase timings of a deploy (see script/push_code), shown as a live progress line
+# while pushing, summarized at the end, and written as a json report
+#
+# The progress line is only shown when stdout is a terminal, redrawn at most every DRAW_INTERVAL_SECS.
+#
+# Phases of a device (seconds), as they apply to the way it was synced:
+#   libs        shared libraries synced with the sync service (connect, listing and transfer)
+#   delta       large files synced with the delta service
+#   multicast   the app multicast to its group of devices (the same for the whole group)
+#   connect     tcp connect to the sync service, or to ftpd (probe)
+#   list        listing and diff of the device tree (sync service only: lftp does it within its transfer)
+#   transfer    changed files sent (with lftp: listing included)
+#   reboot      reset request through the remote eval service
+#   back        from the reset request to the first beacon of the new boot
+#
+
+import contextlib
+import json
+import statistics
+import sys
+import time
+
+from .discovery import device_ident
+
+PHASES = ("libs", "delta", "multicast", "connect", "list", "transfer", "reboot", "back")
+# The phases sending the bytes counted by transferred(), which the throughput is computed over
+TRANSFER_PHASES = ("libs", "delta", "multicast", "transfer")
+
+DRAW_INTERVAL_SECS = 0.1
+
+class DeployReport:
+
+    def __init__(self, devices, discovery_secs, live=None):
+        self.started = time.time()
+        self.discovery_secs = discovery_secs
+        self.devices = {}
+        for (key, device_info) in devices.items():
+            self.devices[key] = {
+                "device": device_ident(device_info),
+                "ip": device_info['ip'],
+                "app_name": device_info['settings']['board']['app_name'],
+                "method": None,
+                "status": "pending",
+                "ok": None,
+                "error": None,
+                "phases": {},
+                "files": 0,
+                "bytes": 0,
+                "throughput": None,
+                # Whether the app tree hash of the device beacon after the reboot is the one pushed
+                "app_tree_ok": None,
+            }
+        self.live = sys.stdout.isatty() if live is None else live
+        self._line_shown = False
+        self._drawn_at = 0
+
+    def _clear_line(self):
+        if self._line_shown:
+            sys.stdout.write("\r\x1b[K")
+            self._line_shown = False
+
+    def _draw(self, force=False):
+        if not self.live or (not force and time.monotonic() - self._drawn_at < DRAW_INTERVAL_SECS):
+            return
+        self._drawn_at = time.monotonic()
+        counts = {}
+        for device in self.devices.values():
+            counts[device["status"]] = counts.get(device["status"], 0) + 1
+        done = counts.pop("done", 0)
+        sent = sum(device["bytes"] for device in self.devices.values())
+        busy = ", ".join(f"{count} {status}" for (status, count) in sorted(counts.items()))
+        self._clear_line()
+        sys.stdout.write(f"  [{done}/{len(self.devices)} done, {time.time() - self.started:.1f}s, "
+                         f"{sent / 1024:.0f} kB sent] {busy}")
+        sys.stdout.flush()
+        self._line_shown = True
+
+    def log(self, text):
+        """
+            Print a line above the live progress line
+        """
+        self._clear_line()
+        print(text)
+        self._draw(force=True)
+
+    @contextlib.contextmanager
+    def phase(self, key, name):
+        """
+            Time the block as the phase name of the device (added to it, if it already has this phase)
+        """
+        device = self.devices[key]
+        device["status"] = name
+        self._draw()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            device["phases"][name] = round(device["phases"].get(name, 0) + time.monotonic() - start, 4)
+            self._draw()
+
+    def set_phase(self, key, name, secs):
+        self.devices[key]["phases"][name] = None if secs is None else round(secs, 4)
+
+    def app_tree(self, key, device_tree_hash, tree_hash):
+        if device_tree_hash is not None:
+            self.devices[key]["app_tree_ok"] = device_tree_hash == tree_hash
+
+    def set_method(self, key, method):
+        self.devices[key]["method"] = method
+
+    def transferred(self, key, files, size):
+        """
+            Count files and bytes sent to the device, the throughput is computed over its transfer phases
+        """
+        device = self.devices[key]
+        device["files"] += files
+        device["bytes"] += size
+        self._draw()
+
+    def done(self, key, ok, error=None):
+        device = self.devices[key]
+        device["status"] = "done"
+        device["ok"] = ok
+        device["error"] = error or None
+        device["phases"] = dict((name, device["phases"][name]) for name in PHASES if name in device["phases"])
+        secs = sum(device["phases"].get(name) or 0 for name in TRANSFER_PHASES)
+        if device["bytes"] and secs:
+            device["throughput"] = round(device["bytes"] / secs)
+        self._draw()
+
+    def finish(self):
+        self._clear_line()
+        self.total_secs = time.time() - self.started
+
+    def print_summary(self):
+        """
+            Median and max of each phase over the devices, with the slowest device
+        """
+        print(f"Phases (discovery {self.discovery_secs:.2f}s, push {self.total_secs:.2f}s):")
+        for name in PHASES:
+            timed = [(device["phases"][name], device) for device in self.devices.values() if device["phases"].get(name) is not None]
+            if not timed:
+                continue
+            timed.sort(key=lambda t: t[0])
+            (slowest, device) = timed[-1]
+            print(f"  - {name:<10} median {statistics.median(t[0] for t in timed):7.3f}s  max {slowest:7.3f}s  ({device['device']})")
+        missing = [device["device"] for device in self.devices.values() if device["ok"] and device["phases"].get("back", 0) is None]
+        if missing:
+            print(f"  /!\\ No beacon after the reboot from: {', '.join(missing)}")
+        differ = [device["device"] for device in self.devices.values() if device["app_tree_ok"] is False]
+        if differ:
+            print(f"  /!\\ App files differ from the pushed ones after the reboot on: {', '.join(differ)}")
+
+    def to_json(self):
+        return {
+            "started": self.started,
+            "discovery_secs": round(self.discovery_secs, 4),
+            "total_secs": round(self.total_secs, 4),
+            "devices": list(self.devices.values()),
+        }
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_json(), f, indent=2)
@@ -0,0 +1,175 @@
+#
+# Device discovery, by listening to the beacons udp packets sent by the devices
+#
+# If script/discovery_daemon is running, it listens to the beacons continuously, and the fleet
+# is asked to it on its unix socket instead (instant answer, and several tools can scan at once).
+#
+
+import asyncio
+import json
+import os
+import socket
+import time
+
+SCAN_DURATION_SECS = 7
+SCAN_PACKET_MAX_SIZE = 8192
+SCAN_PORT = 1139
+
+DAEMON_SOCKET_PATH = os.environ.get("MICRO_SWARM_DISCOVERY_SOCKET",
+    os.path.join(os.environ.get("XDG_RUNTIME_DIR", "/tmp"), f"micro-swarm-discovery-{os.getuid()}.sock"))
+
+def parse_beacon(data, ip):
+    """
+        Decode a beacon packet received from ip.
+        Returns the device info, or None if the packet is not a beacon from one of the device's nics.
+    """
+    try:
+        beacon = json.loads(data.decode('utf-8'))
+        for nic in beacon["ifconfigs"]:
+            if nic[0] == ip:
+                beacon["ip"] = nic[0]
+                beacon["network"] = nic[1]
+                return beacon
+    except Exception:
+        pass
+    return None
+
+def device_ident(device_info):
+    return f"{device_info['settings']['board']['host_name']}.local ({device_info['ip']})"
+
+def daemon_request(request, timeout=SCAN_DURATION_SECS + 3):
+    """
+        Send a request to the discovery daemon, and return its reply.
+        Raises OSError if the daemon is not running.
+    """
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.settimeout(timeout)
+        s.connect(DAEMON_SOCKET_PATH)
+        s.sendall(json.dumps(request).encode() + b"\n")
+        reply = s.makefile("rb").readline()
+        if not reply:
+            raise ConnectionError("discovery daemon closed the connection")
+        return json.loads(reply)
+    finally:
+        s.close()
+
+def daemon_subscribe():
+    """
+        Yield the fleet changes from the discovery daemon: first {"event": "snapshot", "devices": ...},
+        then {"event": "added" | "updated" | "removed", "ip": ..., "device": ...}
+    """
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(DAEMON_SOCKET_PATH)
+        s.sendall(json.dumps({ "cmd": "subscribe" }).encode() + b"\n")
+        for line in s.makefile("rb"):
+            yield json.loads(line)
+    finally:
+        s.close()
+
+def scan_devices(use_daemon=True):
+    if use_daemon:
+        try:
+            # The daemon waits for a full scan window after its start before answering
+            devices = daemon_request({ "cmd": "list", "min_uptime": SCAN_DURATION_SECS })["devices"]
+            print(f"Found {len(devices)} devices from the discovery daemon")
+            return devices
+        except (OSError, ValueError, KeyError):
+            pass
+
+    devices = {}
+
+    print("Searching for devices...")
+
+    deadline = time.time() + SCAN_DURATION_SECS
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind(("0.0.0.0", SCAN_PORT))
+    try:
+        while True:
+            timeout = deadline - time.time()
+            if timeout < 0:
+                break
+            s.settimeout(timeout)
+            data, (ip, port) = s.recvfrom(SCAN_PACKET_MAX_SIZE)
+            if ip in devices:
+                continue
+            device_info = parse_beacon(data, ip)
+            if device_info:
+                print(f"  - Found {device_ident(device_info)}")
+                devices[ip] = device_info
+    except TimeoutError:
+        pass
+    finally:
+        s.close()
+
+    print("Scan done.")
+
+    return devices
+
+class _BeaconProtocol(asyncio.DatagramProtocol):
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def datagram_received(self, data, addr):
+        device_info = parse_beacon(data, addr[0])
+        if device_info:
+            self.watcher.update({ addr[0]: device_info })
+
+class BeaconWatcher:
+    """
+        The latest beacon of each device, kept up to date in the background: from the discovery daemon
+        if it is running, else by listening to the beacons
+    """
+
+    DAEMON_POLL_SECS = 0.5
+
+    def __init__(self):
+        self.devices = {}
+        self._changed = asyncio.Event()
+        self._transport = None
+        self._poll_task = None
+
+    async def __aenter__(self):
+        try:
+            self.update((await asyncio.to_thread(daemon_request, { "cmd": "list" }))["devices"])
+            self._poll_task = asyncio.create_task(self._poll_daemon())
+        except (OSError, ValueError, KeyError):
+            (self._transport, _) = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: _BeaconProtocol(self), local_addr=("0.0.0.0", SCAN_PORT))
+        return self
+
+    async def __aexit__(self, *exc):
+        if self._poll_task:
+            self._poll_task.cancel()
+        if self._transport:
+            self._transport.close()
+
+    async def _poll_daemon(self):
+        while True:
+            await asyncio.sleep(self.DAEMON_POLL_SECS)
+            try:
+                self.update((await asyncio.to_thread(daemon_request, { "cmd": "list" }))["devices"])
+            except (OSError, ValueError, KeyError):
+                pass
+
+    def update(self, devices):
+        self.devices.update(devices)
+        # Wake up the waiters
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_for(self, ip, predicate, timeout):
+        """
+            Wait for a beacon of the device at ip for which predicate(device_info) is true.
+            Returns False on timeout.
+        """
+        try:
+            async with asyncio.timeout(timeout):
+                while True:
+                    device_info = self.devices.get(ip)
+                    if device_info is not None and predicate(device_info):
+                        return True
+                    await self._changed.wait()
+        except TimeoutError:
+            return False
@@ -0,0 +1,45 @@
+#
+# Client of the logs service of the devices (see boot/root/bootpkg/service_logs.py)
+#
+
+import asyncio
+import json
+
+async def stream_logs(ip, port, boot="-", since=0, follow=False, timeout=4):
+    """
+        Fetch the log lines of a device, from the sequence number since (if boot is the device current boot id).
+        Yields the header {"boot", "first", "next", "clock"}, then the (seq, ticks_ms, source, text) lines.
+        With follow, the new lines are yielded as they come, until cancelled.
+    """
+    async with asyncio.timeout(timeout):
+        reader, writer = await asyncio.open_connection(ip, port)
+    try:
+        writer.write(f"{boot or '-'} {since}{' follow' if follow else ''}\n".encode())
+        await writer.drain()
+        async with asyncio.timeout(timeout):
+            yield json.loads(await reader.readline())
+        while True:
+            if follow:
+                line = await reader.readline()
+            else:
+                async with asyncio.timeout(timeout):
+                    line = await reader.readline()
+            if not line:
+                return
+            yield tuple(json.loads(line))
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+# Period of the micropython ticks
+TICKS_PERIOD = 1 << 30
+
+def line_time(header, ticks_ms):
+    """
+        Unix time (seconds) of a log line, from the clock reference of the header, None if the device clock is not synced
+    """
+    reference = header.get("clock")
+    if not reference:
+        return None
+    diff = (ticks_ms - reference[0] + TICKS_PERIOD // 2) % TICKS_PERIOD - TICKS_PERIOD // 2
+    return (reference[1] + diff) / 1000
@@ -0,0 +1,143 @@
+#
+# Host side of the multicast app deploy (see boot/root/bootpkg/service_mcast_deploy.py)
+#
+# The bundle is sent once to the multicast group, whatever the number of devices, then only
+# the chunks some devices reported missing (NACK) are sent again, until every device is done.
+#
+
+import hashlib
+import os
+import random
+import socket
+import struct
+import time
+
+from .apptree import app_files
+
+MAGIC = b"MSD"
+HEADER_FORMAT = "<3scI"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# Chunk payload size: a chunk packet must fit in an ethernet frame
+CHUNK_SIZE = 1024
+# Multicast rate, in bytes/s: the devices udp buffers are small
+RATE = 256 * 1024
+# Seconds to wait for the devices to be ready (staging file allocated) before sending the chunks
+READY_TIMEOUT_SECS = 8
+# Seconds to wait for the devices status after each pass
+ROUND_SECS = 1.0
+# Maximum number of repair passes
+MAX_ROUNDS = 30
+
+def build_bundle(app_dir):
+    """
+        The app files, as a bundle: <H path length, path, <I size, content for each file
+    """
+    bundle = bytearray()
+    for path in app_files(app_dir):
+        with open(os.path.join(app_dir, path), "rb") as f:
+            content = f.read()
+        encoded_path = path.encode()
+        bundle += struct.pack("<H", len(encoded_path)) + encoded_path + struct.pack("<I", len(content)) + content
+    return bytes(bundle)
+
+class MulticastDeploy:
+
+    def __init__(self, bundle, app_name, group, port, interface=None, chunk_size=CHUNK_SIZE, rate=RATE):
+        self.bundle = bundle
+        self.app_name = app_name
+        self.group = group
+        self.port = port
+        self.chunk_size = chunk_size
+        self.rate = rate
+        self.deploy_id = random.getrandbits(32)
+        self.count = (len(bundle) + chunk_size - 1) // chunk_size
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        if interface:
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+        self.sock.bind((interface or "", 0))
+
+        self.announce = (struct.pack(HEADER_FORMAT, MAGIC, b"A", self.deploy_id)
+            + struct.pack("<IHH", len(bundle), chunk_size, self.sock.getsockname()[1])
+            + hashlib.sha256(bundle).digest()
+            + app_name.encode())
+
+        # Stats
+        self.chunks_sent = 0
+        self.rounds = 0
+
+    def close(self):
+        self.sock.close()
+
+    def send_chunks(self, indexes):
+        interval = (self.chunk_size + 40) / self.rate
+        next_time = time.monotonic()
+        for index in indexes:
+            chunk = self.bundle[index * self.chunk_size:(index + 1) * self.chunk_size]
+            self.sock.sendto(struct.pack(HEADER_FORMAT, MAGIC, b"D", self.deploy_id) + struct.pack("<I", index) + chunk, (self.group, self.port))
+            self.chunks_sent += 1
+            next_time += interval
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def collect(self, ips, status, missing, timeout):
+        """
+            Send the announce, and gather the replies of the devices for timeout seconds
+            (or until every device replied). NACKed chunks are added to missing.
+        """
+        self.sock.sendto(self.announce, (self.group, self.port))
+        replied = set()
+        deadline = time.monotonic() + timeout
+        while replied < ips:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self.sock.settimeout(remaining)
+            try:
+                (data, (ip, port)) = self.sock.recvfrom(2048)
+            except (TimeoutError, socket.timeout):
+                break
+            if ip not in ips or len(data) < HEADER_SIZE:
+                continue
+            (magic, kind, deploy_id) = struct.unpack_from(HEADER_FORMAT, data)
+            if magic != MAGIC or deploy_id != self.deploy_id:
+                continue
+            replied.add(ip)
+            if kind == b"K":
+                status[ip] = "ok" if data[HEADER_SIZE] == 0 else "hash mismatch"
+            elif kind == b"N":
+                (ranges_count,) = struct.unpack_from("<H", data, HEADER_SIZE)
+                for i in range(ranges_count):
+                    (first, count) = struct.unpack_from("<II", data, HEADER_SIZE + 2 + i * 8)
+                    missing.update(range(first, min(first + count, self.count)))
+        return replied
+
+    def run(self, ips):
+        """
+            Deploy the bundle to the devices of these ips.
+            Returns the status of each device which replied: "ok" if it committed the bundle.
+        """
+        ips = set(ips)
+        status = {}
+
+        # Wait for the devices to allocate their staging file
+        deadline = time.monotonic() + READY_TIMEOUT_SECS
+        ready = set()
+        while ready < ips and time.monotonic() < deadline:
+            ready |= self.collect(ips, status, set(), 0.5)
+
+        missing = set(range(self.count))
+        while self.rounds < MAX_ROUNDS:
+            self.rounds += 1
+            self.send_chunks(sorted(missing))
+            missing = set()
+            pending = ips - set(status)
+            if not pending:
+                break
+            self.collect(pending, status, missing, ROUND_SECS)
+            if not ips - set(status):
+                break
+        return status
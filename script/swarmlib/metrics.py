@@ -0,0 +1,68 @@
+#
+# Decoding of the binary metrics export of the devices (see boot/root/bootpkg/metrics.py)
+#
+
+import asyncio
+import struct
+
+EXPORT_MAGIC = b"MSWM"
+HEADER_FORMAT = "<4sIHHH"
+
+KIND_COUNTER = 0
+KIND_GAUGE = 1
+KIND_HISTOGRAM = 2
+
+KIND_NAMES = { KIND_COUNTER: "counter", KIND_GAUGE: "gauge", KIND_HISTOGRAM: "histogram" }
+
+def parse_export(data):
+    """
+        Decode a metrics export.
+        Returns (uptime_ms, metrics) where metrics is a list of (name, kind, bounds, values)
+    """
+    (magic, uptime_ms, metrics_count, values_count, schema_size) = struct.unpack_from(HEADER_FORMAT, data, 0)
+    if magic != EXPORT_MAGIC:
+        raise ValueError("not a metrics export")
+
+    offset = struct.calcsize(HEADER_FORMAT)
+    values = struct.unpack_from(f"<{values_count}q", data, offset + schema_size)
+
+    metrics = []
+    value_index = 0
+    for i in range(metrics_count):
+        (kind, name_len) = struct.unpack_from("<BB", data, offset)
+        offset += 2
+        name = data[offset:offset + name_len].decode()
+        offset += name_len
+        (size,) = struct.unpack_from("<B", data, offset)
+        offset += 1
+        bounds = None
+        if kind == KIND_HISTOGRAM:
+            bounds = struct.unpack_from(f"<{size - 2}i", data, offset)
+            offset += 4 * (size - 2)
+        metrics.append((name, kind, bounds, values[value_index:value_index + size]))
+        value_index += size
+
+    return (uptime_ms, metrics)
+
+def flatten(metrics):
+    """
+        One column per value: histograms are split in their (non cumulative) buckets "name{le=bound}", "name{le=inf}" and "name{sum}"
+    """
+    columns = {}
+    for (name, kind, bounds, values) in metrics:
+        if kind == KIND_HISTOGRAM:
+            for (bound, count) in zip(list(bounds) + ["inf"], values):
+                columns[f"{name}{{le={bound}}}"] = count
+            columns[f"{name}{{sum}}"] = values[-1]
+        else:
+            columns[name] = values[0]
+    return columns
+
+async def fetch_export(ip, port, timeout=4):
+    async with asyncio.timeout(timeout):
+        reader, writer = await asyncio.open_connection(ip, port)
+        try:
+            return await reader.read()
+        finally:
+            writer.close()
+            await writer.wait_closed()
@@ -0,0 +1,257 @@
+#
+# Micropython raw REPL over a serial port, with the raw-paste mode (flow controlled, no echo),
+# used to run code and transfer files on a board before it is on the network
+#
+
+import ast
+import base64
+import struct
+import time
+
+import serial
+
+# Bytes of file content sent per exec: the base64 string literal is compiled on the board, keep it small
+FILE_CHUNK_SIZE = 2048
+
+# Helpers defined on the board once per session
+_HELPERS = """
+import os, ubinascii
+def _walk(d, out):
+    for e in os.ilistdir(d):
+        p = (d if d != '/' else '') + '/' + e[0]
+        if e[1] & 0x4000:
+            out.append(p + '/')
+            _walk(p, out)
+        else:
+            out.append(p)
+    return out
+def _rm(p):
+    if p.endswith('/'):
+        for e in os.ilistdir(p):
+            _rm(p + e[0] + ('/' if e[1] & 0x4000 else ''))
+        os.rmdir(p[:-1])
+    else:
+        os.remove(p)
+def _mkdir(p):
+    try:
+        os.mkdir(p)
+    except OSError:
+        pass
+def _hashes(paths):
+    import hashlib
+    out = {}
+    b = bytearray(512)
+    for p in paths:
+        h = hashlib.sha256()
+        with open(p, 'rb') as f:
+            while True:
+                n = f.readinto(b)
+                if not n:
+                    break
+                h.update(memoryview(b)[0:n])
+        out[p] = ubinascii.hexlify(h.digest()).decode()
+    return out
+"""
+
+# Board code switching the REPL uart to a new baud rate, and back if the host does not confirm it
+# by sending "B" at the new rate: the board is never left at a rate the host cannot use
+_SWITCH_BAUDS = """
+import machine, select, sys, time
+time.sleep_ms(100)
+machine.UART({uart}, {bauds})
+_p = select.poll()
+_p.register(sys.stdin, select.POLLIN)
+if _p.poll(2000) and sys.stdin.read(1) == 'B':
+    print('BAUDS-OK')
+else:
+    machine.UART({uart}, {old_bauds})
+"""
+
+# Uart of the REPL, on which the baud rate is changed
+REPL_UART_ID = 0
+
+class RawReplError(Exception):
+    pass
+
+class RawRepl:
+
+    def __init__(self, port, bauds=115200, timeout=10):
+        self.serial = serial.Serial(port, int(bauds), timeout=0.1)
+        self.bauds = int(bauds)
+        self.timeout = timeout
+        self.use_raw_paste = True
+        self.bytes_sent = 0
+        self.buffer = bytearray()
+
+    def close(self):
+        self.serial.close()
+
+    def __enter__(self):
+        self.enter()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _fill(self):
+        """
+            Read the available bytes into the input buffer, waiting a bit for the first one. Returns False if none came.
+        """
+        chunk = self.serial.read(max(1, self.serial.in_waiting))
+        self.buffer += chunk
+        return bool(chunk)
+
+    def read_until(self, ending, timeout=None):
+        deadline = time.monotonic() + (timeout or self.timeout)
+        while True:
+            i = self.buffer.find(ending)
+            if i >= 0:
+                data = bytes(self.buffer[0:i + len(ending)])
+                del self.buffer[0:i + len(ending)]
+                return data
+            if self._fill():
+                deadline = time.monotonic() + (timeout or self.timeout)
+            elif time.monotonic() > deadline:
+                raise RawReplError(f"timeout waiting for {ending!r}, got {bytes(self.buffer[-80:])!r}")
+
+    def read(self, n):
+        deadline = time.monotonic() + self.timeout
+        while len(self.buffer) < n and (self._fill() or time.monotonic() < deadline):
+            pass
+        data = bytes(self.buffer[0:n])
+        del self.buffer[0:n]
+        return data
+
+    def write(self, data):
+        self.serial.write(data)
+        self.bytes_sent += len(data)
+
+    def enter(self):
+        # ctrl-C twice: interrupt the running program, then ctrl-A: raw REPL
+        self.write(b"\r\x03\x03")
+        time.sleep(0.1)
+        self.serial.reset_input_buffer()
+        self.buffer.clear()
+        self.write(b"\r\x01")
+        self.read_until(b"raw REPL; CTRL-B to exit\r\n")
+        self.exec(_HELPERS)
+
+    def _raw_paste_write(self, code):
+        window_size = struct.unpack("<H", self.read(2))[0]
+        window_remain = window_size
+        i = 0
+        while i < len(code):
+            deadline = time.monotonic() + self.timeout
+            while window_remain == 0 or self.buffer or self.serial.in_waiting:
+                if not self.buffer and not self._fill():
+                    if time.monotonic() > deadline:
+                        raise RawReplError("timeout waiting for the raw paste window")
+                    continue
+                data = self.read(1)
+                if data == b"\x01":
+                    # The board can receive a new window of data
+                    window_remain += window_size
+                elif data == b"\x04":
+                    # The board ended the transfer (compilation error for example)
+                    self.write(b"\x04")
+                    return
+                else:
+                    raise RawReplError(f"unexpected data during raw paste: {data!r}")
+            chunk = code[i:i + window_remain]
+            self.write(chunk)
+            window_remain -= len(chunk)
+            i += len(chunk)
+        self.write(b"\x04")
+        self.read_until(b"\x04")
+
+    def exec_no_follow(self, code):
+        code = code.encode() if isinstance(code, str) else code
+        self.read_until(b">")
+        if self.use_raw_paste:
+            self.write(b"\x05A\x01")
+            reply = self.read(2)
+            if reply == b"R\x01":
+                self._raw_paste_write(code)
+                return
+            if reply != b"R\x00":
+                # The board does not know the raw-paste mode: it is back to the raw REPL prompt
+                self.read_until(b"w REPL; CTRL-B to exit\r\n>")
+            self.use_raw_paste = False
+
+        # Standard raw REPL: slowly, as there is no flow control
+        for i in range(0, len(code), 256):
+            self.write(code[i:i + 256])
+            time.sleep(0.01)
+        self.write(b"\x04")
+        if self.read(2) != b"OK":
+            raise RawReplError("could not exec the code")
+
+    def exec(self, code):
+        """
+            Run code on the board, and return its output. Raises RawReplError with the board traceback on exception.
+        """
+        self.exec_no_follow(code)
+        output = self.read_until(b"\x04")[:-1]
+        error = self.read_until(b"\x04")[:-1]
+        if error:
+            raise RawReplError(error.decode(errors="replace").strip())
+        return output
+
+    def switch_bauds(self, bauds):
+        """
+            Move the serial link to a higher baud rate, if the board accepts it. Returns True if the rate was changed.
+        """
+        bauds = int(bauds)
+        if bauds == self.bauds:
+            return True
+        self.exec_no_follow(_SWITCH_BAUDS.format(uart=REPL_UART_ID, bauds=bauds, old_bauds=self.bauds))
+        time.sleep(0.2)
+        self.serial.baudrate = bauds
+        self.serial.reset_input_buffer()
+        self.buffer.clear()
+        self.write(b"B")
+        try:
+            self.read_until(b"BAUDS-OK\r\n\x04", timeout=3)
+            self.read_until(b"\x04")
+            self.bauds = bauds
+            return True
+        except RawReplError:
+            # The board went back to the previous rate, or never left it (no such uart): resynchronize
+            self.serial.baudrate = self.bauds
+            time.sleep(2.5)
+            self.enter()
+            return False
+
+    def eval(self, expression):
+        return ast.literal_eval(self.exec(f"print(repr({expression}))").decode().strip())
+
+    # Files
+
+    def list_files(self):
+        """
+            Paths of the board files, directories end with /
+        """
+        return self.eval("_walk('/', [])")
+
+    def file_hashes(self, paths):
+        """
+            {path: sha256 hex} of board files, computed on the board
+        """
+        return self.eval(f"_hashes({list(paths)!r})") if paths else {}
+
+    def remove(self, path):
+        self.exec(f"_rm({path!r})")
+
+    def mkdir(self, path):
+        self.exec(f"_mkdir({path!r})")
+
+    def write_file(self, path, content):
+        self.exec(f"_f = open({path!r}, 'wb')")
+        try:
+            for i in range(0, len(content), FILE_CHUNK_SIZE):
+                self.exec(f"_f.write(ubinascii.a2b_base64({base64.b64encode(content[i:i + FILE_CHUNK_SIZE])!r}))")
+        finally:
+            self.exec("_f.close()")
+
+    def soft_reset(self):
+        self.exec_no_follow("import machine\nmachine.soft_reset()")
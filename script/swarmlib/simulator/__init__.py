@@ -0,0 +1,20 @@
+#
+# CPython simulator of micro-swarm devices, running the unmodified boot code on the loopback network
+#
+
+import os
+
+from .device import SimDevice, device_ip
+from .modules import DeviceReset
+
+def create_devices(count, root_dir, first_index=0, install=True, app_code=True, **kwargs):
+    """
+        Create (and install the filesystem of) count simulated devices, each one in root_dir/sim_<index>
+    """
+    devices = []
+    for index in range(first_index, first_index + count):
+        device = SimDevice(index, root=os.path.join(root_dir, f"sim_{index:04d}"), **kwargs)
+        if install:
+            device.install(app_code=app_code)
+        devices.append(device)
+    return devices
@@ -0,0 +1,365 @@
+#
+# A simulated micro-swarm device, running the unmodified boot/root code under CPython
+#
+# Each device has:
+#   - its own root directory (virtual filesystem), populated like script/program_code_boot does
+#   - its own loopback ip (127.1.x.y), to which its sockets are bound
+#   - its own module namespace: its modules are imported as _simdev_<index>.<name>, and run with
+#     their own builtins, whose __import__ resolves the micropython modules (machine, network, os,
+#     uasyncio, ...) to the device shims, and the device files (bootpkg, apps, board, ...) to the
+#     device namespace
+#   - its own thread and asyncio event loop
+#
+# Several devices can run in the same process.
+#
+
+import asyncio
+import builtins
+import importlib
+import importlib.abc
+import importlib.machinery
+import json
+import os
+import shutil
+import sys
+import threading
+import traceback
+import types
+import weakref
+
+from ..artifact import boot_tree_hash
+from . import modules as sim_modules
+from .uasyncio import UAsyncio
+from .vfs import DeviceOS
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+
+# Settings ports which are shifted by the device port offset
+_PORT_SETTINGS_EXCLUDED = ("BEACON_DESTINATION_PORT",)
+
+# Simulated devices, by namespace prefix
+_devices = {}
+
+# The simulated devices must not leave __pycache__ directories in their filesystem
+sys.dont_write_bytecode = True
+
+def device_ip(index):
+    return f"127.1.{index // 250}.{index % 250 + 2}"
+
+class _DeviceLoader(importlib.machinery.SourceFileLoader):
+    """
+        Execute a device module with the device builtins
+    """
+
+    def __init__(self, fullname, path, device):
+        super().__init__(fullname, path)
+        self.device = device
+
+    def exec_module(self, module):
+        module.__dict__["__builtins__"] = self.device.builtins
+        super().exec_module(module)
+        if module.__name__ == self.device.prefix + ".bootpkg.settings":
+            self.device.override_settings(module)
+
+class _DeviceFinder(importlib.abc.MetaPathFinder):
+    """
+        Find the modules of the device namespaces, in the device root directories
+    """
+
+    def find_spec(self, fullname, path, target=None):
+        device = _devices.get(fullname.partition(".")[0])
+        if device is None or path is None:
+            return None
+        spec = importlib.machinery.PathFinder.find_spec(fullname, path)
+        if spec is not None and isinstance(spec.loader, importlib.machinery.SourceFileLoader):
+            spec.loader = _DeviceLoader(spec.loader.name, spec.loader.path, device)
+        return spec
+
+sys.meta_path.insert(0, _DeviceFinder())
+
+class Repl:
+    """
+        Minimal line repl of the device terminal (os.dupterm), as used by telnet.
+        Single line statements only.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.line = bytearray()
+        self.buf = bytearray(256)
+        self.namespace = None
+
+    def feed_from(self, term):
+        while True:
+            n = term.readinto(self.buf)
+            if not n:
+                return
+            for b in self.buf[0:n]:
+                self.feed(b, term)
+
+    def feed(self, b, term):
+        if b in (0x0d, 0x0a):
+            if b == 0x0d:
+                term.write(b"\r\n")
+                self.execute(self.line.decode(errors="replace"))
+                self.line.clear()
+                term.write(b">>> ")
+        elif b in (0x08, 0x7f):
+            if self.line:
+                self.line.pop()
+                term.write(b"\x08 \x08")
+        elif b >= 0x20:
+            self.line.append(b)
+            term.write(bytes([b]))
+
+    def execute(self, src):
+        if not src.strip():
+            return
+        if self.namespace is None:
+            self.namespace = { "__builtins__": self.device.builtins, "__name__": self.device.prefix + ".__main__" }
+        try:
+            try:
+                code = compile(src, "<stdin>", "eval")
+            except SyntaxError:
+                exec(compile(src, "<stdin>", "exec"), self.namespace)
+            else:
+                result = eval(code, self.namespace)
+                if result is not None:
+                    self.device.print(repr(result))
+        except Exception as err:
+            self.device.modules["sys"].print_exception(err)
+
+class SimDevice:
+
+    def __init__(self, index, root, app_name="example", host_name=None, port_offset=2000, beacon_ip="127.0.0.1", echo=True, settings=None):
+        self.index = index
+        self.root = os.path.abspath(root)
+        self.app_name = app_name
+        self.device_name = host_name or f"sim_{index:04d}"
+        self.host_name = self.device_name.replace("_", "-")
+        self.ip = device_ip(index)
+        self.mac = bytes([0x02, 0x53, 0x49, 0x4d, (index >> 8) & 0xff, index & 0xff])
+        self.port_offset = port_offset
+        self.beacon_ip = beacon_ip
+        self.settings = settings or {}
+        self.echo = echo
+        self.prefix = f"_simdev_{index}"
+
+        self.sockets = weakref.WeakSet()
+        self.repl = Repl(self)
+        self.nic = sim_modules.SimNIC(self)
+        self.loop = None
+        self.modules = None
+        self.resets = 0
+
+        self._thread = None
+        self._stopping = False
+        self._output = ""
+
+    # Filesystem
+
+    def install(self, app_code=True):
+        """
+            Populate the device root directory, like script/program_code_boot does over the serial port
+        """
+        ignore = shutil.ignore_patterns("__pycache__", ".*")
+        os.makedirs(self.root, exist_ok=True)
+        shutil.copytree(os.path.join(SRC_DIR, "boot", "root"), self.root, dirs_exist_ok=True, ignore=ignore)
+        shutil.copytree(os.path.join(SRC_DIR, "boot", "hardwares", "simulator"), os.path.join(self.root, "hardwares", "simulator"), dirs_exist_ok=True, ignore=ignore)
+
+        app_dir = os.path.join(self.root, "apps", self.app_name)
+        if app_code:
+            shutil.copytree(os.path.join(SRC_DIR, "apps", self.app_name), app_dir, dirs_exist_ok=True, ignore=ignore)
+            if os.path.isdir(os.path.join(SRC_DIR, "libs")):
+                shutil.copytree(os.path.join(SRC_DIR, "libs"), os.path.join(self.root, "libs"), dirs_exist_ok=True, ignore=ignore)
+        else:
+            os.makedirs(app_dir, exist_ok=True)
+            self._write("apps/" + self.app_name + "/__init__.py",
+                "async def routine_main():\n"
+                "    print('The firmware boot was correctly installed. Please push source code by connecting the device on ethernet, and run push_code')\n")
+
+        self._write("board.py",
+            f"name          = {self.device_name!r}\n"
+            f"device_name   = {self.device_name!r}\n"
+            f"hardware_name = 'simulator'\n"
+            f"app_name      = {self.app_name!r}\n"
+            f"host_name     = {self.host_name!r}\n")
+        self._write("bootpkg/app.py", f"from apps.{self.app_name} import *")
+        self._write("bootpkg/hardware.py", "from hardwares.simulator import *")
+        self._write("boot_upgrade.json", json.dumps({ "state": "installed", "hash": boot_tree_hash(SRC_DIR, "simulator") }))
+
+    def _write(self, path, content):
+        with open(os.path.join(self.root, path), "w") as f:
+            f.write(content)
+
+    # Settings
+
+    def override_settings(self, settings):
+        """
+            Adapt the boot settings to the simulation: no link-local ips, beacons and time requests sent to the host,
+            and service ports shifted by the port offset (so they are not privileged ports)
+        """
+        settings.NETWORK_SET_LOCAL_LINK_IP = False
+        settings.BEACON_DESTINATION_IPS = [ self.beacon_ip ]
+        settings.TIMESYNC_SERVER = self.beacon_ip
+        for name in dir(settings):
+            if name.endswith("_PORT") and name not in _PORT_SETTINGS_EXCLUDED:
+                setattr(settings, name, getattr(settings, name) + self.port_offset)
+        for (name, value) in self.settings.items():
+            setattr(settings, name, value)
+
+    def bind_host(self, host):
+        return self.ip if host in ("", "0.0.0.0", None) else host
+
+    # Output
+
+    def print(self, *args, sep=" ", end="\n", file=None, flush=False):
+        if file is not None:
+            builtins.print(*args, sep=sep, end=end, file=file, flush=flush)
+            return
+        self.output(sep.join(str(arg) for arg in args) + end)
+
+    def output(self, text):
+        if self.echo:
+            lines = (self._output + text).split("\n")
+            self._output = lines.pop()
+            for line in lines:
+                sys.stdout.write(f"{self.host_name:>12} | {line}\n")
+        term = self.modules["os"]._term if self.modules else None
+        if term is not None:
+            try:
+                term.write(text.replace("\n", "\r\n").encode())
+            except Exception:
+                pass
+
+    # Modules
+
+    def _create_namespace(self):
+        # The other devices threads import modules meanwhile: iterate over a snapshot
+        for name in [m for m in list(sys.modules) if m == self.prefix or m.startswith(self.prefix + ".")]:
+            del sys.modules[name]
+        importlib.invalidate_caches()
+
+        namespace = types.ModuleType(self.prefix)
+        namespace.__path__ = [ self.root ]
+        sys.modules[self.prefix] = namespace
+        _devices[self.prefix] = self
+
+        self.builtins = dict(builtins.__dict__)
+        self.builtins.update({
+            "__import__": self._import,
+            "print": self.print,
+            "const": sim_modules._const,
+        })
+
+        self.modules = {}
+        # Time is needed by machine
+        for name in ("time", "gc", "sys", "socket", "machine", "network", "micropython", "uio", "builtins"):
+            self.modules[name] = sim_modules.SHIMS[name](self)
+        self.modules["os"] = DeviceOS(self)
+        self.modules["uasyncio"] = UAsyncio(self)
+        self.modules["asyncio"] = self.modules["uasyncio"]
+        self.builtins["open"] = self.modules["os"].open
+
+    def _search_dirs(self):
+        """
+            The host directories of the device root, and of the absolute directories of the device sys.path (LIBS_DIR)
+        """
+        dirs = [ self.root ]
+        for path in self.modules["sys"].path:
+            if path.startswith("/") and path != "/" and os.path.isdir(self.modules["os"].host_path(path)):
+                dirs.append(self.modules["os"].host_path(path))
+        return dirs
+
+    def _is_device_module(self, top):
+        # The device modules are imported within the namespace package, which looks in all the search directories
+        dirs = self._search_dirs()
+        sys.modules[self.prefix].__path__ = dirs
+        return any(os.path.isdir(os.path.join(d, top)) or os.path.isfile(os.path.join(d, top + ".py")) for d in dirs)
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level == 0:
+            name = sim_modules.ALIASES.get(name, name)
+            shim = self.modules.get(name)
+            if shim is not None:
+                return shim
+            top = name.partition(".")[0]
+            if top != self.prefix and self._is_device_module(top):
+                module = builtins.__import__(self.prefix + "." + name, globals, locals, fromlist, 0)
+                if fromlist:
+                    return module
+                return sys.modules[self.prefix + "." + top]
+        return builtins.__import__(name, globals, locals, fromlist, level)
+
+    def import_module(self, name):
+        self._import(name)
+        return sys.modules[self.prefix + "." + name]
+
+    # Run
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name=self.host_name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping = True
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def reset(self):
+        """
+            Reset the running device, as if machine.reset() was called on it
+        """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.modules["machine"].reset)
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        """
+            Boot the device, like the root main.py does, and boot it again after each machine.reset()
+        """
+        while not self._stopping:
+            self._create_namespace()
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.modules["uasyncio"].get_event_loop()
+            try:
+                bootswap = self.import_module("bootswap")
+                try:
+                    bootswap.boot()
+                except Exception as err:
+                    self.print("Boot upgrade error: {}: {}".format(type(err).__name__, err))
+                try:
+                    self.import_module("bootpkg").main()
+                except Exception as err:
+                    bootswap.failed(err)
+                    raise
+            except sim_modules.DeviceReset:
+                self.resets += 1
+                self.print("*** Device reset ***")
+            except Exception as err:
+                if not self._stopping:
+                    self.print("*** Device crashed, stopped ***\n" + "".join(traceback.format_exception(type(err), err, err.__traceback__)))
+                    self._stopping = True
+            finally:
+                self._shutdown_loop()
+
+    def _shutdown_loop(self):
+        # Cancel every task (closing the servers) and close the remaining sockets, to free the ports.
+        # The device exception handler must not see this.
+        self.loop.set_exception_handler(lambda loop, context: None)
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            try:
+                self.loop.run_until_complete(asyncio.wait(tasks, timeout=2))
+            except BaseException:
+                pass
+        for sock in list(self.sockets):
+            sock.close()
+        self.loop.close()
+        self.loop = None
@@ -0,0 +1,472 @@
+#
+# Micropython modules of a simulated device: machine, network, micropython, sys, time, socket, gc, uio, builtins.
+# Each simulated device gets its own instances, so that its state (clock, sockets, nic, terminal) is its own.
+#
+
+import builtins
+import calendar
+import collections.abc
+import gc as _gc
+import io
+import socket as _socket
+import sys as _sys
+import time as _time
+import traceback
+import types
+
+class DeviceReset(SystemExit):
+    """
+        Raised by machine.reset(): it goes through the device tasks up to the simulator, which restarts the device
+    """
+
+def _const(x):
+    return x
+
+class Machine(types.ModuleType):
+
+    def __init__(self, device):
+        super().__init__("machine")
+        self._device = device
+        device_time = device.modules["time"]
+
+        class RTC:
+            def init(self, datetime):
+                self.datetime(datetime)
+
+            def datetime(self, datetime=None):
+                now = device_time.gmtime()
+                if datetime is None:
+                    # (year, month, day, weekday, hours, minutes, seconds, subseconds)
+                    return (now[0], now[1], now[2], now[6], now[3], now[4], now[5], 0)
+                (year, month, day, weekday, hours, minutes, seconds) = datetime[0:7]
+                subseconds = datetime[7] / 1_000_000 if len(datetime) > 7 else 0
+                device_time.set_time(calendar.timegm((year, month, day, hours, minutes, seconds, 0, 0, 0)) + subseconds)
+
+        self.RTC = RTC
+
+    class Pin:
+        IN = 0
+        OUT = 1
+        PULL_UP = 2
+        PULL_DOWN = 3
+
+        def __init__(self, id, mode=-1, pull=-1, value=None):
+            self.id = id
+            self._value = value or 0
+
+        def value(self, value=None):
+            if value is None:
+                return self._value
+            self._value = value
+
+        def on(self):
+            self._value = 1
+
+        def off(self):
+            self._value = 0
+
+    class UART:
+        def __init__(self, id, baudrate=115200, **kwargs):
+            self.id = id
+            self.baudrate = baudrate
+
+        def init(self, baudrate=115200, **kwargs):
+            self.baudrate = baudrate
+
+    class WDT:
+        def __init__(self, id=0, timeout=5000):
+            pass
+
+        def feed(self):
+            pass
+
+    def reset(self):
+        raise DeviceReset()
+
+    def soft_reset(self):
+        raise DeviceReset()
+
+    def reset_cause(self):
+        return 1
+
+    def unique_id(self):
+        return self._device.mac
+
+    def freq(self, hz=None):
+        return 240_000_000
+
+    def idle(self):
+        pass
+
+class SimNIC:
+    """
+        The loopback network interface of a simulated device
+    """
+
+    def __init__(self, device):
+        self._device = device
+        self._config = (device.ip, "255.0.0.0", "127.0.0.1", "127.0.0.1")
+        self._active = True
+        # Set to False by the simulator to simulate an unplugged cable
+        self.link_up = True
+
+    def ifconfig(self, config=None):
+        if config is None:
+            return self._config
+        # The new configuration is reported, but the device sockets stay bound to the device loopback ip
+        self._config = tuple(config)
+
+    def config(self, *args, **kwargs):
+        if args:
+            return { "mac": self._device.mac, "hostname": self._device.host_name }[args[0]]
+
+    def active(self, state=None):
+        if state is None:
+            return self._active
+        self._active = bool(state)
+
+    def isconnected(self):
+        return self._active and self.link_up
+
+    def status(self, *args):
+        return 1 if self.isconnected() else 0
+
+class Network(types.ModuleType):
+
+    STA_IF = 0
+    AP_IF = 1
+    PHY_LAN8720 = 0
+    PHY_IP101 = 1
+    PHY_RTL8201 = 2
+    PHY_DP83848 = 3
+    PHY_KSZ8041 = 4
+
+    def __init__(self, device):
+        super().__init__("network")
+        self._device = device
+
+    def LAN(self, *args, **kwargs):
+        return self._device.nic
+
+    def WLAN(self, *args, **kwargs):
+        return self._device.nic
+
+class Micropython(types.ModuleType):
+
+    const = staticmethod(_const)
+
+    def __init__(self, device):
+        super().__init__("micropython")
+        self._device = device
+
+    def native(self, f):
+        return f
+
+    viper = native
+
+    def alloc_emergency_exception_buf(self, size):
+        pass
+
+    def mem_info(self, verbose=None):
+        device_gc = self._device.modules["gc"]
+        self._device.print(f"stack: 0 out of 15360\nGC: total: {device_gc.HEAP_SIZE}, used: {device_gc.mem_alloc()}, free: {device_gc.mem_free()}")
+
+    def qstr_info(self, verbose=None):
+        pass
+
+    def stack_use(self):
+        return 0
+
+    def heap_lock(self):
+        return 0
+
+    def heap_unlock(self):
+        return 0
+
+    def kbd_intr(self, chr):
+        pass
+
+    def opt_level(self, level=None):
+        return 0
+
+    def schedule(self, func, arg):
+        self._device.loop.call_soon_threadsafe(func, arg)
+
+class DeviceModules(collections.abc.MutableMapping):
+    """
+        The sys.modules of a simulated device: the host sys.modules, shared by every device thread,
+        of which only the device modules (in its namespace) are listed
+    """
+
+    def __init__(self, prefix):
+        self._prefix = prefix
+        self._dotted_prefix = prefix + "."
+
+    def _own(self, name):
+        return name == self._prefix or name.startswith(self._dotted_prefix)
+
+    def __getitem__(self, name):
+        return _sys.modules[name]
+
+    def __setitem__(self, name, module):
+        _sys.modules[name] = module
+
+    def __delitem__(self, name):
+        del _sys.modules[name]
+
+    def __contains__(self, name):
+        return name in _sys.modules
+
+    def __iter__(self):
+        # The other devices threads import modules meanwhile: iterate over a snapshot
+        return iter([name for name in list(_sys.modules) if self._own(name)])
+
+    def __len__(self):
+        return sum(1 for name in list(_sys.modules) if self._own(name))
+
+class Sys(types.ModuleType):
+
+    platform = "micro-swarm-sim"
+    implementation = types.SimpleNamespace(name="micropython", version=(1, 19, 1), _machine="micro-swarm simulator")
+    version = "3.4.0; MicroPython v1.19.1 (micro-swarm simulator)"
+    byteorder = _sys.byteorder
+    maxsize = _sys.maxsize
+
+    def __init__(self, device):
+        super().__init__("sys")
+        self._device = device
+        self.modules = DeviceModules(device.prefix)
+        self.path = ["", ".frozen", "/lib"]
+        self.argv = []
+
+    def __getattr__(self, name):
+        return getattr(_sys, name)
+
+    def print_exception(self, exc, file=None):
+        text = "".join(traceback.format_exception(type(exc), exc, exc.__traceback__))
+        if file is None:
+            self._device.print(text, end="")
+        else:
+            file.write(text)
+
+    def exit(self, retval=0):
+        raise SystemExit(retval)
+
+class Time(types.ModuleType):
+    """
+        The time module, with the micropython ticks functions.
+        The device clock can be set (machine.RTC), it is kept as an offset from the host clock.
+    """
+
+    _TICKS_PERIOD = 1 << 30
+    _TICKS_MAX = _TICKS_PERIOD - 1
+    _TICKS_HALFPERIOD = _TICKS_PERIOD // 2
+
+    def __init__(self, device):
+        super().__init__("time")
+        self._device = device
+        self._offset = 0
+
+    def set_time(self, seconds):
+        self._offset = seconds - _time.time()
+
+    def time(self):
+        return int(_time.time() + self._offset)
+
+    def time_ns(self):
+        return int((_time.time() + self._offset) * 1_000_000_000)
+
+    def gmtime(self, secs=None):
+        return tuple(_time.gmtime(self.time() if secs is None else secs))[0:8]
+
+    localtime = gmtime
+
+    def mktime(self, t):
+        return calendar.timegm(tuple(t[0:6]) + (0, 0, 0))
+
+    def sleep(self, seconds):
+        _time.sleep(seconds)
+
+    def sleep_ms(self, ms):
+        _time.sleep(ms / 1000)
+
+    def sleep_us(self, us):
+        _time.sleep(us / 1_000_000)
+
+    def ticks_ms(self):
+        return int(_time.monotonic() * 1000) & self._TICKS_MAX
+
+    def ticks_us(self):
+        return int(_time.monotonic() * 1_000_000) & self._TICKS_MAX
+
+    def ticks_cpu(self):
+        return self.ticks_us()
+
+    def ticks_add(self, ticks, delta):
+        return (ticks + delta) & self._TICKS_MAX
+
+    def ticks_diff(self, ticks1, ticks2):
+        return ((ticks1 - ticks2 + self._TICKS_HALFPERIOD) & self._TICKS_MAX) - self._TICKS_HALFPERIOD
+
+class Gc(types.ModuleType):
+    """
+        The heap of the simulated devices is not simulated: collections do nothing,
+        and the heap stats are those of an idle esp32
+    """
+
+    HEAP_SIZE = 111168
+    HEAP_USED = 30000
+
+    def __init__(self, device):
+        super().__init__("gc")
+
+    def collect(self):
+        pass
+
+    def enable(self):
+        pass
+
+    def disable(self):
+        pass
+
+    def isenabled(self):
+        return True
+
+    def threshold(self, amount=None):
+        return -1
+
+    def mem_alloc(self):
+        return self.HEAP_USED
+
+    def mem_free(self):
+        return self.HEAP_SIZE - self.HEAP_USED
+
+class Socket(types.ModuleType):
+    """
+        The socket module: sockets are bound to the device loopback ip, so that they are seen as coming from the device
+    """
+
+    def __init__(self, device):
+        super().__init__("socket")
+
+        class socket(_socket.socket):
+            def __init__(self, af=_socket.AF_INET, type=_socket.SOCK_STREAM, proto=0, fileno=None):
+                super().__init__(af, type, proto, fileno)
+                device.sockets.add(self)
+
+            def _shared_udp(self):
+                # Udp sockets bound with SO_REUSEADDR (multicast listeners) keep their wildcard address
+                return self.type == _socket.SOCK_DGRAM and self.getsockopt(_socket.SOL_SOCKET, _socket.SO_REUSEADDR)
+
+            def bind(self, address):
+                (host, port) = address[0:2]
+                if not self._shared_udp():
+                    host = device.bind_host(host)
+                super().bind((host, port))
+
+            def _auto_bind(self):
+                if self.getsockname()[1] == 0:
+                    super().bind((device.ip, 0))
+
+            def connect(self, address):
+                self._auto_bind()
+                super().connect(address)
+
+            def sendto(self, data, *args):
+                self._auto_bind()
+                if isinstance(data, str):
+                    data = data.encode()
+                return super().sendto(data, *args)
+
+            def send(self, data, *args):
+                if isinstance(data, str):
+                    data = data.encode()
+                return super().send(data, *args)
+
+            def write(self, data):
+                if isinstance(data, str):
+                    data = data.encode()
+                self.sendall(data)
+                return len(data)
+
+            def read(self, size=4096):
+                return self.recv(size)
+
+            def readinto(self, buf, nbytes=0):
+                return self.recv_into(buf, nbytes)
+
+        self.socket = socket
+
+    def __getattr__(self, name):
+        return getattr(_socket, name)
+
+class Uio(types.ModuleType):
+
+    class IOBase:
+        pass
+
+    BytesIO = io.BytesIO
+    StringIO = io.StringIO
+
+    def __init__(self, device):
+        super().__init__("uio")
+
+    def open(self, *args, **kwargs):
+        return builtins.open(*args, **kwargs)
+
+class Builtins(types.ModuleType):
+    """
+        The builtins module, writable view of the device builtins (builtins.print = ... only affects the device)
+    """
+
+    def __init__(self, device):
+        super().__init__("builtins")
+        object.__setattr__(self, "_device_builtins", device.builtins)
+
+    def __getattr__(self, name):
+        try:
+            return self._device_builtins[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self._device_builtins[name] = value
+
+    def __delattr__(self, name):
+        del self._device_builtins[name]
+
+    def __dir__(self):
+        return list(self._device_builtins)
+
+# Shim module classes, by micropython module name
+SHIMS = {
+    "builtins": Builtins,
+    "gc": Gc,
+    "machine": Machine,
+    "micropython": Micropython,
+    "network": Network,
+    "socket": Socket,
+    "sys": Sys,
+    "time": Time,
+    "uio": Uio,
+}
+
+# Micropython "u" module names of the CPython standard modules
+ALIASES = {
+    "ubinascii": "binascii",
+    "ucollections": "collections",
+    "uerrno": "errno",
+    "uhashlib": "hashlib",
+    "uheapq": "heapq",
+    "uio": "uio",
+    "ujson": "json",
+    "uos": "os",
+    "urandom": "random",
+    "ure": "re",
+    "uselect": "select",
+    "usocket": "socket",
+    "ustruct": "struct",
+    "usys": "sys",
+    "utime": "time",
+    "uzlib": "zlib",
+}
@@ -0,0 +1,249 @@
+#
+# The uasyncio module of a simulated device, implemented on top of asyncio.
+# Each simulated device runs its own asyncio event loop in its own thread.
+#
+
+import asyncio
+import inspect
+import types
+
+class _GeneratorAwaitable:
+    def __init__(self, generator):
+        self._generator = generator
+
+    def __await__(self):
+        return self._generator
+
+async def _run_generator(generator):
+    return await _GeneratorAwaitable(generator)
+
+def as_coroutine(coro):
+    """
+        micropython tasks can be plain generators (for example instrumentation wrappers),
+        asyncio only accepts coroutines
+    """
+    if inspect.isgenerator(coro):
+        return _run_generator(coro)
+    return coro
+
+class _RawSocketWriter:
+    """
+        The raw socket of a stream (stream.s): synchronous writes
+    """
+    def __init__(self, transport):
+        self._transport = transport
+
+    def write(self, data):
+        self._transport.write(bytes(data))
+        return len(data)
+
+class Stream:
+    """
+        A uasyncio stream, used as both the reader and the writer of a connection
+    """
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self.s = _RawSocketWriter(writer.transport)
+
+    def get_extra_info(self, name):
+        return self._writer.get_extra_info(name)
+
+    async def read(self, n=-1):
+        return await self._reader.read(n)
+
+    async def readinto(self, buf):
+        data = await self._reader.read(len(buf))
+        buf[0:len(data)] = data
+        return len(data)
+
+    async def readexactly(self, n):
+        return await self._reader.readexactly(n)
+
+    async def readline(self):
+        return await self._reader.readline()
+
+    def write(self, buf, off=0, sz=-1):
+        if isinstance(buf, str):
+            buf = buf.encode()
+        buf = bytes(buf)
+        if sz == -1:
+            sz = len(buf) - off
+        self._writer.write(buf[off:off + sz])
+
+    async def drain(self):
+        try:
+            await self._writer.drain()
+        except ConnectionError as err:
+            raise OSError(err.errno, str(err))
+
+    async def awrite(self, buf, off=0, sz=-1):
+        self.write(buf, off, sz)
+        await self.drain()
+
+    def close(self):
+        self._writer.close()
+
+    async def wait_closed(self):
+        try:
+            await self._writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+    async def aclose(self):
+        self.close()
+        await self.wait_closed()
+
+class Loop:
+    """
+        The uasyncio loop object of a device, wrapping its asyncio loop
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+
+    def create_task(self, coro):
+        return self.loop.create_task(as_coroutine(coro))
+
+    def run_until_complete(self, main_task=None):
+        return self.loop.run_until_complete(as_coroutine(main_task))
+
+    def run_forever(self):
+        self.loop.run_forever()
+
+    def stop(self):
+        self.loop.stop()
+
+    def close(self):
+        pass
+
+    def set_exception_handler(self, handler):
+        if handler is None:
+            self.loop.set_exception_handler(None)
+        else:
+            self.loop.set_exception_handler(lambda loop, context: handler(self, context))
+
+    def get_exception_handler(self):
+        return self.loop.get_exception_handler()
+
+    def default_exception_handler(self, loop, context):
+        self.loop.default_exception_handler(context)
+
+    def call_exception_handler(self, context):
+        self.loop.call_exception_handler(context)
+
+class ThreadSafeFlag:
+    def __init__(self):
+        self._event = asyncio.Event()
+        self._loop = None
+
+    def set(self):
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._event.set)
+        else:
+            self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        self._loop = asyncio.get_running_loop()
+        await self._event.wait()
+        self._event.clear()
+
+class _IOQueue:
+    """
+        The io queue of the micropython uasyncio core: a task waiting for a socket to be readable
+        yields queue_read(sock) (as the uasyncio streams do)
+    """
+
+    def queue_read(self, sock):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        fd = sock.fileno()
+
+        def readable():
+            if not future.done():
+                future.set_result(None)
+
+        def done(future):
+            try:
+                loop.remove_reader(fd)
+            except (ValueError, OSError):
+                pass
+
+        loop.add_reader(fd, readable)
+        future.add_done_callback(done)
+        # Yielded instead of awaited: asyncio only accepts the futures marked as awaited
+        future._asyncio_future_blocking = True
+        return future
+
+class UAsyncio(types.ModuleType):
+    """
+        The uasyncio module of a simulated device
+    """
+
+    Event = asyncio.Event
+    Lock = asyncio.Lock
+    Task = asyncio.Task
+    TimeoutError = asyncio.TimeoutError
+    CancelledError = asyncio.CancelledError
+    ThreadSafeFlag = ThreadSafeFlag
+    StreamReader = Stream
+    StreamWriter = Stream
+    core = types.SimpleNamespace(_io_queue=_IOQueue())
+
+    def __init__(self, device):
+        super().__init__("uasyncio")
+        self._device = device
+        self._loop = None
+
+    def __getattr__(self, name):
+        return getattr(asyncio, name)
+
+    def get_event_loop(self, runq_len=0, waitq_len=0):
+        if self._loop is None:
+            self._loop = Loop(asyncio.get_event_loop())
+        return self._loop
+
+    def new_event_loop(self):
+        self._loop = Loop(asyncio.new_event_loop())
+        asyncio.set_event_loop(self._loop.loop)
+        return self._loop
+
+    def create_task(self, coro):
+        return asyncio.get_running_loop().create_task(as_coroutine(coro))
+
+    def current_task(self):
+        return asyncio.current_task()
+
+    def run(self, coro):
+        return self.get_event_loop().run_until_complete(coro)
+
+    async def sleep(self, t):
+        await asyncio.sleep(t)
+
+    async def sleep_ms(self, t):
+        await asyncio.sleep(t / 1000)
+
+    async def wait_for(self, aw, timeout):
+        return await asyncio.wait_for(as_coroutine(aw), timeout)
+
+    async def wait_for_ms(self, aw, timeout):
+        return await asyncio.wait_for(as_coroutine(aw), timeout / 1000)
+
+    async def gather(self, *aws, return_exceptions=False):
+        return await asyncio.gather(*(as_coroutine(aw) for aw in aws), return_exceptions=return_exceptions)
+
+    async def start_server(self, callback, host, port, backlog=5):
+        async def client_connected(reader, writer):
+            stream = Stream(reader, writer)
+            await callback(stream, stream)
+
+        return await asyncio.start_server(client_connected, self._device.bind_host(host), port, backlog=backlog)
+
+    async def open_connection(self, host, port):
+        reader, writer = await asyncio.open_connection(host, port, local_addr=(self._device.ip, 0))
+        stream = Stream(reader, writer)
+        return stream, stream
@@ -0,0 +1,100 @@
+#
+# Virtual filesystem of a simulated device: the micropython os module and the open() builtin,
+# mapping the device paths into a host directory
+#
+
+import builtins
+import os
+import posixpath
+import types
+
+_S_IFDIR = 0o040000
+_S_IFREG = 0o100000
+
+class DeviceOS(types.ModuleType):
+    """
+        The micropython os module of a simulated device
+    """
+
+    sep = "/"
+
+    def __init__(self, device):
+        super().__init__("os")
+        self._device = device
+        self._cwd = "/"
+        self._term = None
+
+    def host_path(self, path):
+        """
+            Map a device path to the host path, without being able to escape the device root
+        """
+        if isinstance(path, bytes):
+            path = path.decode()
+        path = posixpath.normpath(posixpath.join(self._cwd, path))
+        return os.path.join(self._device.root, path.lstrip("/"))
+
+    def open(self, path, mode="r", *args, **kwargs):
+        return builtins.open(self.host_path(path), mode, *args, **kwargs)
+
+    def getcwd(self):
+        return self._cwd
+
+    def chdir(self, path):
+        path = posixpath.normpath(posixpath.join(self._cwd, path))
+        if not os.path.isdir(self.host_path(path)):
+            raise OSError(2, "ENOENT")
+        self._cwd = path
+
+    def listdir(self, path=""):
+        return os.listdir(self.host_path(path))
+
+    def ilistdir(self, path=""):
+        with os.scandir(self.host_path(path)) as entries:
+            for entry in entries:
+                st = entry.stat()
+                yield (entry.name, _S_IFDIR if entry.is_dir() else _S_IFREG, st.st_ino, st.st_size)
+
+    def stat(self, path):
+        st = os.stat(self.host_path(path))
+        return (st.st_mode, st.st_ino, st.st_dev, st.st_nlink, st.st_uid, st.st_gid,
+                st.st_size, int(st.st_atime), int(st.st_mtime), int(st.st_ctime))
+
+    def statvfs(self, path):
+        return tuple(os.statvfs(self.host_path(path)))
+
+    def remove(self, path):
+        os.remove(self.host_path(path))
+
+    def rename(self, old_path, new_path):
+        os.rename(self.host_path(old_path), self.host_path(new_path))
+
+    def mkdir(self, path):
+        os.mkdir(self.host_path(path))
+
+    def rmdir(self, path):
+        os.rmdir(self.host_path(path))
+
+    def sync(self):
+        pass
+
+    def urandom(self, n):
+        return os.urandom(n)
+
+    def uname(self):
+        return types.SimpleNamespace(
+            sysname="sim",
+            nodename=self._device.host_name,
+            release="1.19.1",
+            version="micro-swarm simulator",
+            machine="CPython",
+        )
+
+    def dupterm(self, stream=None, index=0):
+        previous = self._term
+        self._term = stream
+        return previous
+
+    def dupterm_notify(self, obj):
+        # The terminal stream has data to read: feed the simulated repl
+        if self._term is not None:
+            self._device.repl.feed_from(self._term)
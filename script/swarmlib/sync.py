@@ -0,0 +1,141 @@
+#
+# Host side of the pipelined binary file sync (see boot/root/bootpkg/service_sync.py)
+#
+# The device tree is listed first (size and sha256 of each file), then all the operations
+# (deletes, mkdirs, changed files) are sent at once, while the replies are read.
+#
+
+import asyncio
+import os
+import struct
+import time
+
+def _op(kind, path, extra=b""):
+    path = path.encode()
+    return kind + struct.pack("<H", len(path)) + path + extra
+
+class SyncClient:
+    """
+        A connection to the sync service of a device
+    """
+
+    def __init__(self, ip, port, timeout=30):
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def connect(self):
+        async with asyncio.timeout(self.timeout):
+            (self.reader, self.writer) = await asyncio.open_connection(self.ip, self.port)
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+    async def list(self, root):
+        """
+            The tree under root on the device: ({relative path: (size, sha256 hex)}, set of relative directories)
+        """
+        self.writer.write(_op(b"L", root))
+        await self.writer.drain()
+        files = {}
+        dirs = set()
+        async with asyncio.timeout(self.timeout):
+            while True:
+                kind = await self.reader.readexactly(1)
+                if kind == b"e":
+                    return (files, dirs)
+                (length,) = struct.unpack("<H", await self.reader.readexactly(2))
+                path = (await self.reader.readexactly(length)).decode()
+                if kind == b"d":
+                    dirs.add(path)
+                else:
+                    (size,) = struct.unpack("<I", await self.reader.readexactly(4))
+                    files[path] = (size, (await self.reader.readexactly(32)).hex())
+
+    async def _read_replies(self, ops):
+        errors = []
+        for op in ops:
+            reply = await self.reader.readexactly(1)
+            if reply == b"X":
+                (length,) = struct.unpack("<H", await self.reader.readexactly(2))
+                errors.append(f"{op}: {(await self.reader.readexactly(length)).decode()}")
+            elif reply != b"K":
+                raise OSError(f"unexpected sync reply {reply!r}")
+        if await self.reader.readexactly(1) != b"E":
+            raise OSError("unexpected sync end reply")
+        return errors
+
+    async def mirror(self, local_dir, files, root):
+        """
+            Make the device directory root a copy of local_dir, whose files are given as dicts
+            with their path, size and sha256 (like the artifact manifest).
+            Returns the counts of the files sent, unchanged and deleted, of the directories created, the bytes sent,
+            and the durations of the listing and of the transfer.
+        """
+        stats = { "sent": 0, "unchanged": 0, "deleted": 0, "mkdirs": 0, "bytes": 0 }
+        start = time.monotonic()
+        (device_files, device_dirs) = await self.list(root)
+        stats["list_secs"] = time.monotonic() - start
+
+        wanted_dirs = set()
+        for f in files:
+            parts = f["path"].split("/")[:-1]
+            wanted_dirs.update("/".join(parts[0:i]) for i in range(1, len(parts) + 1))
+
+        ops = [ "mkdir" ]
+        frames = [ _op(b"M", root) ]
+        # Extra entries, the outermost only: directories are deleted with their content
+        local_files = set(f["path"] for f in files)
+        extra = set(p for p in device_files if p not in local_files) | (device_dirs - wanted_dirs)
+        for path in sorted(extra):
+            if not any(path.startswith(d + "/") for d in extra):
+                ops.append(f"delete {path}")
+                frames.append(_op(b"D", f"{root}/{path}"))
+                stats["deleted"] += 1
+        for path in sorted(wanted_dirs - device_dirs, key=lambda p: p.count("/")):
+            ops.append(f"mkdir {path}")
+            frames.append(_op(b"M", f"{root}/{path}"))
+            stats["mkdirs"] += 1
+        to_send = []
+        for f in files:
+            if device_files.get(f["path"]) == (f["size"], f["sha256"]):
+                stats["unchanged"] += 1
+            else:
+                to_send.append(f)
+
+        async def send():
+            for frame in frames:
+                self.writer.write(frame)
+            for f in to_send:
+                with open(os.path.join(local_dir, f["path"]), "rb") as local:
+                    data = local.read()
+                self.writer.write(_op(b"F", f"{root}/{f['path']}", struct.pack("<I", len(data)) + bytes.fromhex(f["sha256"])))
+                self.writer.write(data)
+                await self.writer.drain()
+                stats["sent"] += 1
+                stats["bytes"] += len(data)
+            self.writer.write(b"E\x00\x00")
+            await self.writer.drain()
+
+        ops += [f"write {f['path']}" for f in to_send]
+        total = sum(f["size"] for f in to_send)
+        start = time.monotonic()
+        async with asyncio.timeout(self.timeout + total / 10_000):
+            (_, errors) = await asyncio.gather(send(), self._read_replies(ops))
+        stats["transfer_secs"] = time.monotonic() - start
+        if errors:
+            raise OSError("sync failed: " + "; ".join(errors))
+        return stats